@@ -1,147 +1,533 @@
 import asyncio
+import collections
+import contextlib
+import json
 import logging
-from typing import List, Dict, Any
-from datetime import datetime
+import multiprocessing
+import os
+import socket
+import time
+import uuid
+from typing import List, Dict, Any, Optional
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import or_, text
 from sqlalchemy.orm import Session
-from . import models, crud, bgeigie_parser
+from . import models, crud, bgeigie_columnar, bgeigie_parser, db_writer, log_archives, upload_store
+from .config import settings
 from .database import SessionLocal
+from .knn_index import measurement_index
 
 logger = logging.getLogger(__name__)
 
+# Seconds between progress writes (which also renew the lease) while a handler runs
+PROGRESS_INTERVAL_SECONDS = 1.0
+
+# Job priorities; lower runs sooner. Waiting jobs age towards PRIORITY_HIGH (JOB_PRIORITY_AGING_SECONDS)
+PRIORITY_HIGH = 0     # Interactive work: re-processing, small uploads, notifications
+PRIORITY_NORMAL = 5
+PRIORITY_BULK = 10    # Backfills, e.g. every log of a multi-log .zip
+
+# Claims within this window count towards a user's share of the workers
+FAIRNESS_WINDOW = timedelta(days=1)
+
+
+class PermanentJobError(Exception):
+    """A job failure that retrying cannot fix; the job is dead-lettered straight away."""
+
+
 class BackgroundJobProcessor:
     """
     Background job processor for async file processing and notifications.
-    Uses FastAPI's async capabilities with DuckDB for efficient processing.
+    Jobs are rows in the jobs table: a worker claims one by taking a lease, renews the lease
+    while it runs, and on failure requeues it with exponential backoff until max_attempts,
+    after which it is dead-lettered. Queued and interrupted jobs survive restarts.
     """
     
     def __init__(self):
-        self.processing_queue = asyncio.Queue()
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.wakeup = asyncio.Event()
         self.is_running = False
+        self.running_jobs = set()
+        self.loop_task = None
+        self.parse_executor = None
+        self.parse_workers = 0
+        self.parse_slots = None
     
     async def start(self):
         """Start the background job processor."""
         if not self.is_running:
             self.is_running = True
-            asyncio.create_task(self._process_jobs())
+            # The event loop only coordinates; parsing runs in this pool and writes on the database writer
+            self.parse_workers = settings.JOB_PARSE_CONCURRENCY or os.cpu_count() or 1
+            if settings.JOB_PARSE_EXECUTOR == "process":
+                # Spawned workers do not inherit the parent's threads, sockets or database connections
+                self.parse_executor = ProcessPoolExecutor(max_workers=self.parse_workers,
+                                                          mp_context=multiprocessing.get_context('spawn'))
+            else:
+                self.parse_executor = ThreadPoolExecutor(max_workers=self.parse_workers,
+                                                         thread_name_prefix="job-parse")
+            self.parse_slots = asyncio.Semaphore(self.parse_workers)
+            await db_writer.write(None, self._recover_jobs)
+            self.loop_task = asyncio.create_task(self._process_jobs())
             logger.info("Background job processor started")
     
     async def stop(self):
         """Stop the background job processor."""
         self.is_running = False
+        if self.loop_task is not None:
+            self.loop_task.cancel()
+        # Interrupted jobs are requeued at the next start
+        if self.parse_executor is not None:
+            self.parse_executor.shutdown(wait=False, cancel_futures=True)
         logger.info("Background job processor stopped")
     
-    async def add_job(self, job_type: str, job_data: Dict[str, Any]):
-        """Add a job to the processing queue."""
-        job = {
-            "id": f"{job_type}_{datetime.utcnow().timestamp()}",
-            "type": job_type,
-            "data": job_data,
-            "created_at": datetime.utcnow(),
-            "status": "queued"
+    async def _parse(self, fn, *args, thread: bool = False):
+        """
+        Runs a parsing step in the parse pool, within the parse concurrency limit.
+        Stateful steps (advancing a decompressing stream) pass thread=True to stay in this process.
+        """
+        async with self.parse_slots:
+            if thread and isinstance(self.parse_executor, ProcessPoolExecutor):
+                return await asyncio.to_thread(fn, *args)
+            return await asyncio.get_running_loop().run_in_executor(self.parse_executor, fn, *args)
+    
+    async def add_job(self, job_type: str, job_data: Dict[str, Any], user_id: Optional[int] = None,
+                      idempotency_key: Optional[str] = None, priority: int = PRIORITY_NORMAL):
+        """
+        Add a job to the queue. A job with the same idempotency_key is only queued once;
+        later calls return the id of the existing job.
+        """
+        job_id = await db_writer.write(None, self._insert_job, job_type, job_data, user_id, idempotency_key, priority)
+        self.wakeup.set()
+        logger.info(f"Added job {job_id} to queue")
+        return job_id
+    
+    def _insert_job(self, db: Session, job_type: str, job_data: Dict[str, Any], user_id: Optional[int],
+                    idempotency_key: Optional[str], priority: int) -> str:
+        # Writes are serialised on the writer, so no other insert can slip in between check and insert
+        if idempotency_key is not None:
+            existing = db.query(models.Job.id).filter(models.Job.idempotency_key == idempotency_key).first()
+            if existing:
+                return existing.id
+        now = datetime.utcnow()
+        job = models.Job(
+            id=uuid.uuid4().hex,
+            type=job_type,
+            data=json.dumps(job_data, default=str),
+            user_id=user_id,
+            idempotency_key=idempotency_key,
+            status="queued",
+            priority=priority,
+            attempts=0,
+            max_attempts=settings.JOB_MAX_ATTEMPTS,
+            run_after=now,
+            insert_seconds=0.0,
+            created_at=now
+        )
+        db.add(job)
+        db.flush()
+        return job.id
+    
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """The job with the given id, or None if it is unknown."""
+        db = SessionLocal()
+        try:
+            job = db.query(models.Job).filter(models.Job.id == job_id).first()
+            return self._job_dict(job) if job else None
+        finally:
+            db.close()
+    
+    def _job_dict(self, job: models.Job) -> Dict[str, Any]:
+        return {
+            "id": job.id,
+            "type": job.type,
+            "data": json.loads(job.data or "{}"),
+            "user_id": job.user_id,
+            "status": job.status,
+            "priority": job.priority,
+            "attempts": job.attempts,
+            "max_attempts": job.max_attempts,
+            "run_after": job.run_after,
+            "progress": json.loads(job.progress or "{}"),
+            "insert_seconds": job.insert_seconds or 0.0,
+            "result": json.loads(job.result) if job.result else None,
+            "error": job.error,
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "completed_at": job.completed_at
         }
-        await self.processing_queue.put(job)
-        logger.info(f"Added job {job['id']} to queue")
-        return job["id"]
+    
+    def _recover_jobs(self, db: Session):
+        """
+        Requeues jobs left in processing by a previous run and purges old completed jobs.
+        DuckDB lets only one process open the database, so any processing job at startup
+        was interrupted by a restart or crash.
+        """
+        now = datetime.utcnow()
+        recovered = db.execute(text("""
+            UPDATE jobs SET status = 'queued', lease_owner = NULL, lease_expires_at = NULL, run_after = :now
+            WHERE status = 'processing'
+            RETURNING id
+        """), {"now": now}).fetchall()
+        db.execute(text("DELETE FROM jobs WHERE status = 'completed' AND completed_at < :cutoff"),
+                   {"cutoff": now - timedelta(days=settings.JOB_RETENTION_DAYS)})
+        for row in recovered:
+            logger.warning(f"Requeued interrupted job {row.id}")
+    
+    def _claim_job(self, db: Session) -> Optional[Dict[str, Any]]:
+        """
+        Leases the next due job (or one whose lease expired) to this worker.
+        Jobs are taken by aged priority first; within a priority level users take turns: the user
+        with the fewest running jobs, then the one served longest ago, goes next.
+        """
+        now = datetime.utcnow()
+        row = db.execute(text("""
+            UPDATE jobs
+            SET status = 'processing', lease_owner = :owner, lease_expires_at = :lease,
+                attempts = attempts + 1, started_at = COALESCE(started_at, :now), claimed_at = :now
+            WHERE id = (
+                WITH served AS (
+                    SELECT COALESCE(user_id, 0) AS uid,
+                           COUNT(*) FILTER (WHERE status = 'processing') AS running,
+                           MAX(claimed_at) AS last_claimed
+                    FROM jobs
+                    WHERE claimed_at >= :window_start OR status = 'processing'
+                    GROUP BY 1
+                )
+                SELECT j.id FROM jobs j LEFT JOIN served s ON COALESCE(j.user_id, 0) = s.uid
+                WHERE (j.status = 'queued' AND j.run_after <= :now)
+                   OR (j.status = 'processing' AND j.lease_expires_at < :now)
+                ORDER BY j.priority - date_diff('second', j.created_at, :now) // :aging,
+                         COALESCE(s.running, 0), s.last_claimed NULLS FIRST, j.created_at
+                LIMIT 1
+            )
+            RETURNING id
+        """), {"owner": self.worker_id, "now": now,
+               "lease": now + timedelta(seconds=settings.JOB_LEASE_SECONDS),
+               "window_start": now - FAIRNESS_WINDOW,
+               "aging": settings.JOB_PRIORITY_AGING_SECONDS}).first()
+        if row is None:
+            return None
+        return self._job_dict(db.query(models.Job).filter(models.Job.id == row.id).one())
+    
+    def queue_stats(self, user_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Queue depth and waiting times per user (one user's row if user_id is given).
+        Wait times of started jobs cover the FAIRNESS_WINDOW.
+        """
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            rows = db.execute(text("""
+                SELECT user_id,
+                       COUNT(*) FILTER (WHERE status = 'queued') AS queued,
+                       COUNT(*) FILTER (WHERE status = 'processing') AS processing,
+                       COUNT(*) FILTER (WHERE status = 'dead') AS dead,
+                       COUNT(*) FILTER (WHERE status = 'queued' AND priority <= :high) AS queued_high,
+                       COUNT(*) FILTER (WHERE status = 'queued' AND priority > :high AND priority < :bulk) AS queued_normal,
+                       COUNT(*) FILTER (WHERE status = 'queued' AND priority >= :bulk) AS queued_bulk,
+                       MAX(date_diff('millisecond', created_at, :now)) FILTER (WHERE status = 'queued') / 1000.0 AS oldest_queued_seconds,
+                       AVG(date_diff('millisecond', created_at, started_at)) FILTER (WHERE started_at >= :window_start) / 1000.0 AS avg_wait_seconds,
+                       MAX(date_diff('millisecond', created_at, started_at)) FILTER (WHERE started_at >= :window_start) / 1000.0 AS max_wait_seconds
+                FROM jobs
+                WHERE (:user_id IS NULL OR user_id = :user_id)
+                  AND (status IN ('queued', 'processing', 'dead') OR started_at >= :window_start)
+                GROUP BY user_id
+                ORDER BY queued DESC, user_id
+            """), {"now": now, "window_start": now - FAIRNESS_WINDOW, "user_id": user_id,
+                   "high": PRIORITY_HIGH, "bulk": PRIORITY_BULK}).mappings().all()
+            return [dict(row) for row in rows]
+        finally:
+            db.close()
+    
+    def _update_leased_job(self, job: Dict[str, Any], **values):
+        """Writes columns of a job this worker holds the lease on."""
+        db_writer.write_sync(None, self._write_leased_job, job["id"], values)
+    
+    def _write_leased_job(self, db: Session, job_id: str, values: Dict[str, Any]):
+        db.query(models.Job).filter(
+            models.Job.id == job_id, models.Job.lease_owner == self.worker_id
+        ).update(values)
+    
+    def report_progress(self, job: Dict[str, Any], force: bool = False):
+        """Persists the job's progress and renews its lease, at most once per PROGRESS_INTERVAL_SECONDS."""
+        now = time.monotonic()
+        if not force and now - job.get("_reported_at", 0.0) < PROGRESS_INTERVAL_SECONDS:
+            return
+        job["_reported_at"] = now
+        self._update_leased_job(
+            job,
+            progress=json.dumps(job["progress"]),
+            insert_seconds=job["insert_seconds"],
+            lease_expires_at=datetime.utcnow() + timedelta(seconds=settings.JOB_LEASE_SECONDS)
+        )
+    
+    def _finish_job(self, job: Dict[str, Any], result: Any):
+        self._update_leased_job(
+            job,
+            status="completed",
+            progress=json.dumps(job["progress"]),
+            insert_seconds=job["insert_seconds"],
+            result=json.dumps(result, default=str) if result is not None else None,
+            error=None,
+            lease_owner=None,
+            lease_expires_at=None,
+            completed_at=datetime.utcnow()
+        )
+    
+    def _fail_job(self, job: Dict[str, Any], error: Exception):
+        """Requeues a failed job with exponential backoff, or dead-letters it once it is out of attempts."""
+        now = datetime.utcnow()
+        values = {
+            "progress": json.dumps(job["progress"]),
+            "insert_seconds": job["insert_seconds"],
+            "error": f"{type(error).__name__}: {error}",
+            "lease_owner": None,
+            "lease_expires_at": None,
+        }
+        if isinstance(error, PermanentJobError) or job["attempts"] >= job["max_attempts"]:
+            logger.error(f"Job {job['id']} dead-lettered after {job['attempts']} attempt(s): {error}")
+            values.update(status="dead", completed_at=now)
+        else:
+            delay = min(settings.JOB_RETRY_BASE_SECONDS * 2 ** (job["attempts"] - 1), settings.JOB_RETRY_MAX_SECONDS)
+            logger.warning(f"Job {job['id']} failed (attempt {job['attempts']}), retrying in {delay}s: {error}")
+            values.update(status="queued", run_after=now + timedelta(seconds=delay))
+        self._update_leased_job(job, **values)
     
     async def _process_jobs(self):
-        """Main job processing loop."""
+        """Main job processing loop: claims due jobs up to JOB_CONCURRENCY and runs each as a task."""
         while self.is_running:
-            try:
-                # Wait for job with timeout
-                job = await asyncio.wait_for(
-                    self.processing_queue.get(), 
-                    timeout=1.0
-                )
-                
-                logger.info(f"Processing job {job['id']} of type {job['type']}")
-                job["status"] = "processing"
-                
-                # Process job based on type
-                if job["type"] == "process_bgeigie_import":
-                    await self._process_bgeigie_import(job)
-                elif job["type"] == "send_notification":
-                    await self._send_notification(job)
-                elif job["type"] == "validate_measurements":
-                    await self._validate_measurements(job)
-                
-                job["status"] = "completed"
-                job["completed_at"] = datetime.utcnow()
-                logger.info(f"Completed job {job['id']}")
-                
-            except asyncio.TimeoutError:
-                # No jobs in queue, continue
+            job = None
+            if len(self.running_jobs) < settings.JOB_CONCURRENCY:
+                try:
+                    job = await db_writer.write(None, self._claim_job)
+                except Exception as e:
+                    logger.error(f"Error claiming job: {e}")
+            if job is None:
+                # Nothing due or no free slot; wait for a new or finished job, or poll again for retries coming due
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    pass
                 continue
+            
+            task = asyncio.create_task(self._run_job(job))
+            self.running_jobs.add(task)
+            task.add_done_callback(self._job_done)
+    
+    def _job_done(self, task: asyncio.Task):
+        self.running_jobs.discard(task)
+        self.wakeup.set()
+    
+    async def _run_job(self, job: Dict[str, Any]):
+        logger.info(f"Processing job {job['id']} of type {job['type']} (attempt {job['attempts']})")
+        try:
+            # Process job based on type
+            if job["type"] == "process_bgeigie_import":
+                result = await self._process_bgeigie_import(job)
+            elif job["type"] == "send_notification":
+                result = await self._send_notification(job)
+            elif job["type"] == "validate_measurements":
+                result = await self._validate_measurements(job)
+            else:
+                raise PermanentJobError(f"Unknown job type {job['type']}")
+            await asyncio.to_thread(self._finish_job, job, result)
+            logger.info(f"Completed job {job['id']}")
+        except Exception as e:
+            logger.error(f"Error processing job {job['id']}: {e}")
+            try:
+                await asyncio.to_thread(self._fail_job, job, e)
             except Exception as e:
-                logger.error(f"Error processing job: {e}")
-                if 'job' in locals():
-                    job["status"] = "failed"
-                    job["error"] = str(e)
+                logger.error(f"Error recording failure of job {job['id']}: {e}")
     
     async def _process_bgeigie_import(self, job: Dict[str, Any]):
         """Process a bGeigie import file asynchronously."""
-        import_id = job["data"]["import_id"]
+        bgeigie_import = await self._ingest_bgeigie_import(job)
+        # Approved measurements may have been replaced (auto-approval, or a reparse shared with an approved import)
+        measurement_index.request_sync()
+        if bgeigie_import is not None:
+            # Queue notification job; keyed on this job so a retried import notifies once
+            await self.add_job("send_notification", {
+                "type": "import_processed",
+                "import_id": bgeigie_import["id"],
+                "user_id": bgeigie_import["user_id"],
+                "status": bgeigie_import["status"],
+                "source": bgeigie_import["source"],
+                "email": job["data"].get("notify_email", False)
+            }, user_id=bgeigie_import["user_id"], idempotency_key=f"notify:{job['id']}", priority=PRIORITY_HIGH)
+        return bgeigie_import
+    
+    async def _ingest_bgeigie_import(self, job: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Parses an import's stored log and inserts its measurements, recording progress on the job.
+        Parsing of the next batch overlaps the insert of the current one. Returns the import's
+        id, user_id and status when measurements were found, else None.
+        Safe to re-run: measurements left by an interrupted attempt are deleted first.
+        """
+        source = await db_writer.write(None, self._prepare_import, job, bulk=True)
+        if source is None:
+            return None
+        file_path, archive_member, measurements_import_id = source
         
-        db = SessionLocal()
+        stats = bgeigie_parser.ParseStats()
+        totals = {"count": 0, "valid_gps": 0, "max_cpm": 0}
+        job["insert_seconds"] = 0.0
+        job["progress"].update(lines_parsed=0, rows_inserted=0, bytes_read=0)
         try:
-            # Get the import record
-            bgeigie_import = db.query(models.BGeigieImport).filter(
-                models.BGeigieImport.id == import_id
-            ).first()
-            
-            if not bgeigie_import:
-                raise ValueError(f"Import {import_id} not found")
-            
-            # Read file from disk
-            file_path = f"uploads/{bgeigie_import.source}"
-            with open(file_path, 'r', encoding='utf-8') as f:
-                file_content = f.read()
-            
-            # Parse measurements
-            measurements_data = bgeigie_parser.parse_bgeigie_log(file_content)
-            
-            # Filter and validate measurements
-            filtered_measurements = []
-            for m in measurements_data:
-                if self._is_valid_measurement(m):
-                    filtered_measurements.append({
-                        'cpm': m['cpm'],
-                        'latitude': m['latitude'],
-                        'longitude': m['longitude'],
-                        'captured_at': m['captured_at'],
-                    })
+            async with contextlib.aclosing(self._parse_stored_log(file_path, archive_member, stats)) as batches:
+                async for batch in batches:
+                    # Each batch is its own transaction on the writer, so small writes are not held up behind a whole log
+                    await db_writer.write(None, self._insert_batch, job, measurements_import_id, batch, stats, totals,
+                                         bulk=True)
+        except FileNotFoundError as e:
+            raise PermanentJobError(f"Stored log missing: {e}")
+        except (UnicodeDecodeError,) + log_archives.DECOMPRESSION_ERRORS as e:
+            raise PermanentJobError(f"Unreadable log: {e}")
+        
+        return await db_writer.write(None, self._complete_import, job, stats, totals)
+    
+    async def _parse_stored_log(self, file_path: str, archive_member: Optional[str], stats: bgeigie_parser.ParseStats):
+        """
+        Yields batches of measurements from a stored log as column arrays (see bgeigie_columnar),
+        keeping parse work queued ahead of the caller. Plain logs are cut into line ranges parsed side
+        by side in the parse pool (merged back in file order); compressed logs are a single stream,
+        advanced one block ahead on a thread.
+        """
+        if archive_member is None and log_archives.sniff_format(file_path) == log_archives.PLAIN:
+            ranges = iter(bgeigie_parser.split_line_ranges(file_path))
+            pending = collections.deque()
+            try:
+                for start, end in ranges:
+                    pending.append(asyncio.ensure_future(self._parse(bgeigie_columnar.parse_column_range, file_path, start, end)))
+                    if len(pending) > self.parse_workers:
+                        break
+                while pending:
+                    columns, counters = await pending.popleft()
+                    for start, end in ranges:
+                        pending.append(asyncio.ensure_future(self._parse(bgeigie_columnar.parse_column_range, file_path, start, end)))
+                        break
+                    bgeigie_parser.merge_range_stats(stats, counters)
+                    if len(columns['cpm']):
+                        yield columns
+            finally:
+                for future in pending:
+                    future.cancel()
+            return
+        
+        step = None
+        with log_archives.open_log(file_path, archive_member) as stream:
+            batches = bgeigie_columnar.iter_bgeigie_column_batches(stream, stats)
+            try:
+                step = asyncio.ensure_future(self._parse(next, batches, None, thread=True))
+                while True:
+                    batch = await step
+                    if batch is None:
+                        break
+                    step = asyncio.ensure_future(self._parse(next, batches, None, thread=True))
+                    yield batch
+            finally:
+                # Let a step in flight finish before the stream is closed under it
+                if step is not None and not step.done():
+                    await asyncio.gather(step, return_exceptions=True)
+    
+    def _prepare_import(self, db: Session, job: Dict[str, Any]):
+        """
+        Looks up the import and clears measurements from earlier attempts; returns its
+        (file_path, archive_member, measurements_import_id) or None to skip.
+        """
+        import_id = job["data"]["import_id"]
+        bgeigie_import = db.query(models.BGeigieImport).filter(
+            models.BGeigieImport.id == import_id
+        ).first()
+        
+        if not bgeigie_import:
+            raise PermanentJobError(f"Import {import_id} not found")
+        
+        # Imports that moved on in the approval workflow are only reprocessed when a user asks for it
+        if bgeigie_import.status in ("submitted", "approved", "rejected") and not job["data"].get("force"):
+            logger.info(f"Import {import_id} is already {bgeigie_import.status}; nothing to do")
+            return None
+        # A re-upload sharing measurements parsed in the meantime has their results already
+        if bgeigie_import.parsed_at is not None and not job["data"].get("force"):
+            logger.info(f"Import {import_id} is already parsed; nothing to do")
+            return None
+        
+        # Re-uploads of the same bytes share one set of measurements, parsed again for all of them
+        measurements_import_id = bgeigie_import.measurements_import_id
+        # Start from a clean slate in case an earlier attempt inserted part of the log
+        if crud.measurements_on_map(db, measurements_import_id):
+            # Out of the approved data until parsed again, as the new measurements are not in the grid
+            crud.record_measurements_change(db, measurements_import_id, False)
+        if bgeigie_import.status == "approved":
+            bgeigie_import.status = "unprocessed"
+        db.execute(text("DELETE FROM measurements WHERE bgeigie_import_id = :import_id"),
+                   {"import_id": measurements_import_id})
+        db.commit()
+        return upload_store.import_file_path(bgeigie_import), bgeigie_import.archive_member, measurements_import_id
+    
+    def _insert_batch(self, db: Session, job: Dict[str, Any], measurements_import_id: int,
+                      batch: Dict[str, np.ndarray], stats: bgeigie_parser.ParseStats, totals: Dict[str, int]):
+        """Filters a parsed batch of column arrays and bulk inserts it, then records progress on the job."""
+        # Filter and validate measurements
+        keep = self._valid_measurements(batch)
+        count = int(np.count_nonzero(keep))
+        if count:
+            filtered = {name: values[keep] for name, values in batch.items()}
+            # Create measurement records in one bulk insert
+            started = time.perf_counter()
+            crud.bulk_insert_measurements(db, filtered, bgeigie_import_id=measurements_import_id)
+            job["insert_seconds"] += time.perf_counter() - started
+            totals["count"] += count
+            totals["max_cpm"] = max(totals["max_cpm"], int(filtered['cpm'].max()))
+            totals["valid_gps"] += int(np.count_nonzero(self._valid_gps(filtered)))
+        job["progress"].update(lines_parsed=stats.lines_read, rows_inserted=totals["count"], bytes_read=stats.bytes_read)
+        self.report_progress(job)
+    
+    def _complete_import(self, db: Session, job: Dict[str, Any], stats: bgeigie_parser.ParseStats,
+                         totals: Dict[str, int]) -> Optional[Dict[str, Any]]:
+        """Stores the parse results on the import once every batch is inserted."""
+        from .routers.bgeigie_imports import should_auto_approve_counts
+        import_id = job["data"]["import_id"]
+        count = totals["count"]
+        job["progress"].update(lines_parsed=stats.lines_read, rows_inserted=count, bytes_read=stats.bytes_read)
+        
+        bgeigie_import = db.query(models.BGeigieImport).filter(models.BGeigieImport.id == import_id).one()
+        bgeigie_import.parse_report = json.dumps(stats.report.as_dict())
+        bgeigie_import.lines_count = stats.lines_read
+        bgeigie_import.measurements_count = count
+        bgeigie_import.parsed_at = datetime.utcnow()
+        
+        # Re-uploads of the same bytes share the measurements, and so the parse results
+        measurements_import_id = bgeigie_import.measurements_import_id
+        group = crud.get_import_group_ids(db, measurements_import_id)
+        for other in db.query(models.BGeigieImport).filter(models.BGeigieImport.id.in_(group),
+                                                           models.BGeigieImport.id != import_id):
+            crud.copy_parse_results(bgeigie_import, other)
+        # Back in the approved data at once if another import sharing them is approved
+        if crud.measurements_on_map(db, measurements_import_id, excluding=import_id):
+            crud.record_measurements_change(db, measurements_import_id, True)
+        
+        if count:
+            # Update import status
+            bgeigie_import.status = "processed"
             
-            if filtered_measurements:
-                # Create measurement records
-                crud.create_measurements(
-                    db=db, 
-                    measurements=filtered_measurements, 
-                    bgeigie_import_id=import_id
-                )
-                
-                # Update import status
-                max_cpm = max([m['cpm'] for m in filtered_measurements])
-                bgeigie_import.measurements_count = len(filtered_measurements)
-                bgeigie_import.status = "processed"
-                
-                # Check for auto-approval
-                from .routers.bgeigie_imports import should_auto_approve
-                if should_auto_approve(filtered_measurements, max_cpm):
-                    bgeigie_import.status = "approved"
-                    bgeigie_import.approved_at = datetime.utcnow()
-                    bgeigie_import.approved_by = "auto-approval"
-                
-                db.commit()
-                
-                # Queue notification job
-                await self.add_job("send_notification", {
-                    "type": "import_processed",
-                    "import_id": import_id,
-                    "user_id": bgeigie_import.user_id,
-                    "status": bgeigie_import.status
-                })
+            # Check for auto-approval (uploads leave it off to preserve the metadata workflow)
+            if job["data"].get("auto_approve", True) and should_auto_approve_counts(count, totals["valid_gps"], totals["max_cpm"]):
+                bgeigie_import.status = "approved"
+                bgeigie_import.approved_at = datetime.utcnow()
+                bgeigie_import.approved_by = "auto-approval"
+                crud.record_approval_change(db, import_id, True)
             
-        finally:
-            db.close()
+            db.commit()
+            return {"id": import_id, "user_id": bgeigie_import.user_id, "status": bgeigie_import.status,
+                    "source": bgeigie_import.source, "measurements_count": count}
+        else:
+            # Nothing usable, but keep the parse report
+            db.commit()
+            return None
     
     async def _send_notification(self, job: Dict[str, Any]):
         """Send notification (placeholder for email/webhook integration)."""
@@ -150,8 +536,32 @@ class BackgroundJobProcessor:
         # Log notification (in production, integrate with email service)
         logger.info(f"Notification: {notification_data['type']} for user {notification_data.get('user_id')}")
         
-        # Simulate async notification sending
-        await asyncio.sleep(0.1)
+        if notification_data['type'] == "import_processed" and notification_data.get("email"):
+            from .email_service import send_bgeigie_notification_email
+            user = await asyncio.to_thread(self._get_user, notification_data["user_id"])
+            if user is not None:
+                # Send email notification to the import owner
+                try:
+                    await send_bgeigie_notification_email(
+                        recipient_email=user["email"],
+                        recipient_name=user["name"] or user["email"],
+                        action="processed",
+                        import_id=notification_data["import_id"],
+                        import_filename=notification_data.get("source")
+                    )
+                except Exception as e:
+                    logger.warning(f"Failed to send processing email: {e}")
+        else:
+            # Simulate async notification sending
+            await asyncio.sleep(0.1)
+    
+    def _get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            user = db.query(models.User).filter(models.User.id == user_id).first()
+            return {"email": user.email, "name": user.name} if user else None
+        finally:
+            db.close()
     
     async def _validate_measurements(self, job: Dict[str, Any]):
         """Validate measurement data quality."""
@@ -179,30 +589,22 @@ class BackgroundJobProcessor:
         logger.info(f"Validation results: {validation_results}")
         return validation_results
     
-    def _is_valid_measurement(self, measurement: Dict[str, Any]) -> bool:
-        """Validate individual measurement data."""
-        try:
-            # Check required fields
-            if not all(key in measurement for key in ['cpm', 'latitude', 'longitude', 'captured_at']):
-                return False
-            
-            # Validate CPM range
-            if not (0 <= measurement['cpm'] <= 50000):
-                return False
-            
-            # Validate GPS coordinates
-            lat, lon = measurement['latitude'], measurement['longitude']
-            if not (-90 <= lat <= 90 and -180 <= lon <= 180):
-                return False
-            
-            # Check for zero coordinates (invalid GPS)
-            if abs(lat) < 0.001 and abs(lon) < 0.001:
-                return False
-            
-            return True
-            
-        except (KeyError, TypeError, ValueError):
-            return False
+    @staticmethod
+    def _valid_measurements(columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """Mask of the measurements with a plausible CPM and a non-zero position in range."""
+        cpm, lat, lon = columns['cpm'], columns['latitude'], columns['longitude']
+        return (
+            (cpm >= 0) & (cpm <= 50000)
+            & (lat >= -90) & (lat <= 90) & (lon >= -180) & (lon <= 180)
+            # Zero coordinates mean no GPS fix
+            & ~((np.abs(lat) < 0.001) & (np.abs(lon) < 0.001))
+        )
+    
+    @staticmethod
+    def _valid_gps(columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """Whether each measurement carries a plausible, non-zero GPS fix."""
+        lat, lon = columns['latitude'], columns['longitude']
+        return (np.abs(lat) > 0.001) & (np.abs(lon) > 0.001) & (lat >= -90) & (lat <= 90) & (lon >= -180) & (lon <= 180)
 
 # Global background processor instance
 background_processor = BackgroundJobProcessor()
@@ -215,11 +617,57 @@ async def stop_background_processor():
     """Stop the global background processor."""
     await background_processor.stop()
 
-async def queue_bgeigie_processing(import_id: int):
-    """Queue a bGeigie import for background processing."""
+async def queue_bgeigie_processing(import_id: int, user_id: Optional[int] = None, auto_approve: bool = True,
+                                   priority: int = PRIORITY_NORMAL):
+    """Queue a freshly uploaded bGeigie import for background processing (once per import)."""
     return await background_processor.add_job("process_bgeigie_import", {
-        "import_id": import_id
-    })
+        "import_id": import_id,
+        "auto_approve": auto_approve
+    }, user_id=user_id, idempotency_key=f"process_bgeigie_import:{import_id}", priority=priority)
+
+def get_active_import_job(db: Session, import_id: int) -> Optional[str]:
+    """
+    Id of a parse job queued or running for the import, or for another import sharing its
+    measurements (whose parse it waits for), if there is one.
+    """
+    bgeigie_import = db.query(models.BGeigieImport).filter(models.BGeigieImport.id == import_id).first()
+    if bgeigie_import is None:
+        return None
+    keys = [f"process_bgeigie_import:{i}" for i in crud.get_import_group_ids(db, bgeigie_import.measurements_import_id)]
+    active = db.query(models.Job.id).filter(
+        models.Job.type == "process_bgeigie_import",
+        or_(models.Job.idempotency_key.in_(keys), *(models.Job.idempotency_key.like(f"{key}:%") for key in keys)),
+        models.Job.status.in_(("queued", "processing"))
+    ).order_by(models.Job.created_at).first()
+    return active.id if active else None
+
+async def queue_bgeigie_reprocessing(import_id: int, user_id: Optional[int] = None):
+    """
+    Queue an interactive re-processing of an import at high priority, emailing the owner when done.
+    Returns the id of a job already queued or running for the import instead of queueing another.
+    """
+    db = SessionLocal()
+    try:
+        active = get_active_import_job(db, import_id)
+    finally:
+        db.close()
+    if active:
+        return active
+    return await background_processor.add_job("process_bgeigie_import", {
+        "import_id": import_id,
+        "auto_approve": False,
+        "force": True,
+        "notify_email": True
+    }, user_id=user_id, idempotency_key=f"process_bgeigie_import:{import_id}:{uuid.uuid4().hex}",
+        priority=PRIORITY_HIGH)
+
+def get_queue_stats(user_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Per-user queue depth and waiting times."""
+    return background_processor.queue_stats(user_id)
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Look up a job by id."""
+    return background_processor.get_job(job_id)
 
 async def queue_notification(notification_type: str, **kwargs):
     """Queue a notification for sending."""
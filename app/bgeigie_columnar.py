@@ -0,0 +1,441 @@
+"""
+Columnar bGeigie parse engine.
+
+Parses a whole log buffer at once with NumPy and returns column arrays instead of
+one dict per line. Line splitting, checksums (via a prefix XOR), field boundaries,
+DDMM.MMMM coordinates, CPM, altitude, GPS validity, HDOP and ISO timestamps are
+decoded in bulk over the raw bytes, at the field positions of each header's
+bgeigie_parser.SentenceDecoder. Rows outside the common shapes (non-ASCII bytes, stray
+whitespace, several '*' or '$', unusual number formats) are handed to
+bgeigie_parser.parse_bgeigie_line, so the output is always identical to the
+scalar parser.
+
+Import jobs parse stored logs with this engine (see background_tasks): plain logs as
+newline-aligned byte ranges (parse_column_range), compressed ones as a stream of blocks
+(iter_bgeigie_column_batches).
+"""
+import datetime
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .bgeigie_parser import BAD_CHECKSUM, BAD_HEADER, DECODERS, ParseStats, decode_bgeigie_line
+
+COLUMN_DTYPES = {
+    'cpm': np.dtype(np.int32),
+    'latitude': np.dtype(np.float64),
+    'longitude': np.dtype(np.float64),
+    'captured_at': np.dtype('datetime64[us]'),
+    'altitude': np.dtype(np.float64),
+    'gps_valid': np.dtype(bool),
+    'hdop': np.dtype(np.float32),
+}
+
+# The buffer is processed in newline-aligned blocks to bound temporary arrays
+BLOCK_BYTES = 4 * 1024 * 1024
+# Numeric fields wider than this take the scalar path (keeps mantissas exact in int64)
+MAX_NUMBER_WIDTH = 17
+
+# Zero bytes appended to each block so fixed-width windows never run off the end
+_PADDING = 32
+
+_ALL_ONES = np.uint64(0xFFFFFFFFFFFFFFFF)
+_HEX = np.frombuffer(b'0123456789ABCDEF', dtype=np.uint8)
+_INT_POW10 = 10 ** np.arange(19, dtype=np.int64)
+_FLOAT_POW10 = 10.0 ** np.arange(23)
+_DAYS_IN_MONTH = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31], dtype=np.int64)
+_TIMESTAMP_DIGITS = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]
+_SEPARATOR_COLUMNS = [4, 7, 10, 13, 16, 19]
+_SEPARATORS = np.frombuffer(b'--T::Z', dtype=np.uint8)
+
+
+def empty_columns() -> Dict[str, np.ndarray]:
+    return {name: np.empty(0, dtype=dtype) for name, dtype in COLUMN_DTYPES.items()}
+
+
+def _window(a: np.ndarray, start: np.ndarray, width: int) -> np.ndarray:
+    """(n, width) byte window starting at each position; a carries _PADDING zero bytes at the end."""
+    return sliding_window_view(a, width)[start]
+
+
+def _count_between(positions: np.ndarray, start: np.ndarray, end: np.ndarray) -> np.ndarray:
+    """Number of sorted positions falling in [start, end) for every row."""
+    return np.searchsorted(positions, end) - np.searchsorted(positions, start)
+
+
+def _xor_range(a: np.ndarray, start: np.ndarray, end: np.ndarray) -> np.ndarray:
+    """XOR of the bytes a[start:end] for every row, from a prefix XOR over 8-byte words."""
+    words = a[:len(a) // 8 * 8].view('<u8')
+    prefix = np.bitwise_xor.accumulate(words)
+    first, last = start >> 3, end >> 3
+    head = words[first] & (_ALL_ONES << ((start & 7) << 3).astype(np.uint64))
+    tail = np.where(last < len(words), words[np.minimum(last, len(words) - 1)], 0) & ~(_ALL_ONES << ((end & 7) << 3).astype(np.uint64))
+    # Whole words strictly between the first and the last one
+    middle = np.where(last > first + 1, prefix[np.maximum(last - 1, 0)] ^ prefix[first], 0)
+    x = np.where(last > first, head ^ middle ^ tail, head & tail)
+    x ^= x >> np.uint64(32)
+    x ^= x >> np.uint64(16)
+    x ^= x >> np.uint64(8)
+    return (x & np.uint64(0xFF)).astype(np.intp)
+
+
+class _Number:
+    """Decoded shape of a numeric field: -?D+(.D*)? with an exact int64 mantissa."""
+
+    def __init__(self, a: np.ndarray, start: np.ndarray, end: np.ndarray):
+        n = len(start)
+        length = end - start
+        width = int(min(length.max(initial=0), MAX_NUMBER_WIDTH + 2))
+        self.length = length
+        if width == 0:
+            self.mantissa = np.zeros(n, dtype=np.int64)
+            self.int_digits = self.frac_digits = np.zeros(n, dtype=np.int64)
+            self.negative = np.zeros(n, dtype=bool)
+            self.ok = np.zeros(n, dtype=bool)
+            self.first = np.zeros(n, dtype=np.uint8)
+            return
+        window = _window(a, start, width)
+        self.first = window[:, 0]
+        self.negative = self.first == ord('-')
+        values = window - np.uint8(ord('0'))
+        # Column by column: count digits and dots, note the dot, and run Horner's rule over the digits
+        mantissa = np.zeros(n, dtype=np.int64)
+        digits = np.zeros(n, dtype=np.int64)
+        dots = np.zeros(n, dtype=np.int64)
+        dot_pos = length.copy()
+        for col in range(width):
+            inside = col < length
+            is_digit = (values[:, col] <= 9) & inside
+            is_dot = (window[:, col] == ord('.')) & inside
+            digits += is_digit
+            dots += is_dot
+            dot_pos[is_dot & (dots == 1)] = col
+            np.multiply(mantissa, 10, out=mantissa, where=is_digit)
+            np.add(mantissa, values[:, col], out=mantissa, where=is_digit)
+        dot_pos = np.where(dots == 1, dot_pos, length)
+        self.int_digits = dot_pos - self.negative
+        self.frac_digits = digits - self.int_digits
+        self.ok = (
+            (length <= width) & (dots <= 1) & (self.int_digits >= 1)
+            & (digits + dots + self.negative == length) & (digits <= MAX_NUMBER_WIDTH)
+        )
+        self.mantissa = mantissa
+
+    def value(self) -> np.ndarray:
+        """float(field), exact because mantissa and 10**k are exact and IEEE division rounds correctly."""
+        value = self.mantissa.astype(np.float64) / _FLOAT_POW10[np.clip(self.frac_digits, 0, 22)]
+        return np.where(self.negative, -value, value)
+
+
+def _ddm_to_dd(a, start, end, direction_start, direction_end):
+    """Vectorized bgeigie_parser.ddm_to_dd; returns (degrees, ok). Empty fields give 0.0."""
+    number = _Number(a, start, end)
+    # Keep the scaled minutes below 2**53 so their float conversion is exact
+    ok = number.ok & ~number.negative & (number.int_digits >= 3) & (number.frac_digits >= 1) & (number.frac_digits <= 12)
+    scale = _INT_POW10[np.clip(number.frac_digits, 0, 18)]
+    degrees = number.mantissa // scale // 100
+    minutes = (number.mantissa - degrees * 100 * scale).astype(np.float64) / _FLOAT_POW10[np.clip(number.frac_digits, 0, 22)]
+    dd = degrees.astype(np.float64) + minutes / 60
+    direction = a[direction_start]
+    south_or_west = (direction_end - direction_start == 1) & ((direction == ord('S')) | (direction == ord('W')))
+    dd = np.where(south_or_west, dd * -1, dd)
+    empty = number.length == 0
+    return np.where(empty, 0.0, dd), ok | empty
+
+
+def _parse_timestamps(a, start, end):
+    """Parses YYYY-MM-DDTHH:MM:SSZ fields into datetime64[us]; returns (values, ok)."""
+    window = _window(a, start, 20)
+    digits = window[:, _TIMESTAMP_DIGITS] - np.uint8(ord('0'))
+    ok = (end - start == 20) & np.all(digits <= 9, axis=1) & np.all(window[:, _SEPARATOR_COLUMNS] == _SEPARATORS, axis=1)
+    digits = digits.astype(np.int64)
+    year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    month = digits[:, 4] * 10 + digits[:, 5]
+    day = digits[:, 6] * 10 + digits[:, 7]
+    seconds = ((digits[:, 8] * 10 + digits[:, 9]) * 60 + digits[:, 10] * 10 + digits[:, 11]) * 60
+    seconds += digits[:, 12] * 10 + digits[:, 13]
+    leap = ((year % 4 == 0) & (year % 100 != 0)) | (year % 400 == 0)
+    days_in_month = _DAYS_IN_MONTH[np.clip(month, 0, 12)] + (leap & (month == 2))
+    ok &= (year >= 1) & (month >= 1) & (month <= 12) & (day >= 1) & (day <= days_in_month)
+    ok &= (digits[:, 8] * 10 + digits[:, 9] < 24) & (digits[:, 10] < 6) & (digits[:, 12] < 6)
+    months = np.where(ok, (year - 1970) * 12 + month - 1, 0).astype('timedelta64[M]')
+    dates = (np.datetime64('1970-01', 'M') + months).astype('datetime64[D]')
+    dates = dates + np.where(ok, day - 1, 0).astype('timedelta64[D]')
+    values = dates.astype('datetime64[us]') + (np.where(ok, seconds, 0) * 1_000_000).astype('timedelta64[us]')
+    return values, ok
+
+
+def _match_headers(a: np.ndarray, starts: np.ndarray, length: np.ndarray, decoders: list) -> np.ndarray:
+    """Index into decoders of the sentence header ('$XXXX,') each line starts with, or -1."""
+    header_id = np.full(len(starts), -1, dtype=np.intp)
+    head = _window(a, starts, 8).view('<u8')[:, 0]
+    for i, decoder in enumerate(decoders):
+        prefix = (decoder.header + ',').encode('ascii')
+        if len(prefix) <= 8:
+            # One AND and compare against the little-endian word of the prefix
+            word = np.uint64(int.from_bytes(prefix, 'little'))
+            mask = np.uint64((1 << (8 * len(prefix))) - 1)
+            match = (head & mask) == word
+        else:
+            match = np.all(_window(a, starts, len(prefix)) == np.frombuffer(prefix, dtype=np.uint8), axis=1)
+        header_id[match & (length >= len(prefix))] = i
+    return header_id
+
+
+def _layout(decoders: list, name: str, header_id: np.ndarray) -> np.ndarray:
+    """Per-row field index of a SentenceDecoder attribute, -1 where the format has no such field."""
+    table = np.array([-1 if getattr(d, name) is None else getattr(d, name) for d in decoders], dtype=np.intp)
+    return table[header_id]
+
+
+def _naive_utc(captured_at: datetime.datetime) -> datetime.datetime:
+    if captured_at.tzinfo is not None:
+        return captured_at.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return captured_at
+
+
+def _fallback_row(line: bytes) -> Tuple[Optional[tuple], Optional[str]]:
+    """
+    Parses one irregular row with the scalar parser; returns (column tuple, None) or (None, drop reason).
+    The values fit COLUMN_DTYPES: the scalar parser drops CPMs over MAX_CPM.
+    """
+    measurement, reason = decode_bgeigie_line(line.decode('utf-8'))
+    if measurement is None:
+        return None, reason
+    captured_at = _naive_utc(measurement['captured_at'])
+    altitude = measurement['altitude']
+    hdop = measurement['hdop']
+    return (
+        measurement['cpm'],
+        measurement['latitude'],
+        measurement['longitude'],
+        np.datetime64(captured_at, 'us'),
+        np.nan if altitude is None else altitude,
+        measurement['gps_valid'],
+        np.nan if hdop is None else hdop,
+    ), None
+
+
+def _parse_block(block: memoryview, stats: ParseStats) -> Dict[str, np.ndarray]:
+    data = np.frombuffer(block, dtype=np.uint8)
+    size = len(data)
+    a = np.zeros(size + _PADDING, dtype=np.uint8)
+    a[:size] = data
+    # One pass over the bytes finds every structural character: all of them sort below '-'
+    special = np.flatnonzero((data < ord('-')) | (data > 0x7E))
+    kinds = data[special]
+    newlines = special[kinds == ord('\n')]
+    starts = np.concatenate(([0], newlines + 1))
+    raw_ends = np.concatenate((newlines, [size]))
+    if starts[-1] == size:
+        starts, raw_ends = starts[:-1], raw_ends[:-1]
+    # Report line numbers are 1-based across the whole buffer
+    first_line = stats.lines_read + 1
+    stats.lines_read += len(starts)
+    if len(starts) == 0:
+        return empty_columns()
+
+    # Drop one trailing '\r'; anything else outside printable ASCII goes to the scalar path
+    ends = raw_ends - ((raw_ends > starts) & (a[np.maximum(raw_ends - 1, 0)] == ord('\r')))
+    length = ends - starts
+    irregular_pos = special[((kinds < 0x20) & (kinds != ord('\n'))) | (kinds > 0x7E)]
+    first = a[starts]
+    last = a[np.maximum(ends - 1, 0)]
+    nonblank = length > 0
+    irregular = nonblank & ((first == ord(' ')) | (last == ord(' ')))
+    if len(irregular_pos):
+        irregular |= nonblank & (_count_between(irregular_pos, starts, ends) > 0)
+
+    decoders = list(DECODERS.values())
+    header_id = _match_headers(a, starts, length, decoders)
+    header = header_id >= 0
+
+    star_pos = special[kinds == ord('*')]
+    first_star_idx = np.searchsorted(star_pos, starts)
+    stars = np.searchsorted(star_pos, ends) - first_star_idx
+    star = np.where(stars > 0, star_pos[np.minimum(first_star_idx, max(len(star_pos) - 1, 0))] if len(star_pos) else 0, ends)
+    fallback = irregular | (header & (stars > 1))
+    # Every header starts with '$', so any extra '$' shows up as a surplus over the header count
+    dollar_pos = special[kinds == ord('$')]
+    if len(dollar_pos) != np.count_nonzero(header):
+        fallback |= header & (_count_between(dollar_pos, starts, ends) != 1)
+
+    # Checksum: XOR of the bytes between '$' and '*'; exactly two hex digits follow
+    checksum = _xor_range(a, starts + 1, np.maximum(star, starts + 1))
+    hi = a[star + 1]
+    lo = a[star + 2]
+    valid = (
+        header & ~fallback & (stars == 1) & (ends - star == 3)
+        & (hi == _HEX[checksum >> 4]) & (lo == _HEX[checksum & 0x0F])
+    )
+
+    stats.report.add_many(BAD_HEADER, (first_line + np.flatnonzero(nonblank & ~header & ~fallback)).tolist())
+    stats.report.add_many(BAD_CHECKSUM, (first_line + np.flatnonzero(header & ~fallback & ~valid)).tolist())
+
+    rows = np.flatnonzero(valid)
+    start, star = starts[rows], star[rows]
+    comma_pos = special[kinds == ord(',')]
+    first_comma = np.searchsorted(comma_pos, start)
+    commas = np.searchsorted(comma_pos, star) - first_comma
+    last_comma = max(len(comma_pos) - 1, 0)
+
+    def field(k):
+        """(start, end, present) of per-row field index k (-1 = not in the format); missing fields are empty."""
+        present = (k >= 0) & (commas >= k)
+        if len(comma_pos):
+            begin = np.where(k == 0, start, comma_pos[np.clip(first_comma + k - 1, 0, last_comma)] + 1)
+            finish = np.where(commas > k, comma_pos[np.clip(first_comma + k, 0, last_comma)], star)
+        else:
+            begin = finish = star
+        return np.where(present, begin, star), np.where(present, finish, star), present
+
+    def layout(name):
+        return _layout(decoders, name, header_id[rows])
+
+    ts_start, ts_end, ts_present = field(layout('timestamp'))
+    captured_at, ts_ok = _parse_timestamps(a, ts_start, ts_end)
+
+    cpm_start, cpm_end, cpm_present = field(layout('cpm'))
+    cpm = _Number(a, cpm_start, cpm_end)
+    # int('') is never reached: an empty CPM field means 0. Nine digits stay within MAX_CPM (and int32);
+    # longer values are range-checked on the scalar path
+    cpm_ok = cpm_present & ((cpm.length == 0) | (cpm.ok & ~cpm.negative & (cpm.int_digits == cpm.length) & (cpm.length <= 9)))
+
+    # A coordinate needs both its value and its hemisphere field, otherwise it is 0.0
+    k = layout('latitude')
+    latitude, lat_ok = _ddm_to_dd(a, *field(k)[:2], *field(k + 1)[:2])
+    latitude = np.where(commas > k, latitude, 0.0)
+    lat_ok |= commas <= k
+    k = layout('longitude')
+    longitude, lon_ok = _ddm_to_dd(a, *field(k)[:2], *field(k + 1)[:2])
+    longitude = np.where(commas > k, longitude, 0.0)
+    lon_ok |= commas <= k
+
+    def optional_float(name):
+        """SentenceDecoder._float over a field: (value or NaN, ok); non-decimal text is left to float() on the scalar path."""
+        begin, finish, _ = field(layout(name))
+        number = _Number(a, begin, finish)
+        return np.where(number.ok, number.value(), np.nan), number.ok | (number.length == 0)
+
+    altitude, alt_ok = optional_float('altitude')
+    altitude = np.where((altitude >= -5000.0) & (altitude <= 50000.0), altitude, np.nan)
+    hdop, hdop_ok = optional_float('hdop')
+
+    begin, finish, _ = field(layout('gps_valid'))
+    gps_valid = (finish - begin == 1) & (a[begin] == ord('A'))
+
+    fast = ts_present & ts_ok & cpm_ok & lat_ok & lon_ok & alt_ok & hdop_ok
+    keep = np.zeros(len(starts), dtype=bool)
+    keep[rows[fast]] = True
+    columns = {name: np.empty(len(starts), dtype=dtype) for name, dtype in COLUMN_DTYPES.items()}
+    columns['cpm'][rows] = cpm.mantissa
+    columns['latitude'][rows] = latitude
+    columns['longitude'][rows] = longitude
+    columns['captured_at'][rows] = captured_at
+    columns['altitude'][rows] = altitude
+    columns['gps_valid'][rows] = gps_valid
+    columns['hdop'][rows] = hdop
+
+    blank_fallback = 0
+    slow = np.concatenate((np.flatnonzero(fallback), rows[~fast]))
+    for i in np.sort(slow):
+        row, reason = _fallback_row(bytes(block[starts[i]:raw_ends[i]]))
+        if row is None:
+            if reason is None:
+                blank_fallback += 1
+            else:
+                stats.report.add(reason, first_line + int(i))
+            continue
+        keep[i] = True
+        for name, value in zip(COLUMN_DTYPES, row):
+            columns[name][i] = value
+
+    kept = int(keep.sum())
+    stats.skipped += int(nonblank.sum()) - blank_fallback - kept
+    return {name: values[keep] for name, values in columns.items()}
+
+
+def parse_bgeigie_columns(buffer: bytes, stats: Optional[ParseStats] = None) -> Dict[str, np.ndarray]:
+    """
+    Parses a UTF-8 bGeigie log buffer into column arrays:
+    cpm int32, latitude/longitude float64, captured_at datetime64[us] (UTC), altitude float64 (NaN if absent),
+    gps_valid bool and hdop float32 (NaN if absent).
+    """
+    stats = stats if stats is not None else ParseStats()
+    view = memoryview(buffer)
+    blocks = []
+    offset = 0
+    while offset < len(buffer):
+        cut = buffer.rfind(b'\n', offset, offset + BLOCK_BYTES) + 1 if offset + BLOCK_BYTES < len(buffer) else 0
+        end = cut if cut > offset else len(buffer)
+        blocks.append(_parse_block(view[offset:end], stats))
+        offset = end
+    stats.bytes_read += len(buffer)
+
+    if not blocks:
+        return empty_columns()
+    columns = {name: np.concatenate([b[name] for b in blocks]) for name in COLUMN_DTYPES}
+    count = len(columns['cpm'])
+    stats.measurements += count
+    if count:
+        stats.max_cpm = max(stats.max_cpm, int(columns['cpm'].max()))
+    return columns
+
+
+def columns_to_measurements(columns: Dict[str, np.ndarray]) -> List[dict]:
+    """Converts column arrays back into the measurement dicts produced by the scalar parser (naive UTC)."""
+    return [
+        {
+            'captured_at': captured_at,
+            'cpm': int(cpm),
+            'latitude': float(latitude),
+            'longitude': float(longitude),
+            'altitude': None if np.isnan(altitude) else float(altitude),
+            'gps_valid': bool(gps_valid),
+            'hdop': None if np.isnan(hdop) else float(hdop),
+        }
+        for cpm, latitude, longitude, captured_at, altitude, gps_valid, hdop in zip(
+            columns['cpm'], columns['latitude'], columns['longitude'],
+            columns['captured_at'].astype(object), columns['altitude'],
+            columns['gps_valid'], columns['hdop'],
+        )
+    ]
+
+
+def parse_column_range(path: str, start: int, end: int) -> Tuple[Dict[str, np.ndarray], dict]:
+    """
+    Parses bytes [start, end) of a log file into column arrays; runs in a worker process, so
+    it only takes picklable arguments (the counters merge with bgeigie_parser.merge_range_stats).
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    stats = ParseStats()
+    columns = parse_bgeigie_columns(data, stats)
+    return columns, stats.as_dict()
+
+
+def iter_bgeigie_column_batches(stream: BinaryIO, stats: Optional[ParseStats] = None,
+                                block_bytes: int = BLOCK_BYTES) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    Parses a binary stream (e.g. a decompressing one) in newline-aligned blocks of about
+    block_bytes, yielding the column arrays of each block that has measurements.
+    """
+    stats = stats if stats is not None else ParseStats()
+    pending = b''
+    while True:
+        chunk = stream.read(block_bytes)
+        if not chunk:
+            break
+        data = pending + chunk
+        cut = data.rfind(b'\n') + 1
+        data, pending = data[:cut], data[cut:]
+        if data:
+            columns = parse_bgeigie_columns(data, stats)
+            if len(columns['cpm']):
+                yield columns
+    if pending:
+        columns = parse_bgeigie_columns(pending, stats)
+        if len(columns['cpm']):
+            yield columns
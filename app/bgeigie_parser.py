@@ -1,4 +1,87 @@
+import bisect
 import datetime
+import math
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Size of the newline-aligned byte ranges a plain log is parsed in, several at a time
+PARALLEL_CHUNK_BYTES = 2 * 1024 * 1024
+# Number of sample line numbers kept per reason in a ParseReport
+REPORT_SAMPLES = 10
+# Largest CPM measurements.cpm (INTEGER) can hold; corrupt lines may claim more
+MAX_CPM = 2 ** 31 - 1
+
+# Reasons a non-blank line is dropped
+BAD_HEADER = 'bad_header'
+BAD_CHECKSUM = 'bad_checksum'
+BAD_TIMESTAMP = 'bad_timestamp'
+BAD_COORDINATES = 'bad_coordinates'
+BAD_CPM = 'bad_cpm'
+MALFORMED = 'malformed'
+
+
+class LineError(ValueError):
+    """Raised by a SentenceDecoder when a field cannot be decoded; carries the report reason."""
+
+    def __init__(self, reason: str, message: str = ''):
+        super().__init__(message or reason)
+        self.reason = reason
+
+
+class ParseReport:
+    """Counts of dropped lines by reason, with the first few (1-based) line numbers of each."""
+
+    def __init__(self, max_samples: int = REPORT_SAMPLES):
+        self.max_samples = max_samples
+        self.counts: Dict[str, int] = {}
+        self.samples: Dict[str, List[int]] = {}
+
+    def add(self, reason: str, line_number: int):
+        self.counts[reason] = self.counts.get(reason, 0) + 1
+        samples = self.samples.setdefault(reason, [])
+        if len(samples) < self.max_samples or line_number < samples[-1]:
+            bisect.insort(samples, line_number)
+            del samples[self.max_samples:]
+
+    def add_many(self, reason: str, line_numbers: Iterable[int]):
+        line_numbers = list(line_numbers)
+        if not line_numbers:
+            return
+        self.counts[reason] = self.counts.get(reason, 0) + len(line_numbers)
+        samples = self.samples.setdefault(reason, [])
+        samples[:] = sorted(samples + line_numbers[:self.max_samples])[:self.max_samples]
+
+    def merge(self, other: dict, line_offset: int = 0):
+        """Adds a report produced by as_dict(), shifting its line numbers by line_offset."""
+        for reason, count in other["counts"].items():
+            self.counts[reason] = self.counts.get(reason, 0) + count - len(other["samples"][reason])
+            self.add_many(reason, [n + line_offset for n in other["samples"][reason]])
+
+    def as_dict(self) -> dict:
+        return {"counts": dict(self.counts), "samples": {reason: list(lines) for reason, lines in self.samples.items()}}
+
+
+class ParseStats:
+    """Running counters for a streaming parse, updated as batches are yielded."""
+
+    def __init__(self):
+        self.bytes_read = 0
+        self.lines_read = 0
+        self.measurements = 0
+        self.skipped = 0
+        self.max_cpm = 0
+        self.report = ParseReport()
+
+    def as_dict(self) -> dict:
+        return {
+            "bytes_read": self.bytes_read,
+            "lines_read": self.lines_read,
+            "measurements": self.measurements,
+            "skipped": self.skipped,
+            "max_cpm": self.max_cpm,
+            "report": self.report.as_dict(),
+        }
+
 
 def calculate_checksum(sentence: str) -> str:
     """Calculates the checksum for a NMEA sentence."""
@@ -9,90 +92,205 @@ def calculate_checksum(sentence: str) -> str:
         checksum ^= ord(char)
     return f"{checksum:02X}"
 
-def ddm_to_dd(ddm: str, direction: str) -> float:
-    """Converts a latitude or longitude from DDMM.MMMM format to decimal degrees."""
+def _parse_ddm(ddm: str, direction: str) -> float:
+    """DDMM.MMMM to decimal degrees; an empty value is 0.0, anything unparsable raises ValueError or IndexError."""
     if not ddm:
         return 0.0
+    parts = ddm.split('.')
+    degrees = int(parts[0][:-2])
+    minutes = float(f"{parts[0][-2:]}.{parts[1]}")
+    dd = degrees + minutes / 60
+    if direction in ['S', 'W']:
+        dd *= -1
+    return dd
+
+def ddm_to_dd(ddm: str, direction: str) -> float:
+    """Converts a latitude or longitude from DDMM.MMMM format to decimal degrees."""
     try:
-        parts = ddm.split('.')
-        degrees = int(parts[0][:-2])
-        minutes = float(f"{parts[0][-2:]}.{parts[1]}")
-        dd = degrees + minutes / 60
-        if direction in ['S', 'W']:
-            dd *= -1
-        return dd
+        return _parse_ddm(ddm, direction)
     except (ValueError, IndexError):
         return 0.0
 
-def parse_bgeigie_log(content: str):
-    """Parses the content of a bGeigie log file."""
-    measurements = []
-    valid_headers = ['$BMRDD', '$BGRDD', '$BNRDD', '$BNXRDD', '$PNTDD', '$CZRDD']
-    
-    for line in content.strip().split('\n'):
-        line = line.strip()
-        if not line or '*' not in line:
-            continue
-            
-        # Check if line starts with any valid bGeigie header
-        if not any(line.startswith(header) for header in valid_headers):
-            continue
-
-        parts = line.split('*')
-        sentence = parts[0]
-        try:
-            checksum = parts[1]
-        except IndexError:
-            continue # Skip lines without a checksum
+class SentenceDecoder:
+    """
+    Decodes the comma-separated fields of one sentence type into a measurement.
 
-        if calculate_checksum(sentence) != checksum:
-            # You might want to log this for debugging
-            continue
+    Every position is a fixed field index; None means the format does not carry that field.
+    The nano-style layout is: header, device id, timestamp, CPM, counts per 5s, total counts,
+    radiation validity, latitude, N/S, longitude, E/W, altitude, GPS validity, satellites, HDOP.
+    """
 
-        fields = sentence.split(',')
+    def __init__(self, header: str, timestamp: int = 2, cpm: int = 3, latitude: int = 7, longitude: int = 9,
+                 altitude: Optional[int] = 11, gps_valid: Optional[int] = 12, hdop: Optional[int] = 14):
+        self.header = header
+        self.timestamp = timestamp
+        self.cpm = cpm
+        self.latitude = latitude
+        self.longitude = longitude
+        self.altitude = altitude
+        self.gps_valid = gps_valid
+        self.hdop = hdop
+
+    @staticmethod
+    def _float(fields: List[str], index: Optional[int]) -> Optional[float]:
+        """float() of a field, or None if the field is absent, empty, unparsable or not finite."""
+        if index is None or len(fields) <= index or not fields[index]:
+            return None
+        try:
+            value = float(fields[index])
+        except ValueError:
+            return None
+        return value if math.isfinite(value) else None
 
+    @staticmethod
+    def _coordinate(fields: List[str], index: int) -> float:
+        """Decimal degrees from a DDMM.MMMM field and the hemisphere field after it; 0.0 if either is absent."""
+        if len(fields) <= index + 1:
+            return 0.0
         try:
-            # Parse timestamp - handle different formats
-            timestamp_str = fields[2]
-            if 'T' in timestamp_str:
-                # ISO format: 2024-11-22T07:17:00Z
+            return _parse_ddm(fields[index], fields[index + 1])
+        except (ValueError, IndexError):
+            raise LineError(BAD_COORDINATES, f"invalid coordinate {fields[index]!r}")
+
+    def decode(self, fields: List[str]) -> dict:
+        """Builds a measurement from the fields; raises LineError, ValueError or IndexError on bad input."""
+        # Parse timestamp - handle different formats
+        timestamp_str = fields[self.timestamp]
+        if 'T' in timestamp_str:
+            # ISO format: 2024-11-22T07:17:00Z
+            try:
                 captured_at = datetime.datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-            else:
-                # Alternative format handling
-                try:
-                    captured_at = datetime.datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-                except ValueError:
-                    captured_at = datetime.datetime.now()
-            
-            # Try to parse altitude if present; many logs don't include it
-            altitude = None
+            except ValueError as e:
+                raise LineError(BAD_TIMESTAMP, str(e))
+        else:
+            # Alternative format handling
             try:
-                # Heuristic: after longitude components, some formats include altitude in meters
-                # Commonly around index 11-13; pick the first parsable float there
-                for idx in (11, 12, 13):
-                    if len(fields) > idx and fields[idx]:
-                        try:
-                            altitude_candidate = float(fields[idx])
-                            # Filter out obviously invalid values
-                            if -5000.0 <= altitude_candidate <= 50000.0:
-                                altitude = altitude_candidate
-                                break
-                        except ValueError:
-                            continue
-            except Exception:
-                altitude = None
-
-            measurement = {
-                'captured_at': captured_at,
-                'cpm': int(fields[3]) if fields[3] else 0,
-                'latitude': ddm_to_dd(fields[7], fields[8]) if len(fields) > 8 else 0.0,
-                'longitude': ddm_to_dd(fields[9], fields[10]) if len(fields) > 10 else 0.0,
-                'altitude': altitude,
-            }
-            measurements.append(measurement)
-        except (ValueError, IndexError) as e:
-            # Log the error and the line that caused it
-            print(f"Error parsing line: {line}\nError: {e}")
-            continue
+                captured_at = datetime.datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
+            except ValueError:
+                captured_at = datetime.datetime.now()
+
+        cpm = int(fields[self.cpm]) if fields[self.cpm] else 0
+        if not 0 <= cpm <= MAX_CPM:
+            raise LineError(BAD_CPM, f"CPM {cpm} out of range")
+
+        # Altitude in meters; many logs leave it empty. Filter out obviously invalid values
+        altitude = self._float(fields, self.altitude)
+        if altitude is not None and not -5000.0 <= altitude <= 50000.0:
+            altitude = None
+
+        return {
+            'captured_at': captured_at,
+            'cpm': cpm,
+            'latitude': self._coordinate(fields, self.latitude),
+            'longitude': self._coordinate(fields, self.longitude),
+            'altitude': altitude,
+            'gps_valid': self.gps_valid is not None and len(fields) > self.gps_valid and fields[self.gps_valid] == 'A',
+            'hdop': self._float(fields, self.hdop),
+        }
+
+
+# Sentence decoders keyed by header ('$BNRDD', ...); register new device formats here
+DECODERS: Dict[str, SentenceDecoder] = {}
+
+
+def register_decoder(decoder: SentenceDecoder):
+    DECODERS[decoder.header] = decoder
+
+
+for _header in ['$BMRDD', '$BGRDD', '$BNRDD', '$BNXRDD', '$PNTDD', '$CZRDD']:
+    register_decoder(SentenceDecoder(_header))
+
+# Kept for callers that only need the list of accepted headers
+VALID_HEADERS = list(DECODERS)
+
+
+def decode_bgeigie_line(line: str) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    Parses a single log line into (measurement, None), or (None, reason) if the line is dropped.
+    Blank lines give (None, None).
+    """
+    line = line.strip()
+    if not line:
+        return None, None
+
+    # Dispatch on the sentence header, i.e. everything before the first comma
+    comma = line.find(',')
+    decoder = DECODERS.get(line[:comma]) if comma > 0 else None
+    if decoder is None:
+        return None, BAD_HEADER
 
+    parts = line.split('*')
+    if len(parts) < 2 or calculate_checksum(parts[0]) != parts[1]:
+        return None, BAD_CHECKSUM
+
+    try:
+        return decoder.decode(parts[0].split(',')), None
+    except LineError as e:
+        return None, e.reason
+    except (ValueError, IndexError):
+        return None, MALFORMED
+
+def parse_bgeigie_line(line: str) -> Optional[dict]:
+    """Parses a single log line, returning a measurement dict or None if the line is not usable."""
+    return decode_bgeigie_line(line)[0]
+
+def parse_bgeigie_log(content: str, stats: Optional[ParseStats] = None):
+    """Parses the content of a bGeigie log file; pass a ParseStats to collect counters and the parse report."""
+    stats = stats if stats is not None else ParseStats()
+    lines = content.split('\n')
+    if lines[-1] == '':
+        # A trailing newline does not start another line
+        lines.pop()
+    measurements = []
+    for line in lines:
+        _accumulate(measurements, line, stats)
     return measurements
+
+
+def _accumulate(batch: List[dict], line: str, stats: ParseStats):
+    """Parses one line into the current batch and updates the running counters and report."""
+    stats.lines_read += 1
+    measurement, reason = decode_bgeigie_line(line)
+    if measurement is None:
+        if reason is not None:
+            stats.skipped += 1
+            stats.report.add(reason, stats.lines_read)
+        return
+    batch.append(measurement)
+    stats.measurements += 1
+    if measurement['cpm'] > stats.max_cpm:
+        stats.max_cpm = measurement['cpm']
+
+
+def split_line_ranges(path: str, chunk_bytes: int = PARALLEL_CHUNK_BYTES) -> List[Tuple[int, int]]:
+    """Splits a file into consecutive (start, end) byte ranges that each end just after a newline (or at EOF)."""
+    size = os.path.getsize(path)
+    ranges = []
+    start = 0
+    with open(path, 'rb') as f:
+        while start < size:
+            end = start + chunk_bytes
+            if end >= size:
+                end = size
+            else:
+                # Move the cut forward to the end of the line it falls in
+                f.seek(end)
+                tail = f.readline()
+                end += len(tail)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def merge_range_stats(stats: ParseStats, counters: dict):
+    """
+    Adds the counters bgeigie_columnar.parse_column_range returned for the next range of a file to stats.
+    Ranges must be merged in file order: their report line numbers are relative to the range.
+    """
+    stats.report.merge(counters['report'], line_offset=stats.lines_read)
+    stats.bytes_read += counters['bytes_read']
+    stats.lines_read += counters['lines_read']
+    stats.measurements += counters['measurements']
+    stats.skipped += counters['skipped']
+    stats.max_cpm = max(stats.max_cpm, counters['max_cpm'])
+
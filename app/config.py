@@ -17,6 +17,79 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
 
+    # DuckDB resources, shared by every connection in the process; empty or 0 keeps DuckDB's default
+    # Worker threads per query (default: one per core)
+    DUCKDB_THREADS: int = 0
+    # Memory before operators spill to disk, e.g. "2GB" (default: 80% of RAM)
+    DUCKDB_MEMORY_LIMIT: str = ""
+    # Where spilled data goes (default: safecast.db.tmp) and how large it may grow, e.g. "20GB"
+    DUCKDB_TEMP_DIRECTORY: str = ""
+    DUCKDB_MAX_TEMP_DIRECTORY_SIZE: str = ""
+
+    # Read query pools (see query_governor.py): queries run at once and seconds before one is interrupted
+    QUERY_INTERACTIVE_CONCURRENCY: int = 4
+    QUERY_INTERACTIVE_TIMEOUT_SECONDS: float = 5.0
+    QUERY_ANALYTICS_CONCURRENCY: int = 1
+    QUERY_ANALYTICS_TIMEOUT_SECONDS: float = 60.0
+
+    # Database writer (see db_writer.py); DuckDB has a single writer
+    # Writes waiting beyond this many make submitters wait, and fail with WriterBusy after the timeout
+    DB_WRITE_QUEUE_SIZE: int = 1000
+    DB_WRITE_QUEUE_TIMEOUT_SECONDS: float = 30.0
+    # Small writes committed together: at most this many, gathered for up to this long
+    DB_WRITE_GROUP_SIZE: int = 64
+    DB_WRITE_GROUP_WAIT_MS: float = 2.0
+
+    # Serving mode (see snapshots.py): "single" runs everything in one process on safecast.db;
+    # "writer" owns the database and publishes read-only snapshots to SNAPSHOT_DIR, which any
+    # number of "reader" API workers serve reads from
+    SERVING_MODE: str = "single"
+    SNAPSHOT_DIR: str = "snapshots"
+    # Snapshots are published at most this often, and only after something was committed
+    SNAPSHOT_INTERVAL_SECONDS: float = 2.0
+    # Snapshots kept on disk, the current one included
+    SNAPSHOT_KEEP: int = 3
+
+    # Nearest-neighbour index over approved measurements (see knn_index.py)
+    # How often it picks up approvals and removals it was not told about, e.g. made by the writer process
+    KNN_SYNC_SECONDS: float = 30.0
+    # Points approved since the tree was built are scanned directly; past this many the tree is rebuilt
+    KNN_DELTA_MAX_POINTS: int = 200_000
+    # Points of imports that left the index stay in the tree, skipped by queries; past this many it is rebuilt
+    KNN_DEAD_MAX_POINTS: int = 200_000
+    # Largest k a query may ask for
+    KNN_MAX_K: int = 1000
+
+    # Import tracks for the map pages, full and decimated per zoom level (see track_decimation.py)
+    TRACK_CACHE_MAX_BYTES: int = 128 * 1024 * 1024
+
+    # Map tiles over the approved measurements (see tiles.py), cached on disk per tile and version
+    TILE_CACHE_DIR: str = "tile_cache"
+    # Tiles below this zoom cover much of the table and are rendered in the analytics query pool
+    TILE_ANALYTICS_MAX_ZOOM: int = 6
+
+    # Background jobs
+    # A claimed job whose lease runs out without a heartbeat may be claimed again
+    JOB_LEASE_SECONDS: int = 300
+    # Attempts before a failing job is dead-lettered
+    JOB_MAX_ATTEMPTS: int = 5
+    # Retry delay doubles from the base up to the cap
+    JOB_RETRY_BASE_SECONDS: int = 10
+    JOB_RETRY_MAX_SECONDS: int = 3600
+    # Completed jobs older than this are purged at startup
+    JOB_RETENTION_DAYS: int = 30
+    # Jobs run at the same time
+    JOB_CONCURRENCY: int = 2
+    # Import parsing runs in a "process" or "thread" pool of this many workers (0: one per CPU), shared by all jobs.
+    # Processes parse the line ranges of a large log side by side; threads share the GIL, so they only
+    # overlap parsing with inserts. Compressed logs are one stream and always parse on a thread.
+    JOB_PARSE_EXECUTOR: str = "process"
+    JOB_PARSE_CONCURRENCY: int = 2
+    # Uploads up to this size are parsed at high priority
+    JOB_SMALL_IMPORT_BYTES: int = 2 * 1024 * 1024
+    # A queued job moves up one priority level for every this many seconds it waits
+    JOB_PRIORITY_AGING_SECONDS: int = 600
+
     class Config:
         # If you create a .env file in the root directory, these settings will be loaded from it.
         env_file = ".env"
@@ -1,9 +1,12 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import or_, text
 import hashlib
 import secrets
-from datetime import datetime
-from . import models, schemas, security
+from datetime import datetime, timezone
+import numpy as np
+from . import grid_aggregates, models, schemas, security
+from .database import reserve_ids
+from .spatial import spatial_cell, spatial_cells
 
 def get_measurements(db: Session, skip: int = 0, limit: int = 1000):
     return db.query(models.Measurement).offset(skip).limit(limit).all()
@@ -11,8 +14,12 @@ def get_measurements(db: Session, skip: int = 0, limit: int = 1000):
 def get_bgeigie_imports_by_user(db: Session, user_id: int, skip: int = 0, limit: int = 100):
     return db.query(models.BGeigieImport).filter(models.BGeigieImport.user_id == user_id).offset(skip).limit(limit).all()
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+def get_users(db: Session, skip: int = 0, limit: int = 100, after_id: int = None):
+    # In id order; after_id continues from a cursor (see pagination.py)
+    query = db.query(models.User).order_by(models.User.id)
+    if after_id is not None:
+        return query.filter(models.User.id > after_id).limit(limit).all()
+    return query.offset(skip).limit(limit).all()
 
 # Device CRUD operations
 def get_device(db: Session, device_id: int):
@@ -95,12 +102,8 @@ def create_user(db: Session, user: schemas.UserCreate):
     hashed_password = security.get_password_hash(user.password)
     api_key = secrets.token_urlsafe(32)
     
-    # Get next available ID
-    result = db.execute(text("SELECT COALESCE(MAX(id), 0) + 1 FROM users")).fetchone()
-    next_id = result[0]
-    
+    # The id comes from users_id_seq on insert
     db_user = models.User(
-        id=next_id,
         email=user.email,
         name=getattr(user, 'name', None),
         hashed_password=hashed_password,
@@ -112,20 +115,17 @@ def create_user(db: Session, user: schemas.UserCreate):
     return db_user
 
 def create_measurements(db: Session, measurements: list[dict], bgeigie_import_id: int):
-    # Get next available ID
-    result = db.execute(text("SELECT COALESCE(MAX(id), 0) FROM measurements")).fetchone()
-    start_id = result[0] + 1 if result[0] else 1
-    
+    # Ids come from measurements_id_seq on insert
     db_measurements = []
-    for i, measurement in enumerate(measurements):
+    for measurement in measurements:
         db_measurement = models.Measurement(
-            id=start_id + i, 
             bgeigie_import_id=bgeigie_import_id,
             cpm=measurement['cpm'],
             latitude=measurement['latitude'],
             longitude=measurement['longitude'],
             altitude=measurement.get('altitude'),
-            captured_at=measurement['captured_at']
+            captured_at=measurement['captured_at'],
+            spatial_cell=spatial_cell(measurement['latitude'], measurement['longitude'])
         )
         db_measurements.append(db_measurement)
     
@@ -133,15 +133,59 @@ def create_measurements(db: Session, measurements: list[dict], bgeigie_import_id
     db.commit()
     return db_measurements
 
+def _measurement_columns(measurements: list[dict]) -> dict:
+    """Column arrays for bulk_insert_measurements; timestamps become naive UTC, a missing altitude NaN."""
+    captured_at = [m['captured_at'] for m in measurements]
+    captured_at = [t.astimezone(timezone.utc).replace(tzinfo=None) if t.tzinfo else t for t in captured_at]
+    return {
+        'cpm': np.array([m['cpm'] for m in measurements], dtype=np.int64),
+        'latitude': np.array([m['latitude'] for m in measurements], dtype=np.float64),
+        'longitude': np.array([m['longitude'] for m in measurements], dtype=np.float64),
+        'altitude': np.array([np.nan if m.get('altitude') is None else m['altitude'] for m in measurements], dtype=np.float64),
+        'captured_at': np.array(captured_at, dtype='datetime64[us]'),
+    }
+
+def bulk_insert_measurements(db: Session, measurements, bgeigie_import_id: int) -> int:
+    """
+    Inserts measurements for an import in a single INSERT ... SELECT, without ORM objects.
+    Accepts measurement dicts from the parser or column arrays from bgeigie_columnar.
+    Returns the number of rows inserted.
+    """
+    columns = measurements if isinstance(measurements, dict) else _measurement_columns(measurements)
+    count = len(columns['cpm'])
+    if count == 0:
+        return 0
+
+    # DuckDB scans the NumPy arrays in place through a registered view on the session's own connection
+    batch = {
+        'id': reserve_ids(db, 'measurements', count),
+        'cpm': columns['cpm'],
+        'latitude': columns['latitude'],
+        'longitude': columns['longitude'],
+        'altitude': columns['altitude'],
+        'captured_at': columns['captured_at'],
+        'spatial_cell': spatial_cells(columns['latitude'], columns['longitude']),
+    }
+    connection = db.connection().connection.driver_connection
+    connection.register('measurement_batch', batch)
+    try:
+        db.execute(text("""
+            INSERT INTO measurements (id, bgeigie_import_id, cpm, latitude, longitude, altitude, captured_at, spatial_cell)
+            SELECT id, :import_id, cpm, latitude, longitude,
+                   CASE WHEN isnan(altitude) THEN NULL ELSE altitude END, captured_at,
+                   CASE WHEN spatial_cell < 0 THEN NULL ELSE spatial_cell END
+            FROM measurement_batch
+        """), {"import_id": bgeigie_import_id})
+    finally:
+        connection.unregister('measurement_batch')
+    db.commit()
+    return count
+
 def get_device_stories(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.DeviceStory).offset(skip).limit(limit).all()
 
 def create_device_story(db: Session, story: schemas.DeviceStoryCreate, user_id: int):
-    # Get next available ID
-    result = db.execute(text("SELECT COALESCE(MAX(id), 0) + 1 FROM device_stories")).fetchone()
-    next_id = result[0]
-    
-    db_story = models.DeviceStory(id=next_id, **story.dict(), user_id=user_id)
+    db_story = models.DeviceStory(**story.dict(), user_id=user_id)
     db.add(db_story)
     db.commit()
     db.refresh(db_story)
@@ -150,19 +194,66 @@ def create_device_story(db: Session, story: schemas.DeviceStoryCreate, user_id:
 def get_devices_by_user(db: Session, user_id: int, skip: int = 0, limit: int = 100):
     return db.query(models.Device).join(models.BGeigieImport).filter(models.BGeigieImport.user_id == user_id).offset(skip).limit(limit).all()
 
-def create_bgeigie_import(db: Session, bgeigie_import: schemas.BGeigieImportCreate, user_id: int, file_content: bytes):
-    md5sum = hashlib.md5(file_content).hexdigest()
-    
-    # Get next available ID
-    result = db.execute(text("SELECT COALESCE(MAX(id), 0) + 1 FROM bgeigie_imports")).fetchone()
-    next_id = result[0]
+def create_bgeigie_import(db: Session, bgeigie_import: schemas.BGeigieImportCreate, user_id: int,
+                          file_content: bytes = None, md5sum: str = None, archive_member: str = None,
+                          source_import_id: int = None):
+    # Streaming uploads pass the md5sum computed on the fly instead of the whole file content
+    if md5sum is None and file_content is not None:
+        md5sum = hashlib.md5(file_content).hexdigest()
     
-    db_bgeigie_import = models.BGeigieImport(id=next_id, **bgeigie_import.dict(), user_id=user_id, md5sum=md5sum)
+    db_bgeigie_import = models.BGeigieImport(**bgeigie_import.dict(), user_id=user_id, md5sum=md5sum,
+                                             archive_member=archive_member, source_import_id=source_import_id)
+    # A re-upload of bytes already parsed for another import shares that parse at once
+    if source_import_id is not None:
+        source = db.query(models.BGeigieImport).filter(models.BGeigieImport.id == source_import_id).one()
+        if source.parsed_at is not None:
+            copy_parse_results(source, db_bgeigie_import)
     db.add(db_bgeigie_import)
     db.commit()
     db.refresh(db_bgeigie_import)
     return db_bgeigie_import
 
+def get_bgeigie_import_by_md5(db: Session, md5sum: str, user_id: int = None, archive_member: str = None):
+    """
+    The oldest import of the same bytes (and zip member), parsed or not: the given user's,
+    or else one holding its own measurements, which re-uploads of other users can share.
+    """
+    query = db.query(models.BGeigieImport).filter(
+        models.BGeigieImport.md5sum == md5sum,
+        models.BGeigieImport.archive_member == archive_member
+    )
+    if user_id is not None:
+        query = query.filter(models.BGeigieImport.user_id == user_id)
+    else:
+        query = query.filter(models.BGeigieImport.source_import_id.is_(None))
+    return query.order_by(models.BGeigieImport.id).first()
+
+def get_import_group_ids(db: Session, measurements_import_id: int) -> list[int]:
+    """Ids of the imports sharing the measurements stored under measurements_import_id, that import first."""
+    return [row.id for row in db.query(models.BGeigieImport.id).filter(or_(
+        models.BGeigieImport.id == measurements_import_id,
+        models.BGeigieImport.source_import_id == measurements_import_id
+    )).order_by(models.BGeigieImport.id).all()]
+
+def user_shares_import(db: Session, import_id: int, user_id: int) -> bool:
+    """Whether the user owns the import, or another import sharing its measurements (a re-upload of the same bytes)."""
+    db_import = db.query(models.BGeigieImport).filter(models.BGeigieImport.id == import_id).first()
+    if db_import is None:
+        return False
+    return db.query(models.BGeigieImport.id).filter(
+        models.BGeigieImport.id.in_(get_import_group_ids(db, db_import.measurements_import_id)),
+        models.BGeigieImport.user_id == user_id
+    ).first() is not None
+
+def copy_parse_results(source: models.BGeigieImport, target: models.BGeigieImport):
+    """Gives an import sharing the source's measurements the source's parse results."""
+    target.measurements_count = source.measurements_count
+    target.lines_count = source.lines_count
+    target.parse_report = source.parse_report
+    target.parsed_at = source.parsed_at
+    if source.measurements_count and target.status in (None, "unprocessed"):
+        target.status = "processed"
+
 def get_measurements_count(db: Session):
     return db.query(models.Measurement).count()
 
@@ -170,23 +261,125 @@ def get_comments_by_device_story(db: Session, device_story_id: int):
     return db.query(models.DeviceStoryComment).filter(models.DeviceStoryComment.device_story_id == device_story_id).all()
 
 def create_comment(db: Session, comment: schemas.DeviceStoryCommentCreate, device_story_id: int, user_id: int):
-    # Get next available ID
-    result = db.execute(text("SELECT COALESCE(MAX(id), 0) + 1 FROM device_story_comments")).fetchone()
-    next_id = result[0]
-    
-    db_comment = models.DeviceStoryComment(id=next_id, **comment.dict(), device_story_id=device_story_id, user_id=user_id)
+    db_comment = models.DeviceStoryComment(**comment.dict(), device_story_id=device_story_id, user_id=user_id)
     db.add(db_comment)
     db.commit()
     db.refresh(db_comment)
     return db_comment
 
+def record_map_change(db: Session, import_id: int):
+    """
+    Records that the import's measurements joined or left the approved data, so the map tiles
+    over them are rendered again (see tiles.py). Called in the transaction making the change,
+    while the measurements are still there.
+    """
+    db.execute(text("""
+        INSERT INTO map_changes (id, bgeigie_import_id, lat_min, lat_max, lon_min, lon_max, created_at)
+        SELECT nextval('map_changes_id_seq'), :import_id, MIN(latitude), MAX(latitude), MIN(longitude), MAX(longitude), now()
+        FROM measurements
+        WHERE bgeigie_import_id = :import_id AND latitude IS NOT NULL AND longitude IS NOT NULL
+        HAVING COUNT(*) > 0
+    """), {"import_id": import_id})
+
+def measurements_on_map(db: Session, measurements_import_id: int, excluding: int = None) -> bool:
+    """
+    Whether the measurements stored under measurements_import_id are in the approved data:
+    they are while any import sharing them is approved (optionally leaving one import out).
+    """
+    query = db.query(models.BGeigieImport.id).filter(
+        or_(models.BGeigieImport.id == measurements_import_id,
+            models.BGeigieImport.source_import_id == measurements_import_id),
+        models.BGeigieImport.status == "approved"
+    )
+    if excluding is not None:
+        query = query.filter(models.BGeigieImport.id != excluding)
+    return query.first() is not None
+
+def record_measurements_change(db: Session, measurements_import_id: int, on_map: bool):
+    """
+    Updates what is derived from the approved measurements as those stored under
+    measurements_import_id join (on_map) or leave them: the map tiles and the grid aggregates.
+    Called in the transaction making the change, while the measurements are still there.
+    """
+    record_map_change(db, measurements_import_id)
+    if on_map:
+        grid_aggregates.add_import(db, measurements_import_id)
+    else:
+        grid_aggregates.remove_import(db, measurements_import_id)
+
+def record_approval_change(db: Session, import_id: int, approved: bool):
+    """
+    Records that the import is being approved or unapproved. Imports sharing measurements put
+    them on the map once: only the first approval and the last unapproval among them change it.
+    """
+    db_import = db.query(models.BGeigieImport).filter(models.BGeigieImport.id == import_id).one()
+    measurements_import_id = db_import.measurements_import_id
+    if not measurements_on_map(db, measurements_import_id, excluding=import_id):
+        record_measurements_change(db, measurements_import_id, approved)
+
 def update_bgeigie_import_status(db: Session, import_id: int, status: str, user_id: int = None):
     query = db.query(models.BGeigieImport).filter(models.BGeigieImport.id == import_id)
     if user_id:
         query = query.filter(models.BGeigieImport.user_id == user_id)
     db_import = query.first()
     if db_import:
+        if (db_import.status == "approved") != (status == "approved"):
+            record_approval_change(db, import_id, status == "approved")
         db_import.status = status
         db.commit()
         db.refresh(db_import)
     return db_import
+
+def update_bgeigie_import_metadata(db: Session, import_id: int, metadata: dict):
+    """Sets an import's metadata fields and submits it for approval, unless it is already approved."""
+    db_import = db.query(models.BGeigieImport).filter(models.BGeigieImport.id == import_id).first()
+    if db_import:
+        for field, value in metadata.items():
+            setattr(db_import, field, value)
+        if db_import.status in ["processed", "unprocessed", "rejected", "submitted"]:
+            db_import.status = "submitted"
+        db.commit()
+        db.refresh(db_import)
+    return db_import
+
+def delete_bgeigie_import_records(db: Session, import_id: int) -> int:
+    """
+    Deletes the measurements, devices and logs of an import; returns the number of measurements deleted.
+    Measurements other imports share are handed to the oldest of them instead.
+    The import itself has to be deleted in a later transaction: DuckDB checks foreign keys
+    against child rows deleted earlier in the same transaction.
+    """
+    status = db.execute(text("SELECT status FROM bgeigie_imports WHERE id = :import_id"), {"import_id": import_id}).scalar()
+    if status == "approved":
+        record_approval_change(db, import_id, False)
+    successor = db.query(models.BGeigieImport).filter(
+        models.BGeigieImport.source_import_id == import_id
+    ).order_by(models.BGeigieImport.id).first()
+    if successor:
+        params = {"import_id": import_id, "successor_id": successor.id}
+        db.execute(text("UPDATE measurements SET bgeigie_import_id = :successor_id WHERE bgeigie_import_id = :import_id"), params)
+        db.execute(text("""
+            UPDATE bgeigie_imports SET source_import_id = :successor_id
+            WHERE source_import_id = :import_id AND id <> :successor_id
+        """), params)
+        successor.source_import_id = None
+        db.flush()
+    measurements_count = db.execute(text("SELECT COUNT(*) FROM measurements WHERE bgeigie_import_id = :import_id"), {"import_id": import_id}).scalar()
+    for table in ("measurements", "devices", "bgeigie_logs"):
+        db.execute(text(f"DELETE FROM {table} WHERE bgeigie_import_id = :import_id"), {"import_id": import_id})
+    
+    # Verify all child records are actually deleted
+    remaining = {
+        table: db.execute(text(f"SELECT COUNT(*) FROM {table} WHERE bgeigie_import_id = :import_id"), {"import_id": import_id}).scalar()
+        for table in ("measurements", "devices", "bgeigie_logs")
+    }
+    if any(remaining.values()):
+        raise Exception(f"Child rows still present ({', '.join(f'{table}={count}' for table, count in remaining.items())})")
+    return measurements_count
+
+def delete_bgeigie_import(db: Session, import_id: int):
+    db_import = db.query(models.BGeigieImport).filter(models.BGeigieImport.id == import_id).first()
+    if db_import:
+        db.delete(db_import)
+        db.commit()
+    return db_import
@@ -1,13 +1,69 @@
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import declarative_base, sessionmaker
 
+from .config import settings
+
 SQLALCHEMY_DATABASE_URL = "duckdb:///safecast.db"
 
 Base = declarative_base()
 
+def duckdb_config() -> dict:
+    """
+    DuckDB resource settings from config. They apply to the whole database, and DuckDB
+    refuses a second connection to the file with a different config, so every engine in
+    the process must be created with create_duckdb_engine.
+    """
+    config = {}
+    if settings.DUCKDB_THREADS:
+        config["threads"] = settings.DUCKDB_THREADS
+    if settings.DUCKDB_MEMORY_LIMIT:
+        config["memory_limit"] = settings.DUCKDB_MEMORY_LIMIT
+    if settings.DUCKDB_TEMP_DIRECTORY:
+        config["temp_directory"] = settings.DUCKDB_TEMP_DIRECTORY
+    if settings.DUCKDB_MAX_TEMP_DIRECTORY_SIZE:
+        config["max_temp_directory_size"] = settings.DUCKDB_MAX_TEMP_DIRECTORY_SIZE
+    return config
+
+def create_duckdb_engine(url: str = SQLALCHEMY_DATABASE_URL, **kwargs):
+    """An engine on the database; in reader serving mode, on the current read-only snapshot of it."""
+    if settings.SERVING_MODE == "reader" and url == SQLALCHEMY_DATABASE_URL:
+        from .snapshots import create_snapshot_engine
+        return create_snapshot_engine(**kwargs)
+    return create_engine(url, connect_args={"config": duckdb_config()}, **kwargs)
+
 # Create SessionLocal for background tasks
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = create_duckdb_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def ensure_sequences(engine):
+    """
+    Creates the id sequence of every model table that does not have one yet,
+    starting after the highest id already in the table.
+    """
+    from . import models  # noqa: F401  (registers the tables on Base.metadata)
+
+    with engine.begin() as connection:
+        sequences = {row[0] for row in connection.execute(text("SELECT sequence_name FROM duckdb_sequences()"))}
+        tables = {row[0] for row in connection.execute(text("SELECT table_name FROM duckdb_tables()"))}
+        for table in Base.metadata.sorted_tables:
+            sequence = table.c.id.default if 'id' in table.c else None
+            if sequence is None or sequence.name in sequences:
+                continue
+            start = 1
+            if table.name in tables:
+                start = connection.execute(text(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table.name}")).scalar()
+            connection.execute(text(f"CREATE SEQUENCE IF NOT EXISTS {sequence.name} START {start}"))
+
+def reserve_ids(db, table: str, count: int):
+    """Takes a block of count ids from the table's sequence in one query; returns them as an int64 array."""
+    import numpy as np
+
+    if count == 0:
+        return np.empty(0, dtype=np.int64)
+    rows = db.execute(text(f"SELECT nextval('{table}_id_seq') FROM range(:count)"), {"count": count}).fetchall()
+    return np.fromiter((row[0] for row in rows), dtype=np.int64, count=count)
+
 def setup_database(engine):
+    # Sequences first, so create_all finds them instead of creating them at 1
+    ensure_sequences(engine)
     Base.metadata.create_all(bind=engine)
@@ -0,0 +1,243 @@
+"""
+The single database writer.
+
+DuckDB lets one connection write at a time, so every insert, update and delete goes
+through one DatabaseWriter: a thread owning the only write session. Callers submit a
+write function `fn(db, *args)` and get its return value back. Small writes that arrive
+together are run back to back and committed as one group; bulk writes (measurement
+inserts) run alone, each in its own transaction. The queue is bounded: when the writer
+falls behind, submitters wait for room and get WriterBusy if none frees up in time.
+
+Reads stay on their own sessions. A caller that reads after writing should pass its
+read session to write()/write_sync(), which ends its snapshot so the write is visible.
+"""
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional
+
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .database import Base, engine
+
+logger = logging.getLogger(__name__)
+
+
+class WriterBusy(Exception):
+    """The write queue stayed full for longer than the caller was willing to wait."""
+
+
+class WriterUnavailable(Exception):
+    """No database writer runs in this process, e.g. an API worker serving reads from a snapshot."""
+
+
+class GroupCommitSession(Session):
+    """
+    The writer's session. Write functions may call commit() as usual (crud functions do);
+    it only flushes, and the writer commits once the whole group has run. Write functions
+    must not roll back: a failing one should raise, and the writer rolls back for it.
+    """
+
+    def commit(self):
+        self.flush()
+
+    def commit_group(self):
+        super().commit()
+
+
+class _WriteRequest:
+    __slots__ = ("fn", "args", "kwargs", "bulk", "future")
+
+    def __init__(self, fn: Callable, args: tuple, kwargs: dict, bulk: bool):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.bulk = bulk
+        self.future = Future()
+
+
+_STOP = object()
+
+
+class DatabaseWriter:
+    """Runs every database write on one thread, batching small writes into group commits."""
+
+    def __init__(self, queue_size: int = settings.DB_WRITE_QUEUE_SIZE,
+                 group_size: int = settings.DB_WRITE_GROUP_SIZE,
+                 group_wait_ms: float = settings.DB_WRITE_GROUP_WAIT_MS):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.group_size = group_size
+        self.group_wait = group_wait_ms / 1000
+        self.thread = None
+        self.session = None
+        # Held while a group runs; holding it keeps the database file still (see snapshots.py)
+        self.commit_lock = threading.Lock()
+        self.groups_committed = 0
+        self.writes_committed = 0
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+            self.thread.start()
+            logger.info("Database writer started")
+
+    def stop(self, timeout: Optional[float] = None):
+        """Finishes the writes already queued, then stops the writer thread."""
+        if self.thread is not None:
+            self.queue.put(_STOP)
+            self.thread.join(timeout)
+            self.thread = None
+            logger.info("Database writer stopped")
+
+    @property
+    def backlog(self) -> int:
+        """Writes waiting for the writer."""
+        return self.queue.qsize()
+
+    def submit(self, fn: Callable, *args, bulk: bool = False, **kwargs) -> Future:
+        """
+        Queues fn(db, *args, **kwargs) and returns a Future for its result.
+        Blocks while the queue is full, raising WriterBusy after DB_WRITE_QUEUE_TIMEOUT_SECONDS.
+        """
+        if self.thread is None:
+            raise WriterUnavailable("The database writer is not running in this process")
+        request = _WriteRequest(fn, args, kwargs, bulk)
+        try:
+            self.queue.put(request, timeout=settings.DB_WRITE_QUEUE_TIMEOUT_SECONDS)
+        except queue.Full:
+            raise WriterBusy(f"{self.queue.maxsize} writes already waiting")
+        return request.future
+
+    def call(self, fn: Callable, *args, bulk: bool = False, **kwargs) -> Any:
+        """
+        Runs a write and waits for it to be committed; returns fn's result.
+        Called from a write function, fn joins the transaction already running.
+        """
+        if threading.current_thread() is self.thread:
+            return fn(self.session, *args, **kwargs)
+        return self.submit(fn, *args, bulk=bulk, **kwargs).result()
+
+    async def run(self, fn: Callable, *args, bulk: bool = False, **kwargs) -> Any:
+        """call() for coroutines; waiting for room in the queue does not block the event loop."""
+        if self.thread is None:
+            raise WriterUnavailable("The database writer is not running in this process")
+        request = _WriteRequest(fn, args, kwargs, bulk)
+        try:
+            self.queue.put_nowait(request)
+        except queue.Full:
+            future = await asyncio.to_thread(self.submit, fn, *args, bulk=bulk, **kwargs)
+        else:
+            future = request.future
+        return await asyncio.wrap_future(future)
+
+    def _run(self):
+        self.session = GroupCommitSession(bind=engine, autoflush=False, expire_on_commit=False)
+        pending = None
+        try:
+            while True:
+                request = pending if pending is not None else self.queue.get()
+                pending = None
+                if request is _STOP:
+                    break
+                if request.bulk:
+                    with self.commit_lock:
+                        self._commit([request])
+                    continue
+                # Gather the small writes queued behind this one into a single transaction
+                group = [request]
+                deadline = time.monotonic() + self.group_wait
+                while len(group) < self.group_size:
+                    try:
+                        request = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                    except queue.Empty:
+                        break
+                    if request is _STOP or request.bulk:
+                        pending = request
+                        break
+                    group.append(request)
+                with self.commit_lock:
+                    self._commit(group)
+        finally:
+            self.session.close()
+
+    def _commit(self, group: List[_WriteRequest]):
+        """Runs a group of writes in one transaction; if it fails, runs them one by one to find the culprit."""
+        group = [request for request in group if request.future.set_running_or_notify_cancel()]
+        if not group:
+            return
+        results = []
+        try:
+            for request in group:
+                results.append(request.fn(self.session, *request.args, **request.kwargs))
+                # Later writes in the group load rows afresh rather than see this one's objects
+                self.session.flush()
+                self.session.expunge_all()
+            self.session.commit_group()
+        except BaseException as e:
+            self.session.rollback()
+            self.session.expunge_all()
+            if len(group) == 1:
+                group[0].future.set_exception(e)
+            else:
+                for request in group:
+                    self._retry_alone(request)
+            return
+        # Returned objects are handed to other threads detached, with their loaded values
+        self.session.expunge_all()
+        self.groups_committed += 1
+        self.writes_committed += len(group)
+        for request, result in zip(group, results):
+            request.future.set_result(result)
+
+    def _retry_alone(self, request: _WriteRequest):
+        try:
+            result = request.fn(self.session, *request.args, **request.kwargs)
+            self.session.commit_group()
+        except BaseException as e:
+            self.session.rollback()
+            request.future.set_exception(e)
+        else:
+            self.writes_committed += 1
+            request.future.set_result(result)
+        finally:
+            self.session.expunge_all()
+
+
+# The writer shared by the API and the background jobs
+writer = DatabaseWriter()
+
+
+def _into_session(db: Optional[Session], result: Any) -> Any:
+    if db is None:
+        return result
+    # End the read snapshot so the caller's next queries see the write
+    db.rollback()
+    if isinstance(result, Base):
+        # Relationships of the returned row then load through the caller's session
+        return db.merge(result, load=False)
+    return result
+
+
+async def write(db: Optional[Session], fn: Callable, *args, bulk: bool = False, **kwargs) -> Any:
+    """
+    Runs fn(writer_session, *args, **kwargs) on the writer and returns its result once committed.
+    A returned model instance is attached to db, the caller's read session, when one is given.
+    """
+    return _into_session(db, await writer.run(fn, *args, bulk=bulk, **kwargs))
+
+
+def write_sync(db: Optional[Session], fn: Callable, *args, bulk: bool = False, **kwargs) -> Any:
+    """write() for synchronous code: routes declared with def, and worker threads."""
+    return _into_session(db, writer.call(fn, *args, bulk=bulk, **kwargs))
+
+
+def start_writer():
+    writer.start()
+
+
+def stop_writer():
+    writer.stop()
@@ -0,0 +1,168 @@
+"""
+Mean dose per grid cell over the approved measurements, maintained incrementally.
+
+grid_aggregates holds, for each cell of each level in GRID_LEVELS that has approved readings,
+the sum, number, lowest and highest of their CPM and the newest captured_at. The cells are
+the spatial cells of spatial.py at coarser levels: a measurement is in cell
+spatial_cell >> 2 * (CELL_LEVEL - level) of a level, so no coordinates are recomputed.
+
+When an import joins the approved data its per-cell totals are added (add_import); when it
+leaves them (rejection, deletion, reprocessing) they are subtracted (remove_import), and
+cells left without readings are dropped. Lowest, highest and newest cannot be subtracted:
+they are read again from the remaining approved measurements, for the cells where the
+import held one of them only. Both run in the transaction changing the import's status or
+deleting its measurements (see crud.record_approval_change), while its measurements are
+still there, so the table always equals a full recompute; verify_grid.py checks that, and
+rebuilds the table after an upgrade or a change to GRID_LEVELS.
+"""
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, or_, text
+from sqlalchemy.orm import Session
+
+from . import models, spatial
+
+# Cell sizes at the equator: ~625 x 312 km, 156 x 78 km, 39 x 20 km, 9.8 x 4.9 km, 2.4 x 1.2 km
+GRID_LEVELS = (6, 8, 10, 12, 14)
+# Largest number of cells a grid query may cover
+MAX_GRID_CELLS = 65536
+
+# Measurements are stored under one import for every upload of the same bytes (see crud.measurements_on_map)
+_APPROVED_IMPORTS = "SELECT COALESCE(source_import_id, id) FROM bgeigie_imports WHERE status = 'approved'"
+
+
+def _totals(condition: str) -> str:
+    """
+    Per (level, cell) totals of the measurements matching the condition: summed once per
+    finest cell, then rolled up into every level.
+    """
+    return f"""
+        SELECT levels.level, fine.cell >> (2 * ({spatial.CELL_LEVEL} - levels.level)) AS cell,
+               SUM(fine.cpm_sum) AS cpm_sum, SUM(fine.cpm_count) AS cpm_count,
+               MIN(fine.cpm_min) AS cpm_min, MAX(fine.cpm_max) AS cpm_max,
+               MAX(fine.last_captured_at) AS last_captured_at
+        FROM (
+            SELECT m.spatial_cell AS cell, SUM(m.cpm) AS cpm_sum, COUNT(*) AS cpm_count,
+                   MIN(m.cpm) AS cpm_min, MAX(m.cpm) AS cpm_max, MAX(m.captured_at) AS last_captured_at
+            FROM measurements m
+            WHERE ({condition}) AND m.cpm IS NOT NULL AND m.spatial_cell >= 0
+            GROUP BY m.spatial_cell
+        ) fine, (SELECT unnest({list(GRID_LEVELS)}) AS level) levels
+        GROUP BY levels.level, 2
+    """
+
+
+def add_import(db: Session, import_id: int):
+    """Adds the measurements stored under the import to the grid; called as they are approved."""
+    db.execute(text(f"""
+        INSERT INTO grid_aggregates (level, cell, cpm_sum, cpm_count, cpm_min, cpm_max, last_captured_at)
+        {_totals("m.bgeigie_import_id = :import_id")}
+        ON CONFLICT (level, cell) DO UPDATE SET
+            cpm_sum = grid_aggregates.cpm_sum + EXCLUDED.cpm_sum,
+            cpm_count = grid_aggregates.cpm_count + EXCLUDED.cpm_count,
+            cpm_min = LEAST(grid_aggregates.cpm_min, EXCLUDED.cpm_min),
+            cpm_max = GREATEST(grid_aggregates.cpm_max, EXCLUDED.cpm_max),
+            last_captured_at = GREATEST(grid_aggregates.last_captured_at, EXCLUDED.last_captured_at)
+    """), {"import_id": import_id})
+
+
+def remove_import(db: Session, import_id: int):
+    """Takes the measurements stored under the import out of the grid; called while they are still approved and there."""
+    removed = _totals("m.bgeigie_import_id = :import_id")
+    # Extremes held by the import are taken from the other approved imports, cell by cell
+    db.execute(text(f"""
+        UPDATE grid_aggregates
+        SET cpm_min = rest.cpm_min, cpm_max = rest.cpm_max, last_captured_at = rest.last_captured_at
+        FROM (
+            SELECT stale.level, stale.cell, MIN(m.cpm) AS cpm_min, MAX(m.cpm) AS cpm_max,
+                   MAX(m.captured_at) AS last_captured_at
+            FROM (
+                SELECT g.level, g.cell, 2 * ({spatial.CELL_LEVEL} - g.level) AS shift
+                FROM grid_aggregates g JOIN ({removed}) removed ON removed.level = g.level AND removed.cell = g.cell
+                WHERE removed.cpm_min <= g.cpm_min OR removed.cpm_max >= g.cpm_max
+                   OR removed.last_captured_at >= g.last_captured_at
+            ) stale
+            JOIN measurements m
+              ON m.spatial_cell BETWEEN stale.cell << stale.shift AND ((stale.cell + 1) << stale.shift) - 1
+            WHERE m.bgeigie_import_id IN ({_APPROVED_IMPORTS}) AND m.bgeigie_import_id <> :import_id
+              AND m.cpm IS NOT NULL
+            GROUP BY stale.level, stale.cell
+        ) rest
+        WHERE grid_aggregates.level = rest.level AND grid_aggregates.cell = rest.cell
+    """), {"import_id": import_id})
+    db.execute(text(f"""
+        UPDATE grid_aggregates
+        SET cpm_sum = grid_aggregates.cpm_sum - removed.cpm_sum,
+            cpm_count = grid_aggregates.cpm_count - removed.cpm_count
+        FROM ({removed}) removed
+        WHERE grid_aggregates.level = removed.level AND grid_aggregates.cell = removed.cell
+    """), {"import_id": import_id})
+    db.execute(text("DELETE FROM grid_aggregates WHERE cpm_count = 0"))
+
+
+def rebuild(db: Session) -> int:
+    """Recomputes the whole table from the approved measurements; returns the number of cells."""
+    db.execute(text("DELETE FROM grid_aggregates"))
+    db.execute(text(f"""
+        INSERT INTO grid_aggregates (level, cell, cpm_sum, cpm_count, cpm_min, cpm_max, last_captured_at)
+        {_totals(f"m.bgeigie_import_id IN ({_APPROVED_IMPORTS})")}
+    """))
+    db.commit()
+    return db.execute(text("SELECT COUNT(*) FROM grid_aggregates")).scalar()
+
+
+def differences(db: Session, limit: int = 20) -> Tuple[int, List[tuple]]:
+    """
+    Cells where the table differs from a full recompute: their number, and up to limit of them
+    as (level, cell, stored, recomputed), each a (sum, count, min, max, last captured_at) or None.
+    """
+    columns = ("cpm_sum", "cpm_count", "cpm_min", "cpm_max", "last_captured_at")
+    rows = db.execute(text(f"""
+        SELECT COALESCE(g.level, r.level), COALESCE(g.cell, r.cell), g.level IS NOT NULL, r.level IS NOT NULL,
+               {", ".join(f"g.{c}" for c in columns)}, {", ".join(f"r.{c}" for c in columns)},
+               COUNT(*) OVER () AS differing
+        FROM grid_aggregates g
+        FULL OUTER JOIN ({_totals(f"m.bgeigie_import_id IN ({_APPROVED_IMPORTS})")}) r
+          ON r.level = g.level AND r.cell = g.cell
+        WHERE {" OR ".join(f"g.{c} IS DISTINCT FROM r.{c}" for c in columns)}
+        ORDER BY 1, 2
+        LIMIT :limit
+    """), {"limit": limit}).all()
+    if not rows:
+        return 0, []
+    width = len(columns)
+    return rows[0].differing, [
+        (row[0], row[1], tuple(row[4:4 + width]) if row[2] else None,
+         tuple(row[4 + width:4 + 2 * width]) if row[3] else None)
+        for row in rows
+    ]
+
+
+def cells_in_box(db: Session, level: int, lat_min: float, lat_max: float, lon_min: float,
+                 lon_max: float) -> Optional[List[dict]]:
+    """
+    The level's cells with approved readings that overlap the box (within +-90, +-180), with
+    their bounds and mean CPM; None when the box covers more than MAX_GRID_CELLS cells of the level.
+    """
+    if spatial.cell_count(lat_min, lat_max, lon_min, lon_max, level) > MAX_GRID_CELLS:
+        return None
+    ranges = spatial.cell_ranges(lat_min, lat_max, lon_min, lon_max, level)
+    if not ranges:
+        return []
+    grid = models.GridAggregate
+    rows = db.query(grid).filter(
+        grid.level == level, or_(*(and_(grid.cell >= first, grid.cell <= last) for first, last in ranges))
+    ).order_by(grid.cell).all()
+    cells = []
+    for row in rows:
+        south, north, west, east = spatial.cell_bounds(row.cell, level)
+        # The ranges may be of coarser cells than the box needs
+        if south > lat_max or north < lat_min or west > lon_max or east < lon_min:
+            continue
+        cells.append({
+            "level": level, "cell": row.cell,
+            "lat_min": south, "lat_max": north, "lon_min": west, "lon_max": east,
+            "cpm_mean": row.cpm_sum / row.cpm_count, "cpm_min": row.cpm_min, "cpm_max": row.cpm_max,
+            "count": row.cpm_count, "last_captured_at": row.last_captured_at,
+        })
+    return cells
@@ -0,0 +1,276 @@
+"""
+In-memory nearest-neighbour index over the measurements of approved imports.
+
+Measurements are kept as points on the unit sphere, where the straight-line (chord)
+distance orders points exactly as the great-circle distance does, in a KD-tree built with
+scipy's cKDTree. A tree cannot take new points, so the measurements of imports approved
+since the last build go to a small delta that queries scan directly. Nor can it drop
+points: those of an import that leaves the index (rejected, deleted) are marked dead and
+skipped by queries. Once the delta grows past KNN_DELTA_MAX_POINTS, or the dead points
+past KNN_DEAD_MAX_POINTS, the tree is rebuilt. Without scipy the whole index is scanned
+directly.
+
+A background thread keeps the index in line with the database: every KNN_SYNC_SECONDS,
+or right after a route changed an import's approval or a parse finished (request_sync),
+it compares the approved imports, and when each was last parsed, with those indexed. Queries never wait for it; they use the last state
+it published.
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import text
+
+from .config import settings
+from .database import SessionLocal
+from .spatial import EARTH_RADIUS_KM
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # without the optional scipy package queries scan every point
+    cKDTree = None
+
+logger = logging.getLogger(__name__)
+
+
+def unit_vectors(latitudes, longitudes) -> np.ndarray:
+    """(n, 3) points on the unit sphere for the given coordinates in degrees."""
+    latitudes = np.radians(np.asarray(latitudes, dtype=np.float64))
+    longitudes = np.radians(np.asarray(longitudes, dtype=np.float64))
+    cos_latitudes = np.cos(latitudes)
+    return np.column_stack((cos_latitudes * np.cos(longitudes), cos_latitudes * np.sin(longitudes), np.sin(latitudes)))
+
+
+def chord_to_km(chord: np.ndarray) -> np.ndarray:
+    return 2 * np.arcsin(np.minimum(chord / 2, 1.0)) * EARTH_RADIUS_KM
+
+
+class _Points:
+    """Measurement ids, their import ids and unit vectors, as parallel arrays."""
+
+    def __init__(self, ids: np.ndarray, import_ids: np.ndarray, xyz: np.ndarray):
+        self.ids = ids
+        self.import_ids = import_ids
+        self.xyz = xyz
+
+    @classmethod
+    def empty(cls) -> "_Points":
+        return cls(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty((0, 3)))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        return self.ids.nbytes + self.import_ids.nbytes + self.xyz.nbytes
+
+    def concat(self, other: "_Points") -> "_Points":
+        return _Points(np.concatenate((self.ids, other.ids)), np.concatenate((self.import_ids, other.import_ids)),
+                       np.concatenate((self.xyz, other.xyz)))
+
+    def without(self, import_ids) -> "_Points":
+        return self.take(~np.isin(self.import_ids, list(import_ids)))
+
+    def take(self, keep: np.ndarray) -> "_Points":
+        return _Points(self.ids[keep], self.import_ids[keep], self.xyz[keep])
+
+    def nearest(self, point: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """The k nearest points by scanning them all: (ids, chord distances)."""
+        if len(self) == 0:
+            return self.ids, np.empty(0)
+        chords = np.sqrt(((self.xyz - point) ** 2).sum(axis=1))
+        if k < len(self):
+            # Everything tied with the k-th nearest, so ties are broken the same way every time
+            nearest = np.flatnonzero(chords <= np.partition(chords, k - 1)[k - 1])
+            return self.ids[nearest], chords[nearest]
+        return self.ids, chords
+
+    def chords(self, positions: np.ndarray, point: np.ndarray) -> np.ndarray:
+        return np.sqrt(((self.xyz[positions] - point) ** 2).sum(axis=1))
+
+
+class _State:
+    """One published version of the index. Never changed after it is published."""
+
+    def __init__(self, base: _Points, delta: _Points, imports: Dict[int, Tuple[int, Optional[datetime]]], tree=None,
+                 alive: Optional[np.ndarray] = None):
+        self.base = base
+        self.delta = delta
+        # Indexed import id -> its (measurements_count, parsed_at) when it was indexed
+        self.imports = imports
+        self.tree = tree
+        # Per base point, False once its import left the index; None while all are live
+        self.alive = alive
+        self.dead_points = 0 if alive is None else len(alive) - int(np.count_nonzero(alive))
+        self.updated_at = datetime.utcnow()
+
+    @classmethod
+    def build(cls, base: _Points, imports: Dict[int, Tuple[int, Optional[datetime]]]) -> "_State":
+        tree = cKDTree(base.xyz) if cKDTree is not None and len(base) else None
+        return cls(base, _Points.empty(), imports, tree)
+
+    def nearest(self, point: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if self.tree is not None:
+            positions = self._tree_nearest(point, k)
+            # Distances computed as the scan computes them, so the two agree on ties
+            candidates = [(self.base.ids[positions], self.base.chords(positions, point)), self.delta.nearest(point, k)]
+        else:
+            candidates = [self.base.nearest(point, k), self.delta.nearest(point, k)]
+        ids = np.concatenate([c[0] for c in candidates])
+        chords = np.concatenate([c[1] for c in candidates])
+        order = np.lexsort((ids, chords))[:k]
+        return ids[order], chords[order]
+
+    def _tree_nearest(self, point: np.ndarray, k: int) -> np.ndarray:
+        """Positions in base of the k nearest live points, and of everything tied with the k-th."""
+        wanted = min(k, len(self.base))
+        while True:
+            chords, positions = self.tree.query(point, k=wanted)
+            chords, positions = np.atleast_1d(chords), np.atleast_1d(positions)
+            if self.alive is not None:
+                live = self.alive[positions]
+                chords, positions = chords[live], positions[live]
+            if len(positions) >= k or wanted == len(self.base):
+                break
+            # Dead points took some of the places: ask for more
+            wanted = min(2 * wanted, len(self.base))
+        if len(positions) >= k:
+            # Everything tied with the k-th nearest, as when scanning
+            positions = np.asarray(self.tree.query_ball_point(point, chords[k - 1] * (1 + 1e-9)), dtype=np.int64)
+            if self.alive is not None:
+                positions = positions[self.alive[positions]]
+        return positions
+
+
+class MeasurementIndex:
+    """Nearest approved measurements to a coordinate, kept up to date by a background thread."""
+
+    def __init__(self, sync_seconds: float = settings.KNN_SYNC_SECONDS,
+                 delta_max_points: int = settings.KNN_DELTA_MAX_POINTS,
+                 dead_max_points: int = settings.KNN_DEAD_MAX_POINTS):
+        self.sync_seconds = sync_seconds
+        self.delta_max_points = delta_max_points
+        self.dead_max_points = dead_max_points
+        self.state: Optional[_State] = None
+        self.sync_requested = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state is not None
+
+    def start(self):
+        if self.thread is None:
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self._run, name="knn-index", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.stopped.set()
+            self.sync_requested.set()
+            self.thread.join()
+            self.thread = None
+
+    def request_sync(self):
+        """Picks up approval changes and finished parses now rather than at the next KNN_SYNC_SECONDS."""
+        self.sync_requested.set()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"Error updating the nearest-neighbour index: {e}")
+            self.sync_requested.wait(self.sync_seconds)
+            self.sync_requested.clear()
+
+    def sync(self):
+        """Brings the index in line with the approved imports in the database."""
+        state = self.state or _State(_Points.empty(), _Points.empty(), {})
+        db = SessionLocal()
+        try:
+            # Keyed by the import the measurements are stored under, which re-uploads share
+            approved = {i: (count, parsed_at) for i, count, parsed_at in db.execute(text("""
+                SELECT id, COALESCE(measurements_count, 0), parsed_at FROM bgeigie_imports
+                WHERE id IN (SELECT COALESCE(source_import_id, id) FROM bgeigie_imports WHERE status = 'approved')
+            """))}
+            # An import whose measurements were replaced (reparsed, whatever the count) is taken out and put back
+            removed = {i for i, version in state.imports.items() if approved.get(i) != version}
+            added = [i for i, version in approved.items() if state.imports.get(i) != version]
+            if self.state is not None and not removed and not added:
+                return
+            started = time.perf_counter()
+            new_points = self._load(db, added)
+        finally:
+            db.close()
+
+        imports = {i: version for i, version in state.imports.items() if i not in removed}
+        imports.update((i, approved[i]) for i in added)
+        base, delta, alive = state.base, state.delta, state.alive
+        if removed:
+            delta = delta.without(removed)
+            gone = np.isin(base.import_ids, list(removed))
+            if state.tree is None:
+                # Scanned directly, so there is no tree to keep
+                base = base.take(~gone)
+            elif gone.any():
+                alive = ~gone if alive is None else alive & ~gone
+        dead_points = 0 if alive is None else len(alive) - int(np.count_nonzero(alive))
+        if (self.state is None or len(delta) + len(new_points) > self.delta_max_points
+                or dead_points > self.dead_max_points):
+            live = base if alive is None else base.take(alive)
+            self.state = _State.build(live.concat(delta).concat(new_points), imports)
+        else:
+            self.state = _State(base, delta.concat(new_points), imports, state.tree, alive)
+        logger.info(f"Nearest-neighbour index: {len(added)} imports added, {len(removed)} removed "
+                    f"in {time.perf_counter() - started:.2f}s; {self.stats()}")
+
+    def _load(self, db, import_ids: List[int]) -> _Points:
+        if not import_ids:
+            return _Points.empty()
+        columns = db.connection().connection.driver_connection.execute("""
+            SELECT id, bgeigie_import_id, latitude, longitude FROM measurements
+            WHERE bgeigie_import_id IN (SELECT unnest(?))
+              AND latitude IS NOT NULL AND longitude IS NOT NULL
+              AND NOT isnan(latitude) AND NOT isnan(longitude)
+        """, [import_ids]).fetchnumpy()
+        return _Points(np.asarray(columns['id'], dtype=np.int64), np.asarray(columns['bgeigie_import_id'], dtype=np.int64),
+                       unit_vectors(columns['latitude'], columns['longitude']))
+
+    def nearest(self, latitude: float, longitude: float, k: int) -> List[Tuple[int, float]]:
+        """The k approved measurements nearest to the coordinate, nearest first: (id, distance in km)."""
+        state = self.state
+        if state is None or k < 1:
+            return []
+        ids, chords = state.nearest(unit_vectors([latitude], [longitude])[0], k)
+        return list(zip(ids.tolist(), chord_to_km(chords).tolist()))
+
+    def stats(self) -> dict:
+        state = self.state
+        if state is None:
+            return {"ready": False, "backend": "cKDTree" if cKDTree is not None else "scan"}
+        tree_bytes = 0
+        if state.tree is not None:
+            # The tree references base.xyz; it adds its index permutation and nodes (estimated)
+            tree_bytes = state.tree.indices.nbytes + state.tree.size * _TREE_NODE_BYTES
+        return {
+            "ready": True,
+            "backend": "cKDTree" if cKDTree is not None else "scan",
+            "imports": len(state.imports),
+            "points": len(state.base) + len(state.delta) - state.dead_points,
+            "delta_points": len(state.delta),
+            "dead_points": state.dead_points,
+            "memory_bytes": state.base.nbytes + state.delta.nbytes + tree_bytes,
+            "updated_at": state.updated_at,
+        }
+
+
+# Approximate size of a cKDTree node (split dimension and value, children, bounds, counts)
+_TREE_NODE_BYTES = 72
+
+measurement_index = MeasurementIndex()
@@ -0,0 +1,100 @@
+"""
+Compressed bGeigie log uploads.
+
+Logs may be uploaded as plain .log files, .log.gz, .log.zst or .zip archives. The stored
+blob is kept compressed and decompressed as a stream straight into the parser, so the
+uncompressed log never lands on disk or in memory as a whole. A .zip may hold several
+logs; each member becomes its own import.
+"""
+import contextlib
+import gzip
+import zipfile
+import zlib
+from typing import List, Optional
+
+try:
+    import zstandard
+except ImportError:  # .log.zst uploads need the optional zstandard package
+    zstandard = None
+
+# Errors raised while reading a corrupt or truncated compressed log
+DECOMPRESSION_ERRORS = (gzip.BadGzipFile, zlib.error, EOFError, zipfile.BadZipFile)
+if zstandard is not None:
+    DECOMPRESSION_ERRORS += (zstandard.ZstdError,)
+
+PLAIN = 'log'
+GZIP = 'gzip'
+ZSTD = 'zstd'
+ZIP = 'zip'
+
+# Upload file name suffixes and the format they announce
+SUFFIXES = {
+    '.log': PLAIN,
+    '.log.gz': GZIP,
+    '.log.zst': ZSTD,
+    '.zip': ZIP,
+}
+
+# Leading bytes identifying each compressed format
+_MAGIC = (
+    (b'\x1f\x8b', GZIP),
+    (b'\x28\xb5\x2f\xfd', ZSTD),
+    (b'PK\x03\x04', ZIP),
+)
+
+
+def format_from_filename(filename: str) -> Optional[str]:
+    """The upload format announced by a file name, or None if it is not an accepted log."""
+    name = filename.lower()
+    for suffix, fmt in SUFFIXES.items():
+        if name.endswith(suffix):
+            return fmt
+    return None
+
+
+def sniff_format(path: str) -> str:
+    """The format of a stored log, judged by its leading bytes; anything unrecognised is plain text."""
+    with open(path, 'rb') as f:
+        head = f.read(4)
+    for magic, fmt in _MAGIC:
+        if head.startswith(magic):
+            return fmt
+    return PLAIN
+
+
+def _is_log_member(info: zipfile.ZipInfo) -> bool:
+    name = info.filename
+    return (not info.is_dir() and name.lower().endswith('.log')
+            and not name.startswith('__MACOSX/') and not name.rsplit('/', 1)[-1].startswith('.'))
+
+
+def zip_members(path: str) -> List[str]:
+    """Names of the .log members of a zip archive, in archive order."""
+    with zipfile.ZipFile(path) as archive:
+        return [info.filename for info in archive.infolist() if _is_log_member(info)]
+
+
+@contextlib.contextmanager
+def open_log(path: str, member: Optional[str] = None):
+    """
+    Opens a stored log as a binary stream of its decompressed contents.
+    `member` names the log inside a zip archive. Raises ValueError for an unsupported format.
+    """
+    fmt = sniff_format(path)
+    if fmt == ZIP:
+        if member is None:
+            raise ValueError("A zip archive member name is required")
+        with zipfile.ZipFile(path) as archive, archive.open(member) as stream:
+            yield stream
+    elif fmt == GZIP:
+        with gzip.open(path, 'rb') as stream:
+            yield stream
+    elif fmt == ZSTD:
+        if zstandard is None:
+            raise ValueError("zstd compressed logs require the zstandard package")
+        with open(path, 'rb') as f, zstandard.ZstdDecompressor().stream_reader(f) as stream:
+            yield stream
+    else:
+        with open(path, 'rb') as stream:
+            yield stream
+
@@ -1,15 +1,19 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse
 from pathlib import Path
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqladmin import Admin, ModelView
 from contextlib import asynccontextmanager
-from .database import setup_database, SQLALCHEMY_DATABASE_URL
-from .routers import users, bgeigie_imports, measurements, devices, device_stories
+from .database import setup_database, create_duckdb_engine
+from .routers import users, bgeigie_imports, measurements, devices, device_stories, jobs, tiles
 from .background_tasks import start_background_processor, stop_background_processor
+from .db_writer import WriterBusy, WriterUnavailable, writer, start_writer, stop_writer
+from .snapshots import SnapshotPublisher
+from .knn_index import measurement_index
+from .config import settings
+from .query_governor import QueryTimeout, ClientDisconnected
 from . import models
 
 load_dotenv()  # Load environment variables from .env file
@@ -17,10 +21,12 @@ load_dotenv()  # Load environment variables from .env file
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup logic
-    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    engine = create_duckdb_engine()
     app.state.db_engine = engine
     app.state.db_sessionmaker = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    setup_database(engine)
+    # Reader workers serve a read-only snapshot; the writer process sets up the database
+    if settings.SERVING_MODE != "reader":
+        setup_database(engine)
 
     # Setup admin interface
     admin = Admin(app, engine)
@@ -32,15 +38,53 @@ async def lifespan(app: FastAPI):
     admin.add_view(DeviceStoryCommentAdmin)
     admin.add_view(BGeigieLogAdmin)
 
+    # Loads in the background; /measurements/spatial/knn answers 503 until it is ready
+    measurement_index.start()
+
+    if settings.SERVING_MODE == "reader":
+        yield
+        measurement_index.stop()
+        return
+
+    # All writes go through the single database writer; it starts first and stops last
+    start_writer()
+    publisher = None
+    if settings.SERVING_MODE == "writer":
+        publisher = SnapshotPublisher(writer, engine)
+        publisher.start()
     await start_background_processor()
     
     yield
     
     # Shutdown logic
     await stop_background_processor()
+    if publisher is not None:
+        publisher.stop()
+    stop_writer()
+    measurement_index.stop()
 
 app = FastAPI(lifespan=lifespan)
 
+@app.exception_handler(WriterBusy)
+async def writer_busy_handler(request: Request, exc: WriterBusy):
+    # The write queue is full: ask the client to back off instead of piling on more writes
+    return JSONResponse(status_code=503, content={"detail": "Server busy, please retry"},
+                        headers={"Retry-After": "5"})
+
+@app.exception_handler(WriterUnavailable)
+async def writer_unavailable_handler(request: Request, exc: WriterUnavailable):
+    # A reader worker got a write: the proxy should send writes to the writer process
+    return JSONResponse(status_code=503, content={"detail": "Writes are served by the writer process"})
+
+@app.exception_handler(QueryTimeout)
+async def query_timeout_handler(request: Request, exc: QueryTimeout):
+    return JSONResponse(status_code=504, content={"detail": f"Query timed out: {exc}"})
+
+@app.exception_handler(ClientDisconnected)
+async def client_disconnected_handler(request: Request, exc: ClientDisconnected):
+    # Nobody is listening any more; 499 (client closed request) shows up in the access log
+    return JSONResponse(status_code=499, content={"detail": "Client closed request"})
+
 class UserAdmin(ModelView, model=models.User):
     column_list = [models.User.id, models.User.email, models.User.role, models.User.is_active]
 
@@ -68,6 +112,8 @@ app.include_router(bgeigie_imports.router, prefix="/bgeigie-imports", tags=["bge
 app.include_router(measurements.router, prefix='/measurements', tags=['measurements'])
 app.include_router(devices.router, prefix='/devices', tags=['devices'])
 app.include_router(device_stories.router, prefix='/device_stories', tags=['device_stories'])
+app.include_router(jobs.router, prefix='/jobs', tags=['jobs'])
+app.include_router(tiles.router, prefix='/tiles', tags=['tiles'])
 
 app.mount("/static", StaticFiles(directory=str(Path(__file__).parent / "static")), name="static")
 
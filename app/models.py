@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Float, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Float, DateTime, Sequence, BigInteger, Double
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -6,7 +6,7 @@ from .database import Base
 class User(Base):
     __tablename__ = "users"
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
+    id = Column(Integer, Sequence("users_id_seq"), primary_key=True)
     email = Column(String, unique=True, index=True)
     name = Column(String)
     hashed_password = Column(String)
@@ -21,7 +21,7 @@ class User(Base):
 class BGeigieImport(Base):
     __tablename__ = "bgeigie_imports"
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
+    id = Column(Integer, Sequence("bgeigie_imports_id_seq"), primary_key=True)
     source = Column(String)
     md5sum = Column(String)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -41,6 +41,12 @@ class BGeigieImport(Base):
     auto_apprv_gps_validity = Column(Boolean, default=False)
     auto_apprv_no_high_cpm = Column(Boolean, default=False)
     auto_apprv_no_zero_cpm = Column(Boolean, default=False)
+    parse_report = Column(String, nullable=True)  # JSON: dropped line counts and sample line numbers by reason
+    archive_member = Column(String, nullable=True)  # Name of the log inside a .zip upload
+    # A re-upload of bytes another user already uploaded shares that import's measurements instead
+    # of holding a copy. No foreign key: the source may be deleted (see crud.delete_bgeigie_import_records)
+    source_import_id = Column(Integer, nullable=True)
+    parsed_at = Column(DateTime, nullable=True)  # When the log was last parsed, whatever it held
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="bgeigie_imports")
@@ -48,23 +54,60 @@ class BGeigieImport(Base):
     devices = relationship("Device", back_populates="bgeigie_import")
     logs = relationship("BGeigieLog", back_populates="bgeigie_import")
 
+    @property
+    def measurements_import_id(self) -> int:
+        """The import id the measurements are stored under: the source's for a shared re-upload."""
+        return self.source_import_id or self.id
+
 class Measurement(Base):
     __tablename__ = "measurements"
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
+    id = Column(Integer, Sequence("measurements_id_seq"), primary_key=True)
     cpm = Column(Integer)
     latitude = Column(Float)
     longitude = Column(Float)
     altitude = Column(Float, nullable=True)
     captured_at = Column(DateTime)
     bgeigie_import_id = Column(Integer, ForeignKey("bgeigie_imports.id"))
+    # Hierarchical cell of the coordinates (see spatial.py), set at ingest
+    spatial_cell = Column(BigInteger, index=True)
 
     bgeigie_import = relationship("BGeigieImport", back_populates="measurements")
 
+class MapChange(Base):
+    """
+    An import's measurements joined or left the approved data, over the given extent;
+    the map tiles overlapping it are rendered again (see tiles.py).
+    """
+    __tablename__ = "map_changes"
+
+    id = Column(Integer, Sequence("map_changes_id_seq"), primary_key=True)
+    bgeigie_import_id = Column(Integer)  # No foreign key: the change outlives a deleted import
+    lat_min = Column(Double)
+    lat_max = Column(Double)
+    lon_min = Column(Double)
+    lon_max = Column(Double)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class GridAggregate(Base):
+    """
+    CPM readings of the approved measurements in one spatial cell of a grid level, kept up
+    to date as imports are approved, rejected and deleted (see grid_aggregates.py).
+    """
+    __tablename__ = "grid_aggregates"
+
+    level = Column(Integer, primary_key=True)
+    cell = Column(BigInteger, primary_key=True)  # spatial_cell >> 2 * (CELL_LEVEL - level)
+    cpm_sum = Column(BigInteger)
+    cpm_count = Column(BigInteger)
+    cpm_min = Column(Integer)
+    cpm_max = Column(Integer)
+    last_captured_at = Column(DateTime)
+
 class Device(Base):
     __tablename__ = "devices"
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
+    id = Column(Integer, Sequence("devices_id_seq"), primary_key=True)
     unit = Column(String)
     sensor = Column(String)
     bgeigie_import_id = Column(Integer, ForeignKey("bgeigie_imports.id"), nullable=True)
@@ -75,7 +118,7 @@ class Device(Base):
 class DeviceStory(Base):
     __tablename__ = "device_stories"
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
+    id = Column(Integer, Sequence("device_stories_id_seq"), primary_key=True)
     title = Column(String, index=True)
     content = Column(String)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -88,7 +131,7 @@ class DeviceStory(Base):
 class DeviceStoryComment(Base):
     __tablename__ = "device_story_comments"
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
+    id = Column(Integer, Sequence("device_story_comments_id_seq"), primary_key=True)
     content = Column(String(1000))
     device_story_id = Column(Integer, ForeignKey("device_stories.id"))
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -100,7 +143,7 @@ class DeviceStoryComment(Base):
 class BGeigieLog(Base):
     __tablename__ = "bgeigie_logs"
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
+    id = Column(Integer, Sequence("bgeigie_logs_id_seq"), primary_key=True)
     cpm = Column(Integer)
     latitude = Column(Float)
     longitude = Column(Float)
@@ -112,14 +155,14 @@ class BGeigieLog(Base):
 class Map(Base):
     __tablename__ = "maps"
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
+    id = Column(Integer, Sequence("maps_id_seq"), primary_key=True)
 
     measurement_imports = relationship("MeasurementImport", back_populates="map")
 
 class MeasurementImport(Base):
     __tablename__ = "measurement_imports"
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
+    id = Column(Integer, Sequence("measurement_imports_id_seq"), primary_key=True)
     source = Column(String)
     md5sum = Column(String)
     status = Column(String, default="unprocessed")
@@ -132,7 +175,7 @@ class MeasurementImport(Base):
 class MeasurementImportLog(Base):
     __tablename__ = "measurement_import_logs"
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
+    id = Column(Integer, Sequence("measurement_import_logs_id_seq"), primary_key=True)
     measurement_import_id = Column(Integer, ForeignKey("measurement_imports.id"))
 
     measurement_import = relationship("MeasurementImport", back_populates="logs")
@@ -140,7 +183,7 @@ class MeasurementImportLog(Base):
 class DriveImport(Base):
     __tablename__ = "drive_imports"
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
+    id = Column(Integer, Sequence("drive_imports_id_seq"), primary_key=True)
     source = Column(String)
     md5sum = Column(String)
     status = Column(String, default="unprocessed")
@@ -148,13 +191,13 @@ class DriveImport(Base):
 class DriveLog(Base):
     __tablename__ = "drive_logs"
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
+    id = Column(Integer, Sequence("drive_logs_id_seq"), primary_key=True)
     drive_import_id = Column(Integer, ForeignKey("drive_imports.id"))
 
 class IngestMeasurement(Base):
     __tablename__ = "ingest_measurements"
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
+    id = Column(Integer, Sequence("ingest_measurements_id_seq"), primary_key=True)
     cpm = Column(Integer)
     latitude = Column(Float)
     longitude = Column(Float)
@@ -162,5 +205,30 @@ class IngestMeasurement(Base):
 class UploaderContactHistory(Base):
     __tablename__ = "uploader_contact_histories"
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
+    id = Column(Integer, Sequence("uploader_contact_histories_id_seq"), primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"))
+
+class Job(Base):
+    """A background job; rows outlive restarts so queued and interrupted work is picked up again."""
+    __tablename__ = "jobs"
+
+    id = Column(String, primary_key=True)
+    type = Column(String)
+    data = Column(String)  # JSON arguments for the handler
+    user_id = Column(Integer, nullable=True)
+    idempotency_key = Column(String, unique=True, nullable=True)
+    status = Column(String, default="queued")  # queued, processing, completed, dead
+    priority = Column(Integer, default=5)  # Lower runs sooner; see background_tasks.PRIORITY_*
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=5)
+    run_after = Column(DateTime, default=datetime.utcnow)
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    progress = Column(String, nullable=True)  # JSON counters reported by the handler
+    insert_seconds = Column(Float, default=0.0)
+    result = Column(String, nullable=True)  # JSON value returned by the handler
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    claimed_at = Column(DateTime, nullable=True)  # Latest claim; drives round-robin between users
+    completed_at = Column(DateTime, nullable=True)
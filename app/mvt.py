@@ -0,0 +1,90 @@
+"""
+Mapbox Vector Tile (MVT 2.1) encoding of point layers.
+
+Only what the map tiles need: one layer of points, each with a few integer or float
+properties. The protobuf is written directly, without the protobuf runtime:
+
+    Tile    { repeated Layer layers = 3; }
+    Layer   { uint32 version = 15; string name = 1; repeated Feature features = 2;
+              repeated string keys = 3; repeated Value values = 4; uint32 extent = 5; }
+    Feature { repeated uint32 tags = 2 [packed]; GeomType type = 3;
+              repeated uint32 geometry = 4 [packed]; }
+    Value   { double double_value = 3; uint64 uint_value = 5; sint64 sint_value = 6; }
+"""
+import struct
+from typing import Dict, Iterable, List, Tuple, Union
+
+MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+DEFAULT_EXTENT = 4096
+
+_POINT = 1
+_MOVE_TO_ONE = (1 << 3) | 1  # MoveTo command, count 1
+
+_VARINT, _FIXED64, _BYTES = 0, 1, 2
+
+Property = Union[int, float]
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _key(field: int, wire_type: int) -> bytes:
+    return _varint((field << 3) | wire_type)
+
+
+def _bytes_field(field: int, payload: bytes) -> bytes:
+    return _key(field, _BYTES) + _varint(len(payload)) + payload
+
+
+def _packed(field: int, values: Iterable[int]) -> bytes:
+    return _bytes_field(field, b"".join(_varint(value) for value in values))
+
+
+def _value(value: Property) -> bytes:
+    if isinstance(value, float):
+        return _key(3, _FIXED64) + struct.pack("<d", value)
+    if value < 0:
+        return _key(6, _VARINT) + _varint(_zigzag(value))
+    return _key(5, _VARINT) + _varint(value)
+
+
+def encode_point_layer(name: str, points: Iterable[Tuple[int, int, Dict[str, Property]]],
+                       extent: int = DEFAULT_EXTENT) -> bytes:
+    """
+    A tile with one layer of points, given as (x, y, properties) in tile coordinates
+    (0..extent, y down). Returns an empty tile when there are no points.
+    """
+    keys: Dict[str, int] = {}
+    values: Dict[Tuple[type, Property], int] = {}
+    features: List[bytes] = []
+    for x, y, properties in points:
+        tags = []
+        for key, value in properties.items():
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(value), value), len(values)))
+        features.append(_bytes_field(2, (
+            _packed(2, tags)
+            + _key(3, _VARINT) + _varint(_POINT)
+            + _packed(4, (_MOVE_TO_ONE, _zigzag(x), _zigzag(y)))
+        )))
+    if not features:
+        return b""
+    layer = (
+        _key(15, _VARINT) + _varint(2)
+        + _bytes_field(1, name.encode())
+        + b"".join(features)
+        + b"".join(_bytes_field(3, key.encode()) for key in keys)
+        + b"".join(_bytes_field(4, _value(value)) for _, value in values)
+        + _key(5, _VARINT) + _varint(extent)
+    )
+    return _bytes_field(3, layer)
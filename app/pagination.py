@@ -0,0 +1,43 @@
+"""
+Keyset (cursor) pagination for list endpoints.
+
+A page is fetched with `WHERE id > <last id of the previous page> ORDER BY id LIMIT n`
+instead of OFFSET, so deep pages cost no more than the first: DuckDB skips whole row
+groups whose id range lies before the cursor instead of reading and discarding `skip`
+rows. When a page is full, the response carries the cursor of the next one in the
+X-Next-Cursor header; clients pass it back as ?cursor= and stop when the header is absent.
+
+Cursors are opaque to clients. `skip` keeps working for existing clients, without cursors.
+"""
+import base64
+import binascii
+import json
+from typing import Optional
+
+from fastapi import HTTPException, Response
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"id": last_id}).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[int]:
+    """The last id of the previous page, or None for the first page. Raises HTTP 400 for a malformed cursor."""
+    if cursor is None:
+        return None
+    try:
+        value = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        last_id = value["id"]
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(last_id, int):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return last_id
+
+
+def set_next_cursor(response: Response, page: list, limit: int, id_of=lambda row: row.id):
+    """Points the client at the next page, if this one is full (a shorter page is the last)."""
+    if len(page) == limit and page:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(id_of(page[-1]))
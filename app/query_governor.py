@@ -0,0 +1,131 @@
+"""
+Query governor for read queries.
+
+Reads that may be heavy run in one of two pools instead of on the request's session:
+`interactive` for the quick queries behind pages and the map, and `analytics` for scans
+over the whole measurements table. Each pool has its own connections and runs at most a
+fixed number of queries at once. Every query gets a deadline: one still running when the
+deadline passes, or whose client has gone away, is stopped with DuckDB's interrupt() and
+its connection goes back to the pool.
+
+DuckDB's threads, memory_limit and temp_directory cover the whole database in a process,
+so they are set once for every connection (see database.create_duckdb_engine).
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from fastapi import Request
+from sqlalchemy.orm import sessionmaker
+
+from .config import settings
+from .database import create_duckdb_engine
+
+logger = logging.getLogger(__name__)
+
+# How often a waiting request checks its deadline and whether the client is still there
+POLL_SECONDS = 0.1
+
+
+class QueryTimeout(Exception):
+    """A query ran past its deadline, or waited that long for a free slot."""
+
+
+class ClientDisconnected(Exception):
+    """The client went away while its query was running."""
+
+
+class _RunningQuery:
+    """The connection a query runs on, so another thread can interrupt it."""
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.connection = None
+        self.stopped_for = None
+
+    def stop(self, reason: str):
+        self.stopped_for = reason
+        connection = self.connection
+        if connection is not None:
+            connection.interrupt()
+
+
+class QueryPool:
+    """A class of read queries with its own connections, concurrency limit and timeout."""
+
+    def __init__(self, name: str, concurrency: int, timeout_seconds: float):
+        self.name = name
+        self.timeout = timeout_seconds
+        self.engine = create_duckdb_engine(pool_size=concurrency, max_overflow=0)
+        self.sessionmaker = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"query-{name}")
+        self.slots = asyncio.Semaphore(concurrency)
+
+    async def run(self, request: Optional[Request], fn: Callable[..., Any], *args,
+                  timeout: Optional[float] = None) -> Any:
+        """
+        Runs fn(db, *args) on one of the pool's sessions and returns its result, which must be
+        fully loaded (the session is closed afterwards). Raises QueryTimeout once `timeout`
+        seconds (default: the pool's) have passed, counting the wait for a slot, and
+        ClientDisconnected when request's client goes away first.
+        """
+        loop = asyncio.get_running_loop()
+        timeout = self.timeout if timeout is None else timeout
+        deadline = loop.time() + timeout
+        try:
+            await asyncio.wait_for(self.slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise QueryTimeout(f"No {self.name} query slot came free within {timeout:g}s")
+        query = _RunningQuery(timeout)
+        try:
+            future = loop.run_in_executor(self.executor, self._execute, query, fn, args)
+        except BaseException:
+            self.slots.release()
+            raise
+        # The slot frees up when the thread is done with its connection, which may be after a cancelled caller left
+        future.add_done_callback(self._finished)
+        try:
+            while True:
+                done, _ = await asyncio.wait({future}, timeout=POLL_SECONDS)
+                if done:
+                    return future.result()
+                # Keep interrupting until the thread gives up: the first interrupt may land between statements
+                if loop.time() >= deadline:
+                    query.stop("timeout")
+                elif query.stopped_for == "disconnect" or (request is not None and await request.is_disconnected()):
+                    query.stop("disconnect")
+        except asyncio.CancelledError:
+            query.stop("cancelled")
+            raise
+
+    def _finished(self, future: asyncio.Future):
+        self.slots.release()
+        # Nobody awaits the outcome of a query whose caller was cancelled; mark it retrieved
+        if not future.cancelled():
+            future.exception()
+
+    def _execute(self, query: _RunningQuery, fn: Callable[..., Any], args: tuple) -> Any:
+        db = self.sessionmaker()
+        try:
+            query.connection = db.connection().connection.driver_connection
+            if query.stopped_for is None:
+                return fn(db, *args)
+        except Exception as e:
+            if query.stopped_for is None:
+                raise
+            logger.info(f"Interrupted {self.name} query ({query.stopped_for}): {e}")
+        finally:
+            query.connection = None
+            db.close()
+        if query.stopped_for == "timeout":
+            raise QueryTimeout(f"The {self.name} query took longer than {query.timeout:g}s")
+        raise ClientDisconnected()
+
+
+# Quick lookups behind pages and the map
+interactive = QueryPool("interactive", settings.QUERY_INTERACTIVE_CONCURRENCY,
+                        settings.QUERY_INTERACTIVE_TIMEOUT_SECONDS)
+# Scans and aggregates over the measurements table
+analytics = QueryPool("analytics", settings.QUERY_ANALYTICS_CONCURRENCY,
+                      settings.QUERY_ANALYTICS_TIMEOUT_SECONDS)
@@ -1,45 +1,51 @@
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Request
+from typing import List, Optional, Union
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Request, Response
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from sqlalchemy import text
 from datetime import datetime
 from .. import crud, models, schemas
 from ..security import get_db, get_current_active_user, get_current_admin_user, get_optional_user
-from .. import bgeigie_parser
+from .. import log_archives, upload_store
+from ..db_writer import write
+from ..knn_index import measurement_index
+from ..pagination import decode_cursor, set_next_cursor
+from ..streaming import stream_rows
+from .. import packed_track, track_decimation
 from ..email_service import send_bgeigie_notification_email
+from ..background_tasks import (get_active_import_job, queue_bgeigie_processing, queue_bgeigie_reprocessing,
+                                PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_BULK)
+from ..config import settings
+import json
+import math
 import os
+import posixpath
+import zipfile
 
 router = APIRouter()
 templates = Jinja2Templates(directory="app/templates")
 
-def should_auto_approve(measurements: List[dict], max_cpm: int) -> bool:
+def should_auto_approve_counts(measurements_count: int, valid_coordinates: int, max_cpm: int) -> bool:
     """
     Auto-approval logic based on quality thresholds matching official Safecast criteria.
+    Works on running counters so streamed imports never need the full measurement list;
+    valid_coordinates counts plausible, non-zero GPS fixes (see BackgroundJobProcessor._valid_gps).
     """
     # Quality thresholds for auto-approval
     MIN_MEASUREMENTS = 100  # Minimum number of measurements
     MAX_CPM_THRESHOLD = 10000  # Maximum reasonable CPM value
-    MIN_GPS_ACCURACY = 0.001  # Minimum GPS coordinate precision
     
     # Check minimum measurement count
-    if len(measurements) < MIN_MEASUREMENTS:
+    if measurements_count < MIN_MEASUREMENTS:
         return False
     
     # Check for reasonable CPM values
     if max_cpm > MAX_CPM_THRESHOLD:
         return False
     
-    # Check for GPS coordinate validity
-    valid_coordinates = 0
-    for m in measurements:
-        if (abs(m['latitude']) > 0.001 and abs(m['longitude']) > 0.001 and
-            -90 <= m['latitude'] <= 90 and -180 <= m['longitude'] <= 180):
-            valid_coordinates += 1
-    
     # Require at least 90% valid GPS coordinates
-    if valid_coordinates / len(measurements) < 0.9:
+    if valid_coordinates / measurements_count < 0.9:
         return False
     
     return True
@@ -47,26 +53,35 @@ def should_auto_approve(measurements: List[dict], max_cpm: int) -> bool:
 
 @router.get("/")
 def read_bgeigie_imports(
+    response: Response,
+    cursor: Optional[str] = None,
     skip: int = 0,
     limit: int = 100,
     db: Session = Depends(get_db),
     current_user: Optional[models.User] = Depends(get_optional_user)
 ):
-    # Public access - show all approved imports, or user's own imports if logged in
-    if current_user and current_user.role == 'admin':
-        # Admins see all imports
-        imports = db.query(models.BGeigieImport).join(models.User).offset(skip).limit(limit).all()
-    elif current_user:
+    """Imports in id order; page with the X-Next-Cursor response header (see pagination.py)."""
+    after_id = decode_cursor(cursor)
+    # Public access - show all approved imports, or user's own imports if logged in; admins see all imports
+    query = db.query(models.BGeigieImport).join(models.User)
+    if current_user and current_user.role != 'admin':
         # Logged in users see their own imports plus all approved ones
-        imports = db.query(models.BGeigieImport).join(models.User).filter(
+        query = query.filter(
             (models.BGeigieImport.user_id == current_user.id) | 
             (models.BGeigieImport.status == 'approved')
-        ).offset(skip).limit(limit).all()
-    else:
+        )
+    elif not current_user:
         # Anonymous users see only approved imports
-        imports = db.query(models.BGeigieImport).join(models.User).filter(
+        query = query.filter(
             models.BGeigieImport.status == 'approved'
-        ).offset(skip).limit(limit).all()
+        )
+    query = query.order_by(models.BGeigieImport.id)
+    if after_id is not None:
+        imports = query.filter(models.BGeigieImport.id > after_id).limit(limit).all()
+    else:
+        imports = query.offset(skip).limit(limit).all()
+    if skip == 0 or after_id is not None:
+        set_next_cursor(response, imports, limit)
     
     # Convert to dict format with user information
     result = []
@@ -127,6 +142,32 @@ async def get_import(
     }
 
 
+@router.get("/{import_id}/parse-report")
+async def get_import_parse_report(
+    import_id: int,
+    db: Session = Depends(get_db),
+    current_user: Optional[models.User] = Depends(get_optional_user)
+):
+    """Get the lines dropped while parsing the import's log, counted by reason with sample line numbers"""
+    db_import = db.query(models.BGeigieImport).filter(
+        models.BGeigieImport.id == import_id
+    ).first()
+    
+    if not db_import:
+        raise HTTPException(status_code=404, detail="Import not found")
+    if not db_import.parse_report:
+        raise HTTPException(status_code=404, detail="Import has not been parsed yet")
+    
+    report = json.loads(db_import.parse_report)
+    return {
+        "import_id": import_id,
+        "lines_count": db_import.lines_count,
+        "measurements_count": db_import.measurements_count,
+        "skipped_count": sum(report["counts"].values()),
+        **report
+    }
+
+
 @router.get("/{import_id}/detail", response_class=HTMLResponse)
 async def get_import_detail(
     import_id: int,
@@ -151,6 +192,12 @@ async def get_import_detail(
 @router.get("/{import_id}/measurements")
 async def get_import_measurements(
     import_id: int,
+    format: str = Query("json", pattern="^(json|ndjson|csv|packed)$",
+                        description="json, ndjson/csv to stream the rows as they are read, "
+                                    "or packed binary columns for the map (see packed_track.py)"),
+    zoom: Optional[int] = Query(None, ge=0, le=track_decimation.MAX_ZOOM,
+                                description="Map zoom to thin the track for (json and packed)"),
+    max_points: Optional[int] = Query(None, ge=2, description="Most points to return, keeping CPM peaks (json and packed)"),
     db: Session = Depends(get_db),
     current_user: Optional[models.User] = Depends(get_optional_user)
 ):
@@ -162,9 +209,47 @@ async def get_import_measurements(
     if not db_import:
         raise HTTPException(status_code=404, detail="Import not found")
     
-    # Get measurements from measurements table
+    decimated = zoom is not None or max_points is not None
+    if format == "packed" or (decimated and format == "json"):
+        # Full and decimated tracks are cached per level (see track_decimation.py)
+        track = track_decimation.import_track_columns(db, db_import, zoom, max_points)
+        if format == "packed":
+            content = packed_track.pack_track(track['latitude'], track['longitude'], track['altitude'],
+                                              track['captured_at'], track['cpm'])
+            # The map's statistics describe the whole track, however decimated
+            stats = track_decimation.import_track_stats(db, db_import)
+            return Response(content=content, media_type=packed_track.MEDIA_TYPE,
+                            headers={packed_track.STATS_HEADERS[name]: str(value) for name, value in stats.items()})
+        measurement_data = [
+            {
+                "id": id,
+                "cpm": cpm,
+                "latitude": None if math.isnan(latitude) else latitude,
+                "longitude": None if math.isnan(longitude) else longitude,
+                "altitude": None if math.isnan(altitude) else altitude,
+                "captured_at": datetime.utcfromtimestamp(captured_at).isoformat() if captured_at else "",
+            }
+            for id, latitude, longitude, altitude, captured_at, cpm in zip(
+                *(track[name].tolist() for name in ('id', 'latitude', 'longitude', 'altitude', 'captured_at', 'cpm'))
+            )
+        ]
+        return {"measurements": measurement_data, "total_count": len(measurement_data), "import_id": import_id}
+    
+    if decimated:
+        raise HTTPException(status_code=422, detail="zoom and max_points apply to the json and packed formats")
+    
+    if format != "json":
+        # Large drives stream without building a row object per measurement (see streaming.py)
+        return stream_rows(
+            select(models.Measurement.id, models.Measurement.cpm, models.Measurement.latitude,
+                   models.Measurement.longitude, models.Measurement.altitude, models.Measurement.captured_at)
+            .where(models.Measurement.bgeigie_import_id == db_import.measurements_import_id),
+            format, filename=f"import-{import_id}",
+        )
+    
+    # Get measurements from measurements table (a re-upload reads those of the import it shares them with)
     measurements = db.query(models.Measurement).filter(
-        models.Measurement.bgeigie_import_id == import_id
+        models.Measurement.bgeigie_import_id == db_import.measurements_import_id
     ).all()
     
     measurement_data = []
@@ -205,20 +290,8 @@ async def update_import_metadata(
     if db_import.status not in ["processed", "unprocessed", "approved"]:
         raise HTTPException(status_code=400, detail="Import must be processed, unprocessed, or approved to edit metadata")
     
-    # Update metadata fields
-    for field, value in metadata.dict(exclude_unset=True).items():
-        setattr(db_import, field, value)
-    
-    # Status transition and email action
-    # If already approved, keep approved and do not send email; otherwise, submitting metadata moves to submitted
-    send_email = True
-    if db_import.status == "approved":
-        send_email = False
-    elif db_import.status in ["processed", "unprocessed", "rejected", "submitted"]:
-        db_import.status = "submitted"
-    
-    db.commit()
-    db.refresh(db_import)
+    # Update metadata fields; if already approved the import stays approved, otherwise it moves to submitted
+    db_import = await write(db, crud.update_bgeigie_import_metadata, import_id, metadata.dict(exclude_unset=True))
     
     # Send email notification to the import owner
     try:
@@ -250,79 +323,115 @@ def nmea_to_decimal(nmea_coord: float, direction: str) -> float:
     
     return decimal
 
-@router.post("/", response_model=schemas.BGeigieImport)
+def _upload_result(db_bgeigie_import: models.BGeigieImport, job_id: Optional[str] = None) -> dict:
+    return {
+        "id": db_bgeigie_import.id,
+        "source": db_bgeigie_import.source,
+        "user_id": db_bgeigie_import.user_id,
+        "created_at": db_bgeigie_import.created_at,
+        "status": db_bgeigie_import.status,
+        "job_id": job_id,
+    }
+
+
+async def _import_stored_log(db: Session, user_id: int, md5sum: str, source: str,
+                             archive_member: Optional[str] = None, priority: int = PRIORITY_NORMAL) -> dict:
+    """
+    Creates (or reuses) the import for one log in the upload store and queues it for parsing.
+    Returns the upload result, whose job_id is None when no parsing was needed.
+    """
+    # The same user uploading the same bytes again gets their existing import back, with its parse job if still pending
+    existing = crud.get_bgeigie_import_by_md5(db, md5sum, user_id=user_id, archive_member=archive_member)
+    if existing:
+        return _upload_result(existing, get_active_import_job(db, existing.id))
+
+    # Bytes someone else already uploaded share that import's measurements instead of being parsed again
+    original = crud.get_bgeigie_import_by_md5(db, md5sum, archive_member=archive_member)
+    bgeigie_import_create = schemas.BGeigieImportCreate(source=source)
+    db_bgeigie_import = await write(
+        db,
+        crud.create_bgeigie_import,
+        bgeigie_import=bgeigie_import_create, 
+        user_id=user_id,
+        md5sum=md5sum,
+        archive_member=archive_member,
+        source_import_id=original.id if original else None
+    )
+    if original:
+        if db_bgeigie_import.parsed_at is not None:
+            return _upload_result(db_bgeigie_import)
+        # Still being parsed: the new import gets the results when that job completes
+        job_id = get_active_import_job(db, original.id)
+        if job_id:
+            return _upload_result(db_bgeigie_import, job_id)
+
+    # Auto-approval stays off for uploads to preserve the metadata workflow
+    job_id = await queue_bgeigie_processing(db_bgeigie_import.id, user_id=user_id, auto_approve=False,
+                                            priority=priority)
+    return _upload_result(db_bgeigie_import, job_id)
+
+
+@router.post("/", status_code=202,
+             response_model=Union[schemas.BGeigieImportUpload, List[schemas.BGeigieImportUpload]])
 async def create_bgeigie_import(
+    response: Response,
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
-    if not file.filename.lower().endswith('.log'):
-        raise HTTPException(status_code=400, detail="Invalid file type. Only .log files are accepted.")
+    """
+    Uploads a bGeigie log as .log, .log.gz, .log.zst or .zip and returns 202 Accepted once it
+    is stored; parsing happens in the background and can be followed at GET /jobs/{job_id}.
+    A zip archive creates one import per .log member and returns them as a list; the other
+    formats return one import. Re-uploads of already parsed bytes return 200 without a job;
+    re-uploads of bytes still being parsed return the job parsing them.
+    """
+    upload_format = log_archives.format_from_filename(file.filename)
+    if upload_format is None:
+        raise HTTPException(status_code=400, detail="Invalid file type. Only .log, .log.gz, .log.zst and .zip files are accepted.")
 
-    file_content = await file.read()
-    await file.close()
+    if upload_format == log_archives.ZSTD and log_archives.zstandard is None:
+        raise HTTPException(status_code=400, detail="zstd compressed logs are not supported on this server.")
 
-    if not file_content:
+    if file.size == 0:
         raise HTTPException(status_code=400, detail="File is empty.")
 
-    # Create the import record first
-    bgeigie_import_create = schemas.BGeigieImportCreate(source=file.filename)
-    db_bgeigie_import = crud.create_bgeigie_import(
-        db=db, 
-        bgeigie_import=bgeigie_import_create, 
-        user_id=current_user.id, 
-        file_content=file_content
-    )
-
-    # Parse the file and create measurements
+    # Store the raw (still compressed) upload under its md5sum while it streams in
     try:
-        decoded_content = file_content.decode('utf-8')
-        measurements_data = bgeigie_parser.parse_bgeigie_log(decoded_content)
-        
-        # Filter data to match the Measurement model
-        filtered_measurements = [
-            {
-                'cpm': m['cpm'],
-                'latitude': m['latitude'],
-                'longitude': m['longitude'],
-                'altitude': m.get('altitude'),
-                'captured_at': m['captured_at'],
-            }
-            for m in measurements_data
-        ]
+        md5sum, file_path, size = await upload_store.store_upload(file)
+    finally:
+        await file.close()
+    if size == 0:
+        raise HTTPException(status_code=400, detail="File is empty.")
 
-        if filtered_measurements:
-            # Create measurement records
-            crud.create_measurements(db=db, measurements=filtered_measurements, bgeigie_import_id=db_bgeigie_import.id)
-            
-            # Update import with measurement count and max CPM
-            max_cpm = max([m['cpm'] for m in filtered_measurements]) if filtered_measurements else 0
-            db_bgeigie_import.measurements_count = len(filtered_measurements)
-            db_bgeigie_import.status = "processed"
-            
-            # Remove auto-approval to allow metadata entry
-            # Auto-approval logic disabled to preserve metadata workflow
-            # if should_auto_approve(filtered_measurements, max_cpm):
-            #     db_bgeigie_import.status = "approved"
-            #     db_bgeigie_import.approved_at = datetime.utcnow()
-            #     db_bgeigie_import.approved_by = "auto-approval"
-            
-            db.commit()
-            db.refresh(db_bgeigie_import)
-
-    except UnicodeDecodeError:
-        raise HTTPException(status_code=400, detail="Invalid file encoding. Only UTF-8 is supported.")
-    except Exception as e:
-        # Here you might want to delete the bgeigie_import record if parsing fails
-        raise HTTPException(status_code=500, detail=f"Failed to parse and process file: {e}")
+    # Small uploads are parsed ahead of large ones, and multi-log archives behind both
+    priority = PRIORITY_HIGH if size <= settings.JOB_SMALL_IMPORT_BYTES else PRIORITY_NORMAL
+    if upload_format != log_archives.ZIP:
+        results = [await _import_stored_log(db, current_user.id, md5sum, file.filename, priority=priority)]
+    else:
+        try:
+            members = log_archives.zip_members(file_path)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail="Invalid zip archive.")
+        if not members:
+            raise HTTPException(status_code=400, detail="The zip archive contains no .log files.")
+        if len(members) > 1:
+            priority = PRIORITY_BULK
+        results = [
+            await _import_stored_log(db, current_user.id, md5sum, posixpath.basename(member), member, priority)
+            for member in members
+        ]
 
-    return db_bgeigie_import
+    if not any(result["job_id"] for result in results):
+        response.status_code = 200
+    return results if upload_format == log_archives.ZIP else results[0]
 
 @router.patch("/{id}/submit")
 async def submit_bgeigie_import(id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_active_user)):
-    db_import = crud.update_bgeigie_import_status(db, id, "submitted", current_user.id)
+    db_import = await write(db, crud.update_bgeigie_import_status, id, "submitted", current_user.id)
     if not db_import:
         raise HTTPException(status_code=404, detail="Import not found")
+    measurement_index.request_sync()
     
     # Send email notification to the import owner
     try:
@@ -340,9 +449,11 @@ async def submit_bgeigie_import(id: int, db: Session = Depends(get_db), current_
 
 @router.patch("/{id}/approve")
 async def approve_bgeigie_import(id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_admin_user)):
-    db_import = crud.update_bgeigie_import_status(db, id, "approved")
+    db_import = await write(db, crud.update_bgeigie_import_status, id, "approved")
     if not db_import:
         raise HTTPException(status_code=404, detail="Import not found")
+    # The nearest-neighbour index only holds approved imports
+    measurement_index.request_sync()
     
     # Send email notification to the import owner
     try:
@@ -361,9 +472,10 @@ async def approve_bgeigie_import(id: int, db: Session = Depends(get_db), current
 
 @router.patch("/{id}/reject")
 async def reject_bgeigie_import(id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_admin_user)):
-    db_import = crud.update_bgeigie_import_status(db, id, "rejected")
+    db_import = await write(db, crud.update_bgeigie_import_status, id, "rejected")
     if not db_import:
         raise HTTPException(status_code=404, detail="Import not found")
+    measurement_index.request_sync()
     
     # Send email notification to the import owner (only when newly submitted)
     send_email = True
@@ -388,73 +500,23 @@ async def reject_bgeigie_import(id: int, db: Session = Depends(get_db), current_
     
     return db_import
 
-@router.patch("/{id}/process")
+@router.patch("/{id}/process", status_code=202)
 async def process_bgeigie_import(id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_active_user)):
-    """Manually trigger processing of an uploaded bGeigie import"""
+    """
+    Manually trigger processing of an uploaded bGeigie import. The work is queued at high
+    priority, ahead of bulk uploads; follow it at GET /jobs/{job_id}. The owner is emailed when it is done.
+    """
     # Get the import record
     db_import = db.query(models.BGeigieImport).filter(models.BGeigieImport.id == id).first()
     if not db_import:
         raise HTTPException(status_code=404, detail="Import not found")
     
-    # Read file content from disk
-    file_path = f"uploads/{db_import.source}"
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            decoded_content = f.read()
-    except FileNotFoundError:
+    file_path = upload_store.import_file_path(db_import)
+    if not os.path.isfile(file_path):
         raise HTTPException(status_code=400, detail="File not found on disk")
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error reading file: {str(e)}")
     
-    # Parse the file and create measurements
-    try:
-        measurements_data = bgeigie_parser.parse_bgeigie_log(decoded_content)
-        
-        # Filter data to match the Measurement model
-        filtered_measurements = [
-            {
-                'cpm': m['cpm'],
-                'latitude': m['latitude'],
-                'longitude': m['longitude'],
-                'altitude': m.get('altitude'),
-                'captured_at': m['captured_at'],
-            }
-            for m in measurements_data
-        ]
-
-        if filtered_measurements:
-            # Delete existing measurements for this import
-            db.query(models.Measurement).filter(models.Measurement.bgeigie_import_id == id).delete()
-            
-            # Create new measurement records
-            crud.create_measurements(db=db, measurements=filtered_measurements, bgeigie_import_id=id)
-            
-            # Update import with measurement count and status
-            db_import.measurements_count = len(filtered_measurements)
-            db_import.status = "processed"
-            db.commit()
-            db.refresh(db_import)
-            
-            # Send email notification to the import owner
-            try:
-                await send_bgeigie_notification_email(
-                    recipient_email=db_import.user.email,
-                    recipient_name=db_import.user.name or db_import.user.email,
-                    action="processed",
-                    import_id=db_import.id,
-                    import_filename=db_import.source
-                )
-            except Exception as e:
-                print(f"Failed to send processing email: {e}")
-            
-            return {"message": f"Successfully processed {len(filtered_measurements)} measurements", "import": db_import}
-        else:
-            raise HTTPException(status_code=400, detail="No valid measurements found in file")
-
-    except UnicodeDecodeError:
-        raise HTTPException(status_code=400, detail="Invalid file encoding. Only UTF-8 is supported.")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to parse and process file: {e}")
+    job_id = await queue_bgeigie_reprocessing(id, user_id=db_import.user_id)
+    return {"message": "Processing queued", "job_id": job_id, "import": db_import}
 
 @router.delete("/{id}")
 async def delete_bgeigie_import(
@@ -485,64 +547,40 @@ async def delete_bgeigie_import(
     # Owned by current user
     db_import = db_import_any
     
+    # What the email and the file cleanup need, read before the row is gone
+    owner_email = db_import.user.email
+    owner_name = db_import.user.name or db_import.user.email
+    import_source = db_import.source
+    md5sum = db_import.md5sum
+    file_path = upload_store.import_file_path(db_import)
+    
     try:
         print(f"Deleting all related records for import {id}")
+        measurements_count = await write(db, crud.delete_bgeigie_import_records, id, bulk=True)
+        print(f"Deleted {measurements_count} measurements, devices and bgeigie_logs")
         
-        # Get count of measurements to delete
-        measurements_count = db.execute(text("SELECT COUNT(*) FROM measurements WHERE bgeigie_import_id = :import_id"), {"import_id": id}).scalar()
-        print(f"Found {measurements_count} measurements to delete")
-        
-        # Force delete all measurements using raw SQL (ORM seems to have issues with large deletes)
-        db.execute(text("DELETE FROM measurements WHERE bgeigie_import_id = :import_id"), {"import_id": id})
-        db.flush()
-        print(f"Force deleted measurements using raw SQL")
-        
-        # Delete devices using raw SQL for consistency
-        db.execute(text("DELETE FROM devices WHERE bgeigie_import_id = :import_id"), {"import_id": id})
-        db.flush()
-        print(f"Force deleted devices using raw SQL")
-        
-        # Delete bgeigie_logs using raw SQL
-        db.execute(text("DELETE FROM bgeigie_logs WHERE bgeigie_import_id = :import_id"), {"import_id": id})
-        db.flush()
-        print(f"Force deleted bgeigie_logs using raw SQL")
-        
-        # Verify all child records are actually deleted
-        remaining_measurements = db.execute(text("SELECT COUNT(*) FROM measurements WHERE bgeigie_import_id = :import_id"), {"import_id": id}).scalar()
-        remaining_devices = db.execute(text("SELECT COUNT(*) FROM devices WHERE bgeigie_import_id = :import_id"), {"import_id": id}).scalar()
-        remaining_logs = db.execute(text("SELECT COUNT(*) FROM bgeigie_logs WHERE bgeigie_import_id = :import_id"), {"import_id": id}).scalar()
-        print(f"Remaining after deletes — measurements: {remaining_measurements}, devices: {remaining_devices}, logs: {remaining_logs}")
-        
-        if remaining_measurements > 0 or remaining_devices > 0 or remaining_logs > 0:
-            raise Exception(
-                f"Child rows still present (measurements={remaining_measurements}, devices={remaining_devices}, logs={remaining_logs})"
-            )
-        
-        # Commit child deletions before deleting parent to satisfy FK constraints in DuckDB
-        db.commit()
-        print("Committed child deletions")
-
-        # Now delete the import record using ORM (new transaction)
-        db.refresh(db_import)
-        db.delete(db_import)
-        db.commit()
+        # Child deletions are committed before the import record is deleted, to satisfy FK constraints in DuckDB
+        await write(db, crud.delete_bgeigie_import, id)
+        measurement_index.request_sync()
         print(f"Successfully deleted import {id}")
         
         # Send email notification to the import owner
         try:
             await send_bgeigie_notification_email(
-                recipient_email=db_import.user.email,
-                recipient_name=db_import.user.name or db_import.user.email,
+                recipient_email=owner_email,
+                recipient_name=owner_name,
                 action="deleted",
-                import_id=db_import.id,
-                import_filename=db_import.source
+                import_id=id,
+                import_filename=import_source
             )
         except Exception as e:
             print(f"Failed to send deletion email: {e}")
         
-        # Try to delete the uploaded file
-        file_path = f"uploads/{db_import.source}"
-        if os.path.exists(file_path):
+        # Delete the stored log unless another import still shares its bytes
+        if md5sum and file_path == upload_store.blob_path(md5sum):
+            if upload_store.release(db, md5sum):
+                print(f"Deleted file: {file_path}")
+        elif os.path.exists(file_path):
             os.remove(file_path)
             print(f"Deleted file: {file_path}")
         
@@ -2,6 +2,7 @@ from typing import List
 from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
 from .. import crud, models, schemas
+from ..db_writer import write_sync
 from ..security import get_db, get_current_active_user
 
 router = APIRouter(
@@ -25,7 +26,7 @@ def create_device_story(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    return crud.create_device_story(db=db, story=story, user_id=current_user.id)
+    return write_sync(db, crud.create_device_story, story=story, user_id=current_user.id)
 
 @router.get("/{device_story_id}/comments", response_model=List[schemas.DeviceStoryComment])
 def read_comments(device_story_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_active_user)):
@@ -33,4 +34,4 @@ def read_comments(device_story_id: int, db: Session = Depends(get_db), current_u
 
 @router.post("/{device_story_id}/comments", response_model=schemas.DeviceStoryComment)
 def create_comment(device_story_id: int, comment: schemas.DeviceStoryCommentCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_active_user)):
-    return crud.create_comment(db, comment, device_story_id, current_user.id)
+    return write_sync(db, crud.create_comment, comment, device_story_id, current_user.id)
@@ -3,6 +3,7 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import desc, asc
 from .. import crud, models, schemas
+from ..db_writer import write_sync
 from ..security import get_db, get_current_active_user
 
 router = APIRouter(
@@ -48,7 +49,7 @@ def create_device(
     """
     Create a new device.
     """
-    return crud.create_device(db=db, device=device)
+    return write_sync(db, crud.create_device, device=device)
 
 @router.get("/{device_id}", response_model=schemas.Device)
 def read_device(
@@ -77,7 +78,7 @@ def update_device(
     if device is None:
         raise HTTPException(status_code=404, detail="Device not found")
     
-    return crud.update_device(db=db, device_id=device_id, device_update=device_update)
+    return write_sync(db, crud.update_device, device_id=device_id, device_update=device_update)
 
 @router.delete("/{device_id}")
 def delete_device(
@@ -92,5 +93,5 @@ def delete_device(
     if device is None:
         raise HTTPException(status_code=404, detail="Device not found")
     
-    crud.delete_device(db=db, device_id=device_id)
+    write_sync(None, crud.delete_device, device_id=device_id)
     return {"message": "Device deleted successfully"}
@@ -0,0 +1,71 @@
+from datetime import datetime
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from .. import crud, schemas, models
+from ..background_tasks import get_job, get_queue_stats
+from ..security import get_db, get_current_active_user
+
+router = APIRouter(
+    tags=["jobs"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+def _seconds_between(start: datetime, end: datetime) -> float:
+    return round((end - start).total_seconds(), 3)
+
+
+@router.get("/stats", response_model=List[schemas.JobQueueStats])
+def read_queue_stats(user_id: Optional[int] = None, current_user: models.User = Depends(get_current_active_user)):
+    """
+    Queue depth and waiting times per user. Admins see every user (or the one given by user_id);
+    everyone else sees their own row.
+    """
+    if current_user.role != "admin":
+        user_id = current_user.id
+    return get_queue_stats(user_id)
+
+
+@router.get("/{job_id}", response_model=schemas.Job)
+def read_job(job_id: str, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_active_user)):
+    """
+    State, progress and timings of a background job, e.g. the one parsing an upload.
+    Users see their own jobs; admins see all of them. A user who re-uploaded bytes another
+    user's job is parsing sees that job too, without its result.
+    """
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    shared = False
+    if job["user_id"] != current_user.id and current_user.role != "admin":
+        import_id = job["data"].get("import_id")
+        if import_id is None or not crud.user_shares_import(db, import_id, current_user.id):
+            raise HTTPException(status_code=404, detail="Job not found")
+        shared = True
+
+    # Running jobs are timed up to now
+    now = datetime.utcnow()
+    started_at, completed_at = job["started_at"], job["completed_at"]
+    timings = {
+        "queued_seconds": _seconds_between(job["created_at"], started_at or now),
+        "running_seconds": _seconds_between(started_at, completed_at or now) if started_at else None,
+        "insert_seconds": round(job["insert_seconds"], 3),
+    }
+    return {
+        "id": job["id"],
+        "type": job["type"],
+        "state": job["status"],
+        "priority": job["priority"],
+        "import_id": job["data"].get("import_id"),
+        "attempts": job["attempts"],
+        "max_attempts": job["max_attempts"],
+        "progress": job["progress"],
+        "timings": timings,
+        "result": None if shared else job["result"],
+        "created_at": job["created_at"],
+        "started_at": started_at,
+        "completed_at": completed_at,
+        "run_after": job["run_after"] if job["status"] == "queued" else None,
+        "error": job["error"],
+    }
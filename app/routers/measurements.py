@@ -1,9 +1,15 @@
+import asyncio
 from typing import List, Optional
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import text
-from .. import crud, schemas, models
-from ..security import get_db, get_current_active_user
+from sqlalchemy import literal_column, select, text
+from .. import crud, grid_aggregates, schemas, models, spatial
+from ..security import get_current_active_user
+from .. import query_governor
+from ..pagination import decode_cursor, set_next_cursor
+from ..streaming import stream_rows
+from ..config import settings
+from ..knn_index import measurement_index
 
 router = APIRouter(
     tags=["measurements"],
@@ -11,24 +17,68 @@ router = APIRouter(
 )
 
 
+# Columns of the measurement rows streamed as ndjson or csv
+STREAMED_COLUMNS = (
+    models.Measurement.id, models.Measurement.bgeigie_import_id, models.Measurement.cpm,
+    models.Measurement.latitude, models.Measurement.longitude, models.Measurement.altitude,
+    models.Measurement.captured_at,
+)
+
 @router.get("/", response_model=List[schemas.Measurement])
-def read_measurements(
-    skip: int = Query(0, ge=0),
-    limit: int = Query(1000, ge=1, le=10000),
+async def read_measurements(
+    request: Request,
+    response: Response,
+    format: str = Query("json", pattern="^(json|ndjson|csv)$",
+                        description="json, or ndjson/csv to stream the rows as they are read"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    skip: int = Query(0, ge=0, description="Rows to skip (offset paging, ignored with a cursor)"),
+    limit: Optional[int] = Query(None, ge=1, description="Rows per page: json 1000 by default, at most 10000; "
+                                                         "ndjson/csv every row unless given"),
     latitude: Optional[float] = Query(None, description="Center latitude for geographic filtering"),
     longitude: Optional[float] = Query(None, description="Center longitude for geographic filtering"),
     distance: Optional[float] = Query(None, description="Distance in kilometers for geographic filtering"),
     captured_after: Optional[str] = Query(None, description="Filter measurements after this date (ISO format)"),
     captured_before: Optional[str] = Query(None, description="Filter measurements before this date (ISO format)"),
-    user_id: Optional[int] = Query(None, description="Filter by user ID"),
-    db: Session = Depends(get_db)
+    user_id: Optional[int] = Query(None, description="Filter by user ID")
 ):
     """
-    Retrieve measurements with optional geographic and temporal filtering.
+    Retrieve measurements with optional geographic and temporal filtering, in id order.
     Supports DuckDB spatial queries for efficient geographic searches.
+    Page with the X-Next-Cursor response header (see pagination.py).
+    JSON pages run in the interactive query pool; ndjson and csv stream (see streaming.py).
     """
+    after_id = decode_cursor(cursor)
+    statement = _measurements_select(latitude, longitude, distance, captured_after, captured_before, user_id)
+    if after_id is not None:
+        statement = statement.where(models.Measurement.id > after_id)
+
+    if format != "json":
+        statement = statement.with_only_columns(*STREAMED_COLUMNS)
+        # Without a page, rows stream in table order, which is id order, rather than waiting for a sort
+        if limit is not None or (skip and after_id is None):
+            statement = statement.order_by(models.Measurement.id).limit(limit)
+            if after_id is None:
+                statement = statement.offset(skip)
+        return stream_rows(statement, format, filename="measurements")
+
+    limit = 1000 if limit is None else limit
+    if limit > 10000:
+        raise HTTPException(status_code=422, detail="limit may be at most 10000; use format=ndjson or csv for more")
+    # Id order keeps pages stable, whether or not DuckDB reads the rows through an index
+    statement = statement.order_by(models.Measurement.id).limit(limit)
+    if after_id is None:
+        statement = statement.offset(skip)
+    measurements = await query_governor.interactive.run(request, _filtered_measurements, statement)
+    if skip == 0 or after_id is not None:
+        set_next_cursor(response, measurements, limit)
+    return measurements
+
+def _filtered_measurements(db: Session, statement):
+    return db.scalars(statement).all()
+
+def _measurements_select(latitude, longitude, distance, captured_after, captured_before, user_id):
     # Build base query
-    query = db.query(models.Measurement)
+    query = select(models.Measurement)
     
     # Apply geographic filtering using DuckDB spatial functions
     if latitude is not None and longitude is not None and distance is not None:
@@ -42,7 +92,9 @@ def read_measurements(
         lon_min = longitude - degree_distance
         lon_max = longitude + degree_distance
         
-        query = query.filter(
+        # Narrow to the spatial cells covering the box first, then check the box itself
+        query = query.where(
+            spatial.cell_filter(models.Measurement.spatial_cell, lat_min, lat_max, lon_min, lon_max),
             models.Measurement.latitude.between(lat_min, lat_max),
             models.Measurement.longitude.between(lon_min, lon_max)
         )
@@ -52,30 +104,36 @@ def read_measurements(
         
     # Apply temporal filtering
     if captured_after:
-        query = query.filter(models.Measurement.captured_at >= captured_after)
+        query = query.where(models.Measurement.captured_at >= captured_after)
     if captured_before:
-        query = query.filter(models.Measurement.captured_at <= captured_before)
+        query = query.where(models.Measurement.captured_at <= captured_before)
     
     # Apply user filtering
     if user_id:
-        query = query.join(models.BGeigieImport).filter(models.BGeigieImport.user_id == user_id)
+        query = query.join(models.BGeigieImport).where(models.BGeigieImport.user_id == user_id)
     
-    measurements = query.offset(skip).limit(limit).all()
-    return measurements
+    return query
 
 @router.get("/count")
-def get_measurements_count(
+async def get_measurements_count(
+    request: Request,
     latitude: Optional[float] = Query(None),
     longitude: Optional[float] = Query(None),
     distance: Optional[float] = Query(None),
     captured_after: Optional[str] = Query(None),
     captured_before: Optional[str] = Query(None),
-    user_id: Optional[int] = Query(None),
-    db: Session = Depends(get_db)
+    user_id: Optional[int] = Query(None)
 ):
     """
     Get count of measurements with same filtering options as the main endpoint.
+    Counting scans the table, so it runs in the analytics query pool.
     """
+    count = await query_governor.analytics.run(
+        request, _count_measurements, latitude, longitude, distance, captured_after, captured_before, user_id
+    )
+    return {"count": count}
+
+def _count_measurements(db: Session, latitude, longitude, distance, captured_after, captured_before, user_id):
     query = db.query(models.Measurement)
     
     # Apply same filters as read_measurements
@@ -87,6 +145,7 @@ def get_measurements_count(
         lon_max = longitude + degree_distance
         
         query = query.filter(
+            spatial.cell_filter(models.Measurement.spatial_cell, lat_min, lat_max, lon_min, lon_max),
             models.Measurement.latitude.between(lat_min, lat_max),
             models.Measurement.longitude.between(lon_min, lon_max)
         )
@@ -99,32 +158,37 @@ def get_measurements_count(
     if user_id:
         query = query.join(models.BGeigieImport).filter(models.BGeigieImport.user_id == user_id)
     
-    count = query.count()
-    return {"count": count}
+    return query.count()
 
 @router.get("/spatial/nearby", response_model=List[schemas.Measurement])
-def get_nearby_measurements(
+async def get_nearby_measurements(
+    request: Request,
     latitude: float = Query(..., description="Center latitude"),
     longitude: float = Query(..., description="Center longitude"),
     radius_km: float = Query(10.0, description="Search radius in kilometers"),
-    limit: int = Query(100, ge=1, le=1000),
-    db: Session = Depends(get_db)
+    limit: int = Query(100, ge=1, le=1000)
 ):
     """
     Find measurements within a specific radius using DuckDB spatial capabilities.
+    A large radius still covers much of the table, so the query runs in the analytics query pool.
     """
-    # Use DuckDB's spatial functions for precise distance calculation
-    # This is a more accurate approach than simple bounding box
-    sql_query = text("""
-        SELECT m.id, m.cpm, m.latitude, m.longitude, m.captured_at, m.bgeigie_import_id, m.device_id,
-               (6371 * acos(cos(radians(:lat)) * cos(radians(m.latitude)) * 
-                cos(radians(m.longitude) - radians(:lon)) + 
-                sin(radians(:lat)) * sin(radians(m.latitude)))) AS distance_km
-        FROM measurements m
-        WHERE (6371 * acos(cos(radians(:lat)) * cos(radians(m.latitude)) * 
-               cos(radians(m.longitude) - radians(:lon)) + 
-               sin(radians(:lat)) * sin(radians(m.latitude)))) <= :radius
-        ORDER BY distance_km
+    return await query_governor.analytics.run(request, _nearby_measurements, latitude, longitude, radius_km, limit)
+
+def _nearby_measurements(db: Session, latitude: float, longitude: float, radius_km: float, limit: int):
+    # Only measurements in the spatial cells around the circle get the exact distance computed
+    cells = spatial.cell_filter(literal_column("m.spatial_cell"), *spatial.radius_box(latitude, longitude, radius_km))
+    cells = cells.compile(compile_kwargs={"literal_binds": True})
+    sql_query = text(f"""
+        SELECT * FROM (
+            SELECT m.id, m.cpm, m.latitude, m.longitude, m.captured_at, m.bgeigie_import_id, m.device_id,
+                   (6371 * acos(cos(radians(:lat)) * cos(radians(m.latitude)) * 
+                    cos(radians(m.longitude) - radians(:lon)) + 
+                    sin(radians(:lat)) * sin(radians(m.latitude)))) AS distance_km
+            FROM measurements m
+            WHERE {cells}
+        )
+        WHERE distance_km <= :radius
+        ORDER BY distance_km, id
         LIMIT :limit
     """)
     
@@ -148,3 +212,56 @@ def get_nearby_measurements(
         ))
     
     return measurements
+
+@router.get("/grid", response_model=List[schemas.GridCell])
+async def get_grid_cells(
+    request: Request,
+    level: int = Query(..., description=f"Grid level, one of {', '.join(map(str, grid_aggregates.GRID_LEVELS))}"),
+    lat_min: float = Query(..., ge=-90, le=90),
+    lat_max: float = Query(..., ge=-90, le=90),
+    lon_min: float = Query(..., ge=-180, le=180),
+    lon_max: float = Query(..., ge=-180, le=180)
+):
+    """
+    Mean, lowest and highest CPM and number of readings of the approved measurements in each
+    grid cell of the level overlapping the box, from the grid_aggregates table (see grid_aggregates.py).
+    """
+    if level not in grid_aggregates.GRID_LEVELS:
+        raise HTTPException(status_code=422, detail=f"level must be one of {list(grid_aggregates.GRID_LEVELS)}")
+    cells = await query_governor.interactive.run(request, grid_aggregates.cells_in_box,
+                                                 level, lat_min, lat_max, lon_min, lon_max)
+    if cells is None:
+        raise HTTPException(status_code=422, detail=f"The box covers more than {grid_aggregates.MAX_GRID_CELLS} "
+                                                    "cells of the level; use a coarser level or a smaller box")
+    return cells
+
+@router.get("/spatial/knn", response_model=List[schemas.NearestMeasurement])
+async def get_nearest_measurements(
+    request: Request,
+    lat: float = Query(..., ge=-90, le=90, description="Latitude"),
+    lon: float = Query(..., ge=-180, le=180, description="Longitude"),
+    k: int = Query(1, ge=1, le=settings.KNN_MAX_K, description="Number of measurements")
+):
+    """
+    The k measurements of approved imports nearest to a location, nearest first, from the
+    in-memory nearest-neighbour index. Only the rows found are read from the database.
+    """
+    if not measurement_index.ready:
+        raise HTTPException(status_code=503, detail="The nearest-neighbour index is still loading",
+                            headers={"Retry-After": "10"})
+    # Without scipy this scans every point, so keep it off the event loop
+    nearest = await asyncio.to_thread(measurement_index.nearest, lat, lon, k)
+    rows = await query_governor.interactive.run(request, _measurements_by_id, [i for i, _ in nearest])
+    # An import deleted since the index last caught up leaves gaps; its rows are skipped
+    return [
+        schemas.NearestMeasurement(**schemas.Measurement.model_validate(rows[i]).model_dump(), distance_km=distance)
+        for i, distance in nearest if i in rows
+    ]
+
+def _measurements_by_id(db: Session, ids: List[int]) -> dict:
+    return {m.id: m for m in db.query(models.Measurement).filter(models.Measurement.id.in_(ids)).all()}
+
+@router.get("/spatial/knn/stats", response_model=schemas.NearestNeighbourIndexStats)
+def get_nearest_neighbour_index_stats():
+    """Size and memory use of the nearest-neighbour index."""
+    return measurement_index.stats()
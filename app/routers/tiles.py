@@ -0,0 +1,48 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlalchemy.orm import Session
+from .. import mvt, png, query_governor, tiles
+from ..config import settings
+from ..security import get_db
+
+router = APIRouter(
+    tags=["tiles"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+@router.get("/{z}/{x}/{y}.mvt")
+async def read_vector_tile(z: int, x: int, y: int, request: Request, db: Session = Depends(get_db)):
+    """
+    Vector tile of the approved measurements: one point per tile pixel with the mean (cpm_mean),
+    highest (cpm_max) and number (count) of CPM readings there, in the "measurements" layer.
+    Tiles are cached on disk until an approval or deletion changes the data under them (see tiles.py).
+    """
+    if not tiles.valid_tile(z, x, y):
+        raise HTTPException(status_code=404, detail="Tile not found")
+    version = tiles.tile_version(db, z, x, y)
+    data = tiles.mvt_cache.get(z, x, y, version)
+    if data is None:
+        # A low zoom tile aggregates much of the table
+        pool = query_governor.analytics if z < settings.TILE_ANALYTICS_MAX_ZOOM else query_governor.interactive
+        data = await pool.run(request, tiles.render_mvt, z, x, y)
+        tiles.mvt_cache.put(z, x, y, version, data)
+    return Response(content=data, media_type=mvt.MEDIA_TYPE, headers={"ETag": f'"{version}"'})
+
+
+@router.get("/heatmap/{z}/{x}/{y}.png")
+async def read_heatmap_tile(z: int, x: int, y: int, request: Request, db: Session = Depends(get_db)):
+    """
+    Raster heatmap tile of the approved measurements: the mean dose around each pixel in the
+    colours of the map legend, transparent where there are no readings. Low zoom levels are
+    pre-rendered by seed_tiles.py, the others on first request; cached as the vector tiles are.
+    """
+    if not tiles.valid_tile(z, x, y):
+        raise HTTPException(status_code=404, detail="Tile not found")
+    # Readings just past the edge colour the tile's border pixels
+    version = tiles.tile_version(db, z, x, y, tiles.HEAT_RADIUS_PIXELS)
+    data = tiles.heatmap_cache.get(z, x, y, version)
+    if data is None:
+        pool = query_governor.analytics if z < settings.TILE_ANALYTICS_MAX_ZOOM else query_governor.interactive
+        data = await pool.run(request, tiles.render_heatmap, z, x, y)
+        tiles.heatmap_cache.put(z, x, y, version, data)
+    return Response(content=data, media_type=png.MEDIA_TYPE, headers={"ETag": f'"{version}"'})
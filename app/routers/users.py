@@ -1,9 +1,11 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Response, status, BackgroundTasks
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 
 from .. import crud, models, schemas, email
+from ..db_writer import write, write_sync
+from ..pagination import decode_cursor, set_next_cursor
 from ..security import (
     create_access_token,
     create_refresh_token,
@@ -23,7 +25,7 @@ def create_user(user: schemas.UserCreate, background_tasks: BackgroundTasks, db:
     db_user = crud.get_user_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    new_user = crud.create_user(db=db, user=user)
+    new_user = write_sync(db, crud.create_user, user=user)
     background_tasks.add_task(email.send_signup_confirmation, email_to=new_user.email, user=new_user)
     return new_user
 
@@ -37,19 +39,24 @@ def set_user_role(
     if user_update.role not in ["user", "moderator", "admin"]:
         raise HTTPException(status_code=400, detail="Invalid role specified.")
     
-    updated_user = crud.update_user_role(db=db, user_id=user_id, role=user_update.role)
+    updated_user = write_sync(db, crud.update_user_role, user_id=user_id, role=user_update.role)
     if not updated_user:
         raise HTTPException(status_code=404, detail="User not found.")
     return updated_user
 
 @router.get("/users/all", response_model=List[schemas.User])
 def read_users(
+    response: Response,
+    cursor: Optional[str] = None,
     skip: int = 0,
     limit: int = 100,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    users = crud.get_users(db, skip=skip, limit=limit)
+    after_id = decode_cursor(cursor)
+    users = crud.get_users(db, skip=skip, limit=limit, after_id=after_id)
+    if skip == 0 or after_id is not None:
+        set_next_cursor(response, users, limit)
     return users
 
 @router.post("/token", response_model=schemas.Token)
@@ -98,19 +105,12 @@ async def update_user_profile(
     db: Session = Depends(get_db)
 ):
     """Update current user's profile"""
-    # Update name if provided
-    if profile.name is not None:
-        current_user.name = profile.name
-
-    # Update email if provided and unique
-    if profile.email is not None and profile.email != current_user.email:
-        existing = crud.get_user_by_email(db, email=profile.email)
-        if existing and existing.id != current_user.id:
-            raise HTTPException(status_code=400, detail="Email already in use")
-        current_user.email = profile.email
-    db.commit()
-    db.refresh(current_user)
-    return current_user
+    # Name and email are updated if provided; the email must not belong to another user
+    try:
+        return await write(db, crud.update_user, current_user.id,
+                           schemas.UserUpdate(name=profile.name, email=profile.email))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/users/{user_id}", response_model=schemas.User)
 async def get_user_profile(
@@ -133,7 +133,7 @@ async def admin_update_user(
 ):
     """Admin: update user fields (name, email, is_active, role)."""
     try:
-        updated = crud.update_user(db, user_id=user_id, update=user_update)
+        updated = await write(db, crud.update_user, user_id=user_id, update=user_update)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     if not updated:
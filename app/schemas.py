@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, List, Optional
 
 class UserBase(BaseModel):
     email: str
@@ -44,6 +44,49 @@ class BGeigieImport(BGeigieImportBase):
     class Config:
         from_attributes = True
 
+class BGeigieImportUpload(BGeigieImport):
+    status: Optional[str] = None
+    job_id: Optional[str] = None  # Background job parsing the upload; None when an existing parse was reused
+
+class JobProgress(BaseModel):
+    lines_parsed: int = 0
+    rows_inserted: int = 0
+    bytes_read: int = 0
+
+class JobTimings(BaseModel):
+    queued_seconds: Optional[float] = None
+    running_seconds: Optional[float] = None
+    insert_seconds: float = 0.0
+
+class Job(BaseModel):
+    id: str
+    type: str
+    state: str  # queued, processing, completed or dead
+    priority: int  # Lower runs sooner
+    import_id: Optional[int] = None
+    attempts: int = 0
+    max_attempts: int
+    progress: JobProgress
+    timings: JobTimings
+    result: Optional[Any] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+    run_after: Optional[datetime] = None  # When a queued (possibly retrying) job becomes due
+    error: Optional[str] = None  # Last failure, kept while the job is retried
+
+class JobQueueStats(BaseModel):
+    user_id: Optional[int] = None
+    queued: int
+    processing: int
+    dead: int
+    queued_high: int
+    queued_normal: int
+    queued_bulk: int
+    oldest_queued_seconds: Optional[float] = None
+    avg_wait_seconds: Optional[float] = None  # Jobs started in the last day
+    max_wait_seconds: Optional[float] = None
+
 class BGeigieImportMetadata(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
@@ -70,6 +113,32 @@ class Measurement(MeasurementBase):
     class Config:
         from_attributes = True
 
+class NearestMeasurement(Measurement):
+    distance_km: float
+
+class NearestNeighbourIndexStats(BaseModel):
+    ready: bool
+    backend: str  # cKDTree, or scan without scipy
+    imports: int = 0
+    points: int = 0
+    delta_points: int = 0  # Approved since the tree was built, scanned directly
+    dead_points: int = 0  # Of imports removed since the tree was built, skipped by queries
+    memory_bytes: int = 0  # Approximate
+    updated_at: Optional[datetime] = None
+
+class GridCell(BaseModel):
+    level: int
+    cell: int
+    lat_min: float
+    lat_max: float
+    lon_min: float
+    lon_max: float
+    cpm_mean: float
+    cpm_min: int
+    cpm_max: int
+    count: int
+    last_captured_at: Optional[datetime] = None
+
 class DeviceBase(BaseModel):
     manufacturer: Optional[str] = None
     model: Optional[str] = None
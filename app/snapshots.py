@@ -0,0 +1,209 @@
+"""
+Read-only database snapshots for multi-process serving.
+
+DuckDB lets one process open safecast.db for writing and then no other process may open
+it at all, so a single uvicorn worker caps read throughput. With SERVING_MODE=writer, one
+process owns the database: it takes every write and runs the background jobs. Whenever
+something was committed it publishes a snapshot, at most every SNAPSHOT_INTERVAL_SECONDS:
+a copy of the database, taken in one read transaction while writes go on, in SNAPSHOT_DIR,
+made current by atomically replacing SNAPSHOT_DIR/CURRENT.
+
+API workers started with SERVING_MODE=reader open the current snapshot read-only, as many
+processes as needed. A connection is checked against CURRENT whenever it is taken from the
+pool and replaced once a newer snapshot is out, so queries already running finish on the
+snapshot they started on.
+"""
+import logging
+import os
+import threading
+import time
+from typing import List, Optional
+
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.pool import QueuePool
+
+from .config import settings
+from .database import duckdb_config
+
+logger = logging.getLogger(__name__)
+
+CURRENT_FILE = "CURRENT"
+
+# Last CURRENT read, keyed on its mtime so a checkout costs one stat()
+_current = {"mtime": None, "path": None}
+_current_lock = threading.Lock()
+
+
+def current_snapshot_path() -> Optional[str]:
+    """The snapshot readers should use, or None if none was published yet."""
+    pointer = os.path.join(settings.SNAPSHOT_DIR, CURRENT_FILE)
+    try:
+        mtime = os.stat(pointer).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _current_lock:
+        if mtime != _current["mtime"]:
+            with open(pointer) as f:
+                name = f.read().strip()
+            _current.update(mtime=mtime, path=os.path.join(settings.SNAPSHOT_DIR, name))
+        return _current["path"]
+
+
+def _replace_atomically(path: str, write):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def publish_snapshot(connection) -> str:
+    """
+    Copies the database into a new snapshot and makes it current; returns its path.
+    The copy is one read transaction, so it holds what was committed when it began, and
+    writes carry on meanwhile.
+    """
+    os.makedirs(settings.SNAPSHOT_DIR, exist_ok=True)
+    name = f"safecast-{time.time_ns()}.db"
+    path = os.path.join(settings.SNAPSHOT_DIR, name)
+    tmp_path = f"{path}.tmp"
+    database = connection.execute("SELECT current_database()").fetchone()[0]
+    quoted_path = tmp_path.replace("'", "''")
+    connection.execute(f"ATTACH '{quoted_path}' AS snapshot")
+    try:
+        connection.execute("BEGIN TRANSACTION")
+        try:
+            # COPY FROM DATABASE copies tables in name order, which breaks on foreign keys; so the
+            # schema first, then the rows of each table after those it references
+            connection.execute(f'COPY FROM DATABASE "{database}" TO snapshot (SCHEMA)')
+            for table in _tables_in_dependency_order(connection, database):
+                connection.execute(f'INSERT INTO snapshot."{table}" SELECT * FROM "{database}"."{table}"')
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+    finally:
+        # Detaching checkpoints the copy into one file readers can open read-only
+        connection.execute("DETACH snapshot")
+    with open(tmp_path, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _replace_atomically(os.path.join(settings.SNAPSHOT_DIR, CURRENT_FILE), lambda f: f.write(name.encode()))
+    _prune_snapshots()
+    return path
+
+
+def _tables_in_dependency_order(connection, database: str) -> List[str]:
+    """The database's tables, each after the tables its foreign keys reference."""
+    tables = [row[0] for row in connection.execute(
+        "SELECT table_name FROM duckdb_tables() WHERE database_name = ? ORDER BY table_name", [database]).fetchall()]
+    references = {table: set() for table in tables}
+    for table, referenced in connection.execute(
+            "SELECT table_name, referenced_table FROM duckdb_constraints() "
+            "WHERE database_name = ? AND constraint_type = 'FOREIGN KEY'", [database]).fetchall():
+        if referenced != table:
+            references[table].add(referenced)
+    ordered = []
+
+    def visit(table):
+        if table not in ordered:
+            for referenced in sorted(references[table]):
+                visit(referenced)
+            ordered.append(table)
+    for table in tables:
+        visit(table)
+    return ordered
+
+
+def _prune_snapshots():
+    """
+    Deletes all but the newest SNAPSHOT_KEEP snapshots. Readers still holding an
+    older one open keep reading it: the file lives on until they close it.
+    """
+    names = sorted(name for name in os.listdir(settings.SNAPSHOT_DIR)
+                   if name.startswith("safecast-") and name.endswith(".db"))
+    for name in names[:-settings.SNAPSHOT_KEEP]:
+        for path in (os.path.join(settings.SNAPSHOT_DIR, name), os.path.join(settings.SNAPSHOT_DIR, f"{name}.wal")):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class SnapshotPublisher:
+    """Publishes a snapshot after commits on the database writer, at most every SNAPSHOT_INTERVAL_SECONDS."""
+
+    def __init__(self, writer, engine, interval_seconds: float = settings.SNAPSHOT_INTERVAL_SECONDS):
+        self.writer = writer
+        self.engine = engine
+        self.database_path = engine.url.database
+        self.interval = interval_seconds
+        self.published_writes = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.stopped.clear()
+            self.publish()
+            self.thread = threading.Thread(target=self._run, name="snapshot-publisher", daemon=True)
+            self.thread.start()
+            logger.info(f"Publishing database snapshots to {settings.SNAPSHOT_DIR}")
+
+    def stop(self):
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+            # Readers get everything committed before shutdown
+            self.publish()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.publish()
+            except Exception as e:
+                logger.error(f"Error publishing database snapshot: {e}")
+
+    def publish(self) -> bool:
+        """Publishes a snapshot if anything was committed since the last one; returns whether it did."""
+        # A connection of its own, from an engine on the same database instance as the writer
+        connection = self.engine.raw_connection()
+        try:
+            # Holding the commit lock only to fold the WAL into the database file, which needs no write in flight;
+            # the copy after it reads a consistent transaction while writes go on
+            with self.writer.commit_lock:
+                writes = self.writer.writes_committed
+                if writes == self.published_writes:
+                    return False
+                connection.execute("CHECKPOINT")
+            path = publish_snapshot(connection)
+        finally:
+            connection.close()
+        self.published_writes = writes
+        logger.info(f"Published database snapshot {path}")
+        return True
+
+
+def create_snapshot_engine(**kwargs):
+    """
+    An engine whose connections open the current snapshot read-only. A pooled connection to
+    an older snapshot is discarded when it is checked out, and a new one opened in its place.
+    """
+    # The URL names no file (do_connect supplies it), so ask for the pool duckdb_engine uses for files
+    engine = create_engine("duckdb:///:snapshot:", connect_args={"read_only": True, "config": duckdb_config()},
+                           poolclass=QueuePool, **kwargs)
+
+    @event.listens_for(engine, "do_connect")
+    def _open_current_snapshot(dialect, connection_record, cargs, cparams):
+        path = current_snapshot_path()
+        if path is None:
+            raise RuntimeError(f"No database snapshot has been published in {settings.SNAPSHOT_DIR} yet")
+        cparams["database"] = path
+        connection_record.info["snapshot"] = path
+
+    @event.listens_for(engine, "checkout")
+    def _check_snapshot(dbapi_connection, connection_record, connection_proxy):
+        if connection_record.info.get("snapshot") != current_snapshot_path():
+            raise exc.DisconnectionError("A newer database snapshot was published")
+
+    return engine
@@ -0,0 +1,179 @@
+"""
+Hierarchical spatial cells for measurements.
+
+Latitude and longitude are each cut into 2**CELL_LEVEL steps and the two step numbers are
+bit-interleaved (a Morton code, in quadkey order) into measurements.spatial_cell. Cells
+nest: dropping the last 2*k bits of a cell gives the cell containing it k levels up, so a
+coarse cell is one contiguous range of fine cells.
+
+Area queries first narrow measurements to the cells covering the area, then apply their
+exact condition to the candidates. A small area becomes an IN list that DuckDB answers from
+the spatial_cell index (its index serves equality lookups, not ranges); a large one becomes
+a few ranges of coarser cells, checked during the table scan.
+"""
+import math
+from typing import List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import and_, false, or_
+
+CELL_LEVEL = 14  # ~2.4 km of longitude by ~1.2 km of latitude at the equator
+# Areas covered by at most this many cells are looked up in the index
+MAX_INDEXED_CELLS = 1024
+# Otherwise the coarsest level covering the area in at most this many cells is used
+MAX_CELL_RANGES = 64
+
+EARTH_RADIUS_KM = 6371
+
+_STEPS = 1 << CELL_LEVEL
+
+
+def _spread_bits(v: np.ndarray) -> np.ndarray:
+    """Moves bit i of each value to bit 2i."""
+    v = v & 0xFFFFFFFF
+    v = (v | (v << 16)) & 0x0000FFFF0000FFFF
+    v = (v | (v << 8)) & 0x00FF00FF00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v << 2)) & 0x3333333333333333
+    v = (v | (v << 1)) & 0x5555555555555555
+    return v
+
+
+def _compact_bits(v: int) -> int:
+    """Moves bit 2i of the value to bit i, dropping the odd bits; the inverse of _spread_bits."""
+    v &= 0x5555555555555555
+    v = (v | (v >> 1)) & 0x3333333333333333
+    v = (v | (v >> 2)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v >> 4)) & 0x00FF00FF00FF00FF
+    v = (v | (v >> 8)) & 0x0000FFFF0000FFFF
+    v = (v | (v >> 16)) & 0x00000000FFFFFFFF
+    return v
+
+
+def _steps(values, low: float, span: float, level: int = CELL_LEVEL) -> np.ndarray:
+    steps = np.floor((np.asarray(values, dtype=np.float64) - low) / span * (1 << level))
+    return np.clip(steps, 0, (1 << level) - 1).astype(np.int64)
+
+
+def spatial_cells(latitudes, longitudes) -> np.ndarray:
+    """Cells of the given coordinate arrays as int64; -1 where a coordinate is missing (NaN)."""
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        cells = _spread_bits(_steps(longitudes, -180.0, 360.0)) | (_spread_bits(_steps(latitudes, -90.0, 180.0)) << 1)
+    return np.where(np.isnan(latitudes) | np.isnan(longitudes), -1, cells)
+
+
+def spatial_cell(latitude: Optional[float], longitude: Optional[float]) -> Optional[int]:
+    """The cell of one coordinate, or None when it is missing."""
+    if latitude is None or longitude is None:
+        return None
+    cell = int(spatial_cells([latitude], [longitude])[0])
+    return None if cell < 0 else cell
+
+
+def cell_bounds(cell: int, level: int = CELL_LEVEL) -> Tuple[float, float, float, float]:
+    """(lat_min, lat_max, lon_min, lon_max) of a cell of the level (a code of 2 * level bits)."""
+    steps = 1 << level
+    x, y = _compact_bits(cell), _compact_bits(cell >> 1)
+    return (y / steps * 180.0 - 90.0, (y + 1) / steps * 180.0 - 90.0,
+            x / steps * 360.0 - 180.0, (x + 1) / steps * 360.0 - 180.0)
+
+
+def _covering(lat_min: float, lat_max: float, lon_min: float, lon_max: float, level: int) -> List[Tuple[int, int]]:
+    """Ranges of CELL_LEVEL cells covering the box with cells of the given level, merged and sorted."""
+    shift = 2 * (CELL_LEVEL - level)
+    xs = np.arange(_steps(lon_min, -180.0, 360.0, level), _steps(lon_max, -180.0, 360.0, level) + 1)
+    ys = np.arange(_steps(lat_min, -90.0, 180.0, level), _steps(lat_max, -90.0, 180.0, level) + 1)
+    codes = np.sort((_spread_bits(xs)[None, :] | (_spread_bits(ys)[:, None] << 1)).ravel())
+    ranges = []
+    for code in codes.tolist():
+        low, high = code << shift, ((code + 1) << shift) - 1
+        if ranges and ranges[-1][1] + 1 == low:
+            ranges[-1] = (ranges[-1][0], high)
+        else:
+            ranges.append((low, high))
+    return ranges
+
+
+def _split_longitudes(lon_min: float, lon_max: float) -> List[Tuple[float, float]]:
+    """Splits a longitude span crossing the antimeridian into spans within [-180, 180]."""
+    if lon_max - lon_min >= 360:
+        return [(-180.0, 180.0)]
+    spans = [(max(lon_min, -180.0), min(lon_max, 180.0))]
+    if lon_min < -180:
+        spans.append((lon_min + 360, 180.0))
+    if lon_max > 180:
+        spans.append((-180.0, lon_max - 360))
+    return spans
+
+
+def _cell_count(lat_min: float, lat_max: float, spans: List[Tuple[float, float]], level: int) -> int:
+    rows = int(_steps(lat_max, -90.0, 180.0, level)) - int(_steps(lat_min, -90.0, 180.0, level)) + 1
+    return rows * sum(int(_steps(high, -180.0, 360.0, level)) - int(_steps(low, -180.0, 360.0, level)) + 1
+                      for low, high in spans)
+
+
+def cell_filter(column, lat_min: float, lat_max: float, lon_min: float, lon_max: float):
+    """
+    A condition on a spatial_cell column that keeps at least every measurement inside the
+    box (and more: whole cells). Longitudes past +-180 wrap around.
+    """
+    if lat_min > lat_max or lon_min > lon_max:
+        return false()
+    # Widen by one cell, so coordinates that round differently here and at ingest stay in
+    pad_lat, pad_lon = 180.0 / _STEPS, 360.0 / _STEPS
+    lat_min, lat_max = lat_min - pad_lat, lat_max + pad_lat
+    spans = _split_longitudes(lon_min - pad_lon, lon_max + pad_lon)
+
+    if _cell_count(lat_min, lat_max, spans, CELL_LEVEL) <= MAX_INDEXED_CELLS:
+        cells = sorted({cell for span in spans for first, last in _covering(lat_min, lat_max, *span, CELL_LEVEL)
+                        for cell in range(first, last + 1)})
+        return column.in_(cells)
+
+    level = CELL_LEVEL - 1
+    while level > 0 and _cell_count(lat_min, lat_max, spans, level) > MAX_CELL_RANGES:
+        level -= 1
+    ranges = [r for span in spans for r in _covering(lat_min, lat_max, *span, level)]
+    return or_(*(and_(column >= low, column <= high) for low, high in ranges))
+
+
+def cell_count(lat_min: float, lat_max: float, lon_min: float, lon_max: float, level: int) -> int:
+    """Number of the level's cells covering the box."""
+    if lat_min > lat_max or lon_min > lon_max:
+        return 0
+    return _cell_count(lat_min, lat_max, _split_longitudes(lon_min, lon_max), level)
+
+
+def cell_ranges(lat_min: float, lat_max: float, lon_min: float, lon_max: float, level: int) -> List[Tuple[int, int]]:
+    """
+    Ranges (first, last) of codes of the level's cells that cover at least the box, in about
+    MAX_CELL_RANGES ranges: when the box needs more, coarser cells cover it. Longitudes past
+    +-180 wrap around.
+    """
+    if lat_min > lat_max or lon_min > lon_max:
+        return []
+    spans = _split_longitudes(lon_min, lon_max)
+    coarse = level
+    while coarse > 0 and _cell_count(lat_min, lat_max, spans, coarse) > MAX_CELL_RANGES:
+        coarse -= 1
+    shift = 2 * (CELL_LEVEL - level)
+    return [(low >> shift, high >> shift) for span in spans for low, high in _covering(lat_min, lat_max, *span, coarse)]
+
+
+def radius_box(latitude: float, longitude: float, radius_km: float) -> Tuple[float, float, float, float]:
+    """
+    (lat_min, lat_max, lon_min, lon_max) containing every point within radius_km of the
+    center on a sphere of EARTH_RADIUS_KM; longitudes may run past +-180.
+    """
+    angle = radius_km / EARTH_RADIUS_KM
+    lat_min = latitude - math.degrees(angle)
+    lat_max = latitude + math.degrees(angle)
+    if lat_min <= -90 or lat_max >= 90 or angle >= math.pi / 2:
+        # A pole is within reach: every longitude is
+        return lat_min, lat_max, -180.0, 180.0
+    ratio = math.sin(angle) / math.cos(math.radians(latitude))
+    if ratio >= 1:
+        return lat_min, lat_max, -180.0, 180.0
+    lon_delta = math.degrees(math.asin(ratio))
+    return lat_min, lat_max, longitude - lon_delta, longitude + lon_delta
@@ -5,7 +5,8 @@ class BGeigieMap {
         this.map = null;
         this.markers = [];
         this.heatmapLayer = null;
-        this.importData = null;
+        this.track = null;  // packed track, see packed-track.js
+        this.zoomedTrack = null;
     }
 
     // Initialize the map
@@ -120,14 +121,14 @@ class BGeigieMap {
     // Load and display bGeigie import data
     async loadImportData(importId) {
         try {
-            const response = await fetch(`/bgeigie-imports/${importId}/measurements`);
-            if (!response.ok) throw new Error('Failed to load import data');
-            
-            this.importData = await response.json();
-            this.displayMeasurements();
+            // A coarse track places the map, then each zoom level gets its own (see packed-track.js)
+            if (this.zoomedTrack) this.zoomedTrack.stop();
+            this.zoomedTrack = new ZoomedTrack(this.map, importId, (track) => this.showTrack(track));
+            await this.zoomedTrack.start();
             this.fitMapToBounds();
             this.createLegend();
             this.updateStats();
+            this.zoomedTrack.refine();
             
         } catch (error) {
             console.error('Error loading import data:', error);
@@ -135,20 +136,34 @@ class BGeigieMap {
         }
     }
 
+    // Show a newly loaded track, as markers or as the heatmap
+    showTrack(track) {
+        this.track = track;
+        if (this.heatmapLayer) {
+            this.map.removeLayer(this.heatmapLayer);
+            this.createHeatmap();
+        } else {
+            this.displayMeasurements();
+        }
+    }
+
     // Display measurements on the map
     displayMeasurements() {
-        if (!this.importData || !this.importData.measurements) return;
+        if (!this.track) return;
 
         // Clear existing markers
         this.clearMarkers();
 
-        const measurements = this.importData.measurements;
+        const track = this.track;
         
-        measurements.forEach(measurement => {
-            if (measurement.latitude && measurement.longitude) {
-                const marker = L.circleMarker([measurement.latitude, measurement.longitude], {
-                    radius: this.getMarkerSize(measurement.cpm),
-                    fillColor: this.getCPMColor(measurement.cpm),
+        for (let i = 0; i < track.count; i++) {
+            const latitude = track.latitude[i];
+            const longitude = track.longitude[i];
+            if (latitude && longitude) {
+                const cpm = track.cpm[i];
+                const marker = L.circleMarker([latitude, longitude], {
+                    radius: this.getMarkerSize(cpm),
+                    fillColor: this.getCPMColor(cpm),
                     color: '#000',
                     weight: 1,
                     opacity: 0.8,
@@ -156,8 +171,9 @@ class BGeigieMap {
                 });
 
                 // Create tooltip for hover and popup for click
-                const microSvPerHour = this.cpmToMicroSvPerHour(measurement.cpm);
-                const capturedDate = new Date(measurement.captured_at);
+                const microSvPerHour = this.cpmToMicroSvPerHour(cpm);
+                const altitude = track.altitude[i];
+                const capturedDate = new Date(track.capturedAt[i] * 1000);
                 
                 // Tooltip content for hover
                 const tooltipContent = `
@@ -165,13 +181,13 @@ class BGeigieMap {
                         <div style="position: relative;">
                             <button onclick="this.parentElement.parentElement.parentElement.style.display='none'" style="position: absolute; top: -4px; right: -4px; background: #f0f0f0; border: 1px solid #ccc; width: 20px; height: 20px; border-radius: 2px; cursor: pointer; font-size: 14px; line-height: 1;">×</button>
                             <strong>${microSvPerHour.toFixed(2)}µSv/h</strong><br>
-                            <strong>${measurement.cpm}CPM</strong><br>
+                            <strong>${cpm}CPM</strong><br>
                             4SLog CPM<br>
                             5Log CP5s<br>
-                            ${measurement.altitude || 0}m alt<br>
-                            ${measurement.heading || 0}° heading<br>
-                            ${capturedDate.getFullYear()}-${String(capturedDate.getMonth() + 1).padStart(2, '0')}-${String(capturedDate.getDate()).padStart(2, '0')}<br>
-                            ${String(capturedDate.getHours()).padStart(2, '0')}:${String(capturedDate.getMinutes()).padStart(2, '0')}:${String(capturedDate.getSeconds()).padStart(2, '0')} UTC
+                            ${altitude ? Math.round(altitude * 10) / 10 : 0}m alt<br>
+                            0° heading<br>
+                            ${capturedDate.getUTCFullYear()}-${String(capturedDate.getUTCMonth() + 1).padStart(2, '0')}-${String(capturedDate.getUTCDate()).padStart(2, '0')}<br>
+                            ${String(capturedDate.getUTCHours()).padStart(2, '0')}:${String(capturedDate.getUTCMinutes()).padStart(2, '0')}:${String(capturedDate.getUTCSeconds()).padStart(2, '0')} UTC
                         </div>
                     </div>
                 `;
@@ -197,7 +213,7 @@ class BGeigieMap {
                 marker.addTo(this.map);
                 this.markers.push(marker);
             }
-        });
+        }
     }
 
     // Fit map view to show all measurements
@@ -216,19 +232,15 @@ class BGeigieMap {
 
     // Update statistics display
     updateStats() {
-        if (!this.importData) return;
+        if (!this.track) return;
 
-        const measurements = this.importData.measurements;
-        const totalMeasurements = measurements.length;
-        const avgCPM = measurements.reduce((sum, m) => sum + m.cpm, 0) / totalMeasurements;
-        const maxCPM = Math.max(...measurements.map(m => m.cpm));
-        const minCPM = Math.min(...measurements.map(m => m.cpm));
+        const stats = this.track.stats;
 
         // Update stats in the UI
-        document.getElementById('total-measurements').textContent = totalMeasurements;
-        document.getElementById('avg-cpm').textContent = avgCPM.toFixed(1);
-        document.getElementById('max-cpm').textContent = maxCPM;
-        document.getElementById('min-cpm').textContent = minCPM;
+        document.getElementById('total-measurements').textContent = stats.count;
+        document.getElementById('avg-cpm').textContent = stats.avg.toFixed(1);
+        document.getElementById('max-cpm').textContent = stats.max;
+        document.getElementById('min-cpm').textContent = stats.min;
     }
 
     // Toggle between marker and heatmap view
@@ -245,20 +257,23 @@ class BGeigieMap {
 
     // Create heatmap layer
     createHeatmap() {
-        if (!this.importData) return;
+        if (!this.track) return;
 
         // Aggregate into finer grid cells and use AVERAGE µSv/h per cell
         const cellSize = 0.0003; // ~30-35m
         const grid = new Map();
-        for (const m of this.importData.measurements) {
-            if (!m.latitude || !m.longitude) continue;
-            const latCell = Math.floor(m.latitude / cellSize);
-            const lngCell = Math.floor(m.longitude / cellSize);
+        const track = this.track;
+        for (let i = 0; i < track.count; i++) {
+            const latitude = track.latitude[i];
+            const longitude = track.longitude[i];
+            if (!latitude || !longitude) continue;
+            const latCell = Math.floor(latitude / cellSize);
+            const lngCell = Math.floor(longitude / cellSize);
             const key = `${latCell},${lngCell}`;
-            const u = this.cpmToMicroSvPerHour(m.cpm);
+            const u = this.cpmToMicroSvPerHour(track.cpm[i]);
             const g = grid.get(key) || { lat: 0, lng: 0, sum: 0, n: 0 };
-            g.lat += m.latitude;
-            g.lng += m.longitude;
+            g.lat += latitude;
+            g.lng += longitude;
             g.sum += u;
             g.n += 1;
             grid.set(key, g);
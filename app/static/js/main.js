@@ -326,7 +326,7 @@ const renderBGeigieImportsView = async () => {
         <div id="upload-section" style="display: none; margin-bottom: 20px; padding: 15px; border: 1px solid #ddd; border-radius: 4px; background: #f8f9fa;">
             <h3>Upload bGeigie Log File</h3>
             <form id="upload-form" enctype="multipart/form-data">
-                <input type="file" id="file-input" name="file" accept=".log,.LOG" required style="margin-bottom: 10px;">
+                <input type="file" id="file-input" name="file" accept=".log,.LOG,.gz,.zst,.zip" required style="margin-bottom: 10px;">
                 <div>
                     <button type="submit" class="button-primary">Upload</button>
                     <button type="button" id="cancel-upload" class="button-secondary">Cancel</button>
@@ -681,6 +681,28 @@ const handleSortClick = (e) => {
     renderImportsTable();
 };
 
+const waitForJob = async (jobId) => {
+    const uploadSection = document.getElementById('upload-section');
+    let status = document.getElementById('upload-status');
+    if (!status) {
+        status = document.createElement('div');
+        status.id = 'upload-status';
+        // Outside the imports list there is no upload section; progress is then just not shown
+        if (uploadSection) { uploadSection.appendChild(status); }
+    }
+    while (true) {
+        const response = await fetch(`/jobs/${jobId}`, { headers: { 'Authorization': `Bearer ${window.appState.token}` } });
+        if (!response.ok) { return null; }
+        const job = await response.json();
+        if (job.state === 'completed' || job.state === 'dead') {
+            status.textContent = job.state === 'dead' ? `Processing failed: ${job.error}` : '';
+            return job;
+        }
+        status.textContent = `Processing... ${job.progress.lines_parsed} lines parsed, ${job.progress.rows_inserted} measurements stored`;
+        await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+};
+
 const handleUpload = async (e) => {
     e.preventDefault();
     const fileInput = document.getElementById('file-input');
@@ -697,11 +719,23 @@ const handleUpload = async (e) => {
             body: formData
         });
         if (response.ok) {
-            const newImport = await response.json();
-            alert('File uploaded successfully!');
+            const result = await response.json();
+            // A .zip upload returns one import per log in the archive
+            const newImports = Array.isArray(result) ? result : [result];
+            // Parsing runs in the background; wait for the jobs before showing the results
+            for (const newImport of newImports) {
+                if (newImport.job_id) {
+                    await waitForJob(newImport.job_id);
+                }
+            }
+            alert(newImports.length > 1 ? `${newImports.length} logs uploaded successfully!` : 'File uploaded successfully!');
             document.getElementById('upload-section').style.display = 'none';
             document.getElementById('upload-form').reset();
-            window.location.hash = `#bgeigie-imports/${newImport.id}/detail`;
+            if (newImports.length === 1) {
+                window.location.hash = `#bgeigie-imports/${newImports[0].id}/detail`;
+            } else {
+                renderBGeigieImportsView();
+            }
         } else {
             const error = await response.json();
             alert(`Upload failed: ${error.detail}`);
@@ -906,6 +940,68 @@ const renderBGeigieImportDetail = async (importId) => {
     }
 };
 
+// Add a circle marker with a hover tooltip for each located measurement of a packed track
+const addTrackMarkers = (map, track) => {
+    // Color based on radiation level
+    const getColor = (cpm) => {
+        const uSvh = cpm / 334;
+        if (uSvh >= 100) return '#ffff00';
+        if (uSvh >= 10) return '#ff8000';
+        if (uSvh >= 1) return '#ff0000';
+        if (uSvh >= 0.25) return '#8000ff';
+        if (uSvh >= 0.08) return '#00ffff';
+        return '#0000ff';
+    };
+    const markers = [];
+    for (let i = 0; i < track.count; i++) {
+        const latitude = track.latitude[i];
+        const longitude = track.longitude[i];
+        if (!latitude || !longitude) continue;
+        const cpm = track.cpm[i];
+        const microSvPerHour = cpm / 334; // LND7317 conversion
+        const altitude = track.altitude[i];
+        const capturedAt = track.capturedAt[i];
+        
+        const marker = L.circleMarker([latitude, longitude], {
+            radius: Math.max(3, Math.min(10, Math.log(cpm + 1) * 2)),
+            fillColor: getColor(cpm),
+            color: '#000',
+            weight: 1,
+            opacity: 0.8,
+            fillOpacity: 0.7
+        });
+        
+        // Add hover tooltip with measurement details
+        const tooltipContent = `
+            <div class="measurement-tooltip" style="background: white; padding: 8px; border: 1px solid #ccc; border-radius: 4px; box-shadow: 0 2px 4px rgba(0,0,0,0.2); font-size: 12px; line-height: 1.3;">
+                <strong>${microSvPerHour.toFixed(2)} µSv/h</strong><br>
+                <strong>${cpm} CPM</strong><br>
+                Lat: ${latitude.toFixed(6)}<br>
+                Lng: ${longitude.toFixed(6)}<br>
+                Alt: ${Number.isNaN(altitude) ? 0 : Math.round(altitude * 10) / 10} m<br>
+                ${capturedAt ? new Date(capturedAt * 1000).toLocaleString() : ''}
+            </div>
+        `;
+
+        marker.bindTooltip(tooltipContent, {
+            permanent: false,
+            direction: 'top',
+            offset: [0, -10],
+            className: 'custom-tooltip',
+            interactive: true,
+            sticky: true
+        });
+
+        // Ensure tooltip opens/closes on hover explicitly
+        marker.on('mouseover', function () { this.openTooltip(); });
+        marker.on('mouseout', function () { this.closeTooltip(); });
+
+        marker.addTo(map);
+        markers.push(marker);
+    }
+    return markers;
+};
+
 // Initialize bGeigie map for import detail view
 const initializeBGeigieMap = async (importId) => {
     if (typeof L === 'undefined') {
@@ -940,91 +1036,42 @@ const initializeBGeigieMap = async (importId) => {
     
     // Load and display measurement data
     try {
-        const response = await fetch(`/bgeigie-imports/${importId}/measurements`);
-        if (!response.ok) throw new Error('Failed to load measurements');
+        // Show each track as it arrives, as markers or as the heatmap if it is on
+        const showTrack = (track) => {
+            window.currentTrack = track;
+            if (window.heatLayer) {
+                map.removeLayer(window.heatLayer);
+                window.heatLayer = null;
+                window.toggleHeatmap();
+            } else {
+                (window.currentMarkers || []).forEach(m => map.removeLayer(m));
+                window.currentMarkers = addTrackMarkers(map, track);
+            }
+        };
+        
+        // Store globals for controls
+        window.currentMarkers = [];
+        window.heatLayer = null;
         
-        const data = await response.json();
-        const measurements = data.measurements || [];
+        // A coarse track places the map, then each zoom level gets its own (see packed-track.js)
+        const zoomedTrack = new ZoomedTrack(map, importId, showTrack);
+        const track = await zoomedTrack.start();
         
-        if (measurements.length === 0) {
+        if (track.count === 0) {
             console.warn('No measurements found for import');
+            zoomedTrack.stop();
             return;
         }
         
-        const markers = [];
-        
-        // Add markers for each measurement
-        measurements.forEach(measurement => {
-            if (measurement.latitude && measurement.longitude) {
-                const cpm = measurement.cpm || 0;
-                const microSvPerHour = cpm / 334; // LND7317 conversion
-                
-                // Color based on radiation level
-                const getColor = (cpm) => {
-                    const uSvh = cpm / 334;
-                    if (uSvh >= 100) return '#ffff00';
-                    if (uSvh >= 10) return '#ff8000';
-                    if (uSvh >= 1) return '#ff0000';
-                    if (uSvh >= 0.25) return '#8000ff';
-                    if (uSvh >= 0.08) return '#00ffff';
-                    return '#0000ff';
-                };
-                
-                const marker = L.circleMarker([measurement.latitude, measurement.longitude], {
-                    radius: Math.max(3, Math.min(10, Math.log(cpm + 1) * 2)),
-                    fillColor: getColor(cpm),
-                    color: '#000',
-                    weight: 1,
-                    opacity: 0.8,
-                    fillOpacity: 0.7
-                });
-                
-                // Add hover tooltip with measurement details
-                const tooltipContent = `
-                    <div class="measurement-tooltip" style="background: white; padding: 8px; border: 1px solid #ccc; border-radius: 4px; box-shadow: 0 2px 4px rgba(0,0,0,0.2); font-size: 12px; line-height: 1.3;">
-                        <strong>${microSvPerHour.toFixed(2)} µSv/h</strong><br>
-                        <strong>${cpm} CPM</strong><br>
-                        Lat: ${measurement.latitude.toFixed(6)}<br>
-                        Lng: ${measurement.longitude.toFixed(6)}<br>
-                        Alt: ${(measurement.altitude ?? 0)} m<br>
-                        ${measurement.captured_at ? new Date(measurement.captured_at).toLocaleString() : ''}
-                    </div>
-                `;
-
-                marker.bindTooltip(tooltipContent, {
-                    permanent: false,
-                    direction: 'top',
-                    offset: [0, -10],
-                    className: 'custom-tooltip',
-                    interactive: true,
-                    sticky: true
-                });
-
-                // Ensure tooltip opens/closes on hover explicitly
-                marker.on('mouseover', function () { this.openTooltip(); });
-                marker.on('mouseout', function () { this.closeTooltip(); });
-
-                marker.addTo(map);
-                markers.push(marker);
-            }
-        });
-        
-        // Store globals for controls
-        window.currentMarkers = markers;
-        window.currentMeasurements = measurements;
-        window.heatLayer = null;
-        
         // Fit map to show all markers
-        if (markers.length > 0) {
-            const group = new L.featureGroup(markers);
+        if (window.currentMarkers.length > 0) {
+            const group = new L.featureGroup(window.currentMarkers);
             map.fitBounds(group.getBounds().pad(0.1));
         }
+        zoomedTrack.refine();
         
-        // Update statistics
-        const totalMeasurements = measurements.length;
-        const avgCPM = measurements.reduce((sum, m) => sum + (m.cpm || 0), 0) / totalMeasurements;
-        const maxCPM = Math.max(...measurements.map(m => m.cpm || 0));
-        const minCPM = Math.min(...measurements.map(m => m.cpm || 0));
+        // Update statistics (of the whole track)
+        const stats = track.stats;
         
         // Update stats in the UI
         const totalEl = document.getElementById('total-measurements');
@@ -1032,10 +1079,10 @@ const initializeBGeigieMap = async (importId) => {
         const maxEl = document.getElementById('max-cpm');
         const minEl = document.getElementById('min-cpm');
         
-        if (totalEl) totalEl.textContent = totalMeasurements;
-        if (avgEl) avgEl.textContent = avgCPM.toFixed(1);
-        if (maxEl) maxEl.textContent = maxCPM;
-        if (minEl) minEl.textContent = minCPM;
+        if (totalEl) totalEl.textContent = stats.count;
+        if (avgEl) avgEl.textContent = stats.avg.toFixed(1);
+        if (maxEl) maxEl.textContent = stats.max;
+        if (minEl) minEl.textContent = stats.min;
         
     } catch (error) {
         console.error('Error loading measurement data:', error);
@@ -1045,7 +1092,7 @@ const initializeBGeigieMap = async (importId) => {
 // Global functions for map controls
 window.toggleHeatmap = () => {
     const map = window.bgeigieMapInstance;
-    if (!map || !window.currentMeasurements) return;
+    if (!map || !window.currentTrack) return;
 
     // If heatmap exists, turn it off and restore markers
     if (window.heatLayer) {
@@ -1054,52 +1101,7 @@ window.toggleHeatmap = () => {
 
         // Recreate markers
         if (window.currentMarkers && window.currentMarkers.length > 0) return; // already present
-        window.currentMarkers = [];
-        window.currentMeasurements.forEach(measurement => {
-            if (measurement.latitude && measurement.longitude) {
-                const cpm = measurement.cpm || 0;
-                const microSvPerHour = cpm / 334;
-                const getColor = (cpmVal) => {
-                    const uSvh = cpmVal / 334;
-                    if (uSvh >= 100) return '#ffff00';
-                    if (uSvh >= 10) return '#ff8000';
-                    if (uSvh >= 1) return '#ff0000';
-                    if (uSvh >= 0.25) return '#8000ff';
-                    if (uSvh >= 0.08) return '#00ffff';
-                    return '#0000ff';
-                };
-                const marker = L.circleMarker([measurement.latitude, measurement.longitude], {
-                    radius: Math.max(3, Math.min(10, Math.log(cpm + 1) * 2)),
-                    fillColor: getColor(cpm),
-                    color: '#000',
-                    weight: 1,
-                    opacity: 0.8,
-                    fillOpacity: 0.7
-                });
-                const tooltipContent = `
-                    <div class="measurement-tooltip" style="background: white; padding: 8px; border: 1px solid #ccc; border-radius: 4px; box-shadow: 0 2px 4px rgba(0,0,0,0.2); font-size: 12px; line-height: 1.3;">
-                        <strong>${microSvPerHour.toFixed(2)} µSv/h</strong><br>
-                        <strong>${cpm} CPM</strong><br>
-                        Lat: ${measurement.latitude.toFixed(6)}<br>
-                        Lng: ${measurement.longitude.toFixed(6)}<br>
-                        Alt: ${(measurement.altitude ?? 0)} m<br>
-                        ${measurement.captured_at ? new Date(measurement.captured_at).toLocaleString() : ''}
-                    </div>
-                `;
-                marker.bindTooltip(tooltipContent, {
-                    permanent: false,
-                    direction: 'top',
-                    offset: [0, -10],
-                    className: 'custom-tooltip',
-                    interactive: true,
-                    sticky: true
-                });
-                marker.on('mouseover', function () { this.openTooltip(); });
-                marker.on('mouseout', function () { this.closeTooltip(); });
-                marker.addTo(map);
-                window.currentMarkers.push(marker);
-            }
-        });
+        window.currentMarkers = addTrackMarkers(map, window.currentTrack);
         return;
     }
 
@@ -1123,15 +1125,18 @@ window.toggleHeatmap = () => {
     // Aggregate by grid cell and use AVERAGE µSv/h per cell
     const cellSize = 0.0003; // ~30-35m grid at mid-latitudes (finer)
     const grid = new Map();
-    for (const m of (window.currentMeasurements || [])) {
-        if (!m.latitude || !m.longitude) continue;
-        const latCell = Math.floor(m.latitude / cellSize);
-        const lngCell = Math.floor(m.longitude / cellSize);
+    const track = window.currentTrack;
+    for (let i = 0; i < track.count; i++) {
+        const latitude = track.latitude[i];
+        const longitude = track.longitude[i];
+        if (!latitude || !longitude) continue;
+        const latCell = Math.floor(latitude / cellSize);
+        const lngCell = Math.floor(longitude / cellSize);
         const key = `${latCell},${lngCell}`;
-        const u = (m.cpm || 0) / 334;
+        const u = track.cpm[i] / 334;
         const g = grid.get(key) || { lat: 0, lng: 0, sum: 0, n: 0 };
-        g.lat += m.latitude;
-        g.lng += m.longitude;
+        g.lat += latitude;
+        g.lng += longitude;
         g.sum += u;
         g.n += 1;
         grid.set(key, g);
@@ -1184,7 +1189,16 @@ window.processImport = async (importId) => {
             headers: { 'Authorization': `Bearer ${window.appState.token}` }
         });
         if (response.ok) {
-            alert('Import processed successfully!');
+            // Processing is queued; wait for the job to finish
+            const { job_id } = await response.json();
+            const job = await waitForJob(job_id);
+            if (job && job.state === 'dead') {
+                alert(`Failed to process import: ${job.error}`);
+            } else if (job && !job.result) {
+                alert('Failed to process import: No valid measurements found in file');
+            } else {
+                alert('Import processed successfully!');
+            }
             // Refresh the imports list to show updated status
             await renderBGeigieImportsView();
         } else {
@@ -0,0 +1,100 @@
+// Packed measurement tracks (/bgeigie-imports/{id}/measurements?format=packed).
+// The layout is described in app/packed_track.py: a 12-byte header, then one
+// little-endian column per field, wrapped here in typed array views without copying.
+
+const PACKED_TRACK_MAGIC = 'SCTK';
+const PACKED_TRACK_CPM_UINT32 = 0x01;
+
+// Decode an ArrayBuffer into { count, latitude, longitude, altitude, capturedAt, cpm }.
+// Unknown coordinates and altitudes are NaN, unknown capture times 0 (seconds since the epoch).
+window.decodePackedTrack = (buffer) => {
+    const header = new DataView(buffer, 0, 12);
+    const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+    if (magic !== PACKED_TRACK_MAGIC || header.getUint8(4) !== 1) {
+        throw new Error('Unsupported measurement track format');
+    }
+    const flags = header.getUint8(5);
+    const count = header.getUint32(8, true);
+    let offset = 12;
+    const column = (ArrayType) => {
+        const values = new ArrayType(buffer, offset, count);
+        offset += count * ArrayType.BYTES_PER_ELEMENT;
+        return values;
+    };
+    return {
+        count,
+        latitude: column(Float32Array),
+        longitude: column(Float32Array),
+        altitude: column(Float32Array),
+        capturedAt: column(Uint32Array),
+        cpm: column(flags & PACKED_TRACK_CPM_UINT32 ? Uint32Array : Uint16Array)
+    };
+};
+
+// Fetch and decode the track of an import, optionally decimated: params may give the map
+// `zoom` to thin it for, and `max_points`. track.stats describes the whole track
+// ({ count, avg, min, max } CPM), however decimated.
+window.fetchPackedTrack = async (importId, params = {}) => {
+    const query = new URLSearchParams({ format: 'packed', ...params });
+    const response = await fetch(`/bgeigie-imports/${importId}/measurements?${query}`);
+    if (!response.ok) throw new Error('Failed to load measurements');
+    const track = window.decodePackedTrack(await response.arrayBuffer());
+    const header = (name) => Number(response.headers.get(name));
+    track.stats = {
+        count: header('X-Track-Count'),
+        avg: header('X-Track-CPM-Avg'),
+        min: header('X-Track-CPM-Min'),
+        max: header('X-Track-CPM-Max')
+    };
+    return track;
+};
+
+// Loads the track of an import for each zoom level of a map, once: a coarse track of
+// COARSE_TRACK_POINTS first, then the track thinned for the zoom whenever it changes.
+// onTrack(track) is called with each track as it arrives.
+const COARSE_TRACK_POINTS = 2000;
+
+window.ZoomedTrack = class {
+    constructor(map, importId, onTrack) {
+        this.map = map;
+        this.importId = importId;
+        this.onTrack = onTrack;
+        this.tracks = new Map();
+        this.zoom = null;
+        this.current = null;
+        this.refine = () => this.load(this.map.getZoom());
+    }
+
+    // Resolves with the coarse track; the map then follows zoom changes
+    async start() {
+        const track = await fetchPackedTrack(this.importId, { max_points: COARSE_TRACK_POINTS });
+        this.show(track);
+        this.map.on('zoomend', this.refine);
+        return track;
+    }
+
+    stop() {
+        this.map.off('zoomend', this.refine);
+    }
+
+    async load(zoom) {
+        this.zoom = zoom;
+        if (!this.tracks.has(zoom)) {
+            this.tracks.set(zoom, fetchPackedTrack(this.importId, { zoom }));
+        }
+        try {
+            const track = await this.tracks.get(zoom);
+            // Drop tracks for zoom levels the user has already left
+            if (this.zoom === zoom) this.show(track);
+        } catch (error) {
+            this.tracks.delete(zoom);
+            console.error('Error loading track for zoom', zoom, error);
+        }
+    }
+
+    show(track) {
+        if (track === this.current) return;
+        this.current = track;
+        this.onTrack(track);
+    }
+};
@@ -0,0 +1,66 @@
+"""
+Streaming NDJSON and CSV responses for bulk measurement reads.
+
+The query runs on a session of its own and its rows are fetched FETCH_ROWS at a time as
+the client reads, each batch encoded and sent before the next is fetched. No ORM objects
+or Pydantic models are built, memory stays flat and the first bytes go out as soon as
+DuckDB produces the first rows, whatever the size of the result. A client that goes away
+stops the fetching.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Iterator, List, Optional
+
+from fastapi.responses import StreamingResponse
+
+from .database import SessionLocal
+
+FETCH_ROWS = 10_000
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def _ndjson(columns: List[str], batch) -> str:
+    return "".join(json.dumps(dict(zip(columns, row)), default=_json_default) + "\n" for row in batch)
+
+
+def _csv(batch) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(
+        [value.isoformat() if isinstance(value, datetime) else value for value in row] for row in batch
+    )
+    return buffer.getvalue()
+
+
+def _rows(statement, columns: List[str], format: str) -> Iterator[str]:
+    db = SessionLocal()
+    try:
+        # Without yield_per an ORM session buffers the whole result before returning the first row
+        result = db.execute(statement.execution_options(yield_per=FETCH_ROWS))
+        if format == "csv":
+            yield ",".join(columns) + "\n"
+        for batch in result.partitions(FETCH_ROWS):
+            yield _csv(batch) if format == "csv" else _ndjson(columns, batch)
+    finally:
+        db.close()
+
+
+def stream_rows(statement, format: str, filename: Optional[str] = None) -> StreamingResponse:
+    """
+    Streams the rows of a select statement as NDJSON (one object per line) or CSV (with a
+    header line). Column names come from the statement.
+    """
+    columns = [column.key for column in statement.selected_columns]
+    headers = {"Content-Disposition": f'attachment; filename="{filename}.{format}"'} if filename else None
+    return StreamingResponse(_rows(statement, columns, format), media_type=MEDIA_TYPES[format], headers=headers)
@@ -0,0 +1,233 @@
+"""
+Map tiles over the approved measurements, cached on disk.
+
+Tiles use the Web Mercator z/x/y scheme of web maps (256 pixels a side). Within a tile,
+measurements are aggregated per pixel by DuckDB: the mean, highest and number of CPM
+readings. /tiles/{z}/{x}/{y}.mvt serves them as vector tiles (see mvt.py).
+
+/tiles/heatmap/{z}/{x}/{y}.png serves them as raster tiles: the readings are binned per
+pixel with numpy, averaged over HEAT_RADIUS_PIXELS around each pixel (readings just past
+the tile edge included, so tiles join up) and coloured with the µSv/h scale of the map
+legend (see png.py). seed_tiles.py pre-renders the low zoom levels; the others are rendered
+on first request.
+
+Each tile has a version: the newest map_changes row whose extent overlaps it. A row is
+recorded whenever an import's measurements join or leave the approved data (approval,
+rejection, deletion, reprocessing; see crud.record_map_change). Cached tiles are stored
+under their version, so a change invalidates the tiles over that import's extent and no
+others, in every serving process; superseded versions are removed when a tile is
+rendered again.
+"""
+import glob
+import math
+import os
+import tempfile
+from typing import Optional, Tuple
+
+import numpy as np
+from sqlalchemy import Integer, cast, func, select
+from sqlalchemy.orm import Session
+
+from . import models, mvt, png, spatial
+from .config import settings
+
+TILE_PIXELS = 256
+MAX_ZOOM = 22
+LAYER_NAME = "measurements"
+
+
+# Heatmap readings are averaged over this many pixels around each pixel
+HEAT_RADIUS_PIXELS = 2
+HEAT_ALPHA = 200
+
+# Conversion of the LND7317 tube in the bGeigie
+CPM_PER_MICROSIEVERT_HOUR = 334
+# The map legend (static/js): the colour of doses from each threshold in µSv/h up to the next
+DOSE_COLOURS = [
+    (0.0, "#000000"),
+    (0.03, "#0000ff"),
+    (0.08, "#00ffff"),
+    (0.14, "#0080ff"),
+    (0.25, "#8000ff"),
+    (0.43, "#ff00ff"),
+    (1.0, "#ff0080"),
+    (1.65, "#ff0000"),
+    (5.0, "#ff4000"),
+    (10.0, "#ff8000"),
+    (65.54, "#ffff80"),
+    (100.0, "#ffff00"),
+]
+_DOSE_THRESHOLDS = np.array([threshold for threshold, _ in DOSE_COLOURS[1:]])
+_DOSE_PALETTE = np.array([[int(colour[i:i + 2], 16) for i in (1, 3, 5)] + [HEAT_ALPHA] for _, colour in DOSE_COLOURS],
+                         dtype=np.uint8)
+
+
+def pixel_bounds(z: int, left: int, top: int, right: int, bottom: int) -> Tuple[float, float, float, float]:
+    """(west, south, east, north) in degrees of a rectangle of world pixels at the zoom."""
+    size = TILE_PIXELS * 2 ** z
+
+    def latitude(row: float) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / size))))
+
+    return left / size * 360.0 - 180.0, latitude(bottom), right / size * 360.0 - 180.0, latitude(top)
+
+
+def tile_bounds(z: int, x: int, y: int, margin_pixels: int = 0) -> Tuple[float, float, float, float]:
+    """(west, south, east, north) of a tile in degrees, widened by margin_pixels on each side."""
+    return pixel_bounds(z, x * TILE_PIXELS - margin_pixels, y * TILE_PIXELS - margin_pixels,
+                        (x + 1) * TILE_PIXELS + margin_pixels, (y + 1) * TILE_PIXELS + margin_pixels)
+
+
+def valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def tile_version(db: Session, z: int, x: int, y: int, margin_pixels: int = 0) -> int:
+    """Id of the newest change to the approved measurements over the tile (and margin); 0 if there is none."""
+    west, south, east, north = tile_bounds(z, x, y, margin_pixels)
+    return db.query(func.coalesce(func.max(models.MapChange.id), 0)).filter(
+        models.MapChange.lat_min <= north, models.MapChange.lat_max >= south,
+        models.MapChange.lon_min <= east, models.MapChange.lon_max >= west,
+    ).scalar()
+
+
+def _approved_imports():
+    """Ids the approved measurements are stored under; re-uploads share their source's (see crud.measurements_on_map)."""
+    imports = models.BGeigieImport
+    return select(func.coalesce(imports.source_import_id, imports.id)).where(imports.status == "approved")
+
+
+def pixel_aggregates(db: Session, z: int, x: int, y: int) -> list:
+    """(pixel x, pixel y, mean CPM, highest CPM, readings) of each pixel of the tile with approved measurements."""
+    west, south, east, north = tile_bounds(z, x, y)
+    scale = TILE_PIXELS * 2 ** z
+    measurement = models.Measurement
+    latitude = func.radians(measurement.latitude)
+    pixel_x = cast(func.floor((measurement.longitude + 180.0) / 360.0 * scale), Integer) - x * TILE_PIXELS
+    pixel_y = cast(func.floor(
+        (1.0 - func.ln(func.tan(latitude) + 1.0 / func.cos(latitude)) / math.pi) / 2.0 * scale
+    ), Integer) - y * TILE_PIXELS
+    statement = select(
+        pixel_x, pixel_y, func.avg(measurement.cpm), func.max(measurement.cpm), func.count(measurement.cpm)
+    ).where(
+        measurement.bgeigie_import_id.in_(_approved_imports()),
+        spatial.cell_filter(measurement.spatial_cell, south, north, west, east),
+        # Half-open, so a point on a tile edge is in one tile only
+        measurement.latitude > south, measurement.latitude <= north,
+        measurement.longitude >= west, measurement.longitude < east,
+        measurement.cpm.is_not(None),
+    ).group_by(pixel_x, pixel_y)
+    return [
+        (min(max(px, 0), TILE_PIXELS - 1), min(max(py, 0), TILE_PIXELS - 1), mean, highest, count)
+        for px, py, mean, highest, count in db.execute(statement).all()
+    ]
+
+
+def render_mvt(db: Session, z: int, x: int, y: int) -> bytes:
+    """The vector tile: one point per pixel at its centre, with cpm_mean, cpm_max and count."""
+    step = mvt.DEFAULT_EXTENT // TILE_PIXELS
+    return mvt.encode_point_layer(LAYER_NAME, (
+        (px * step + step // 2, py * step + step // 2,
+         {"cpm_mean": round(float(mean), 1), "cpm_max": int(highest), "count": int(count)})
+        for px, py, mean, highest, count in pixel_aggregates(db, z, x, y)
+    ))
+
+
+def _approved_points(db: Session, west: float, south: float, east: float, north: float) -> dict:
+    """Latitude, longitude and cpm arrays of the approved measurements in the box."""
+    measurement = models.Measurement
+    west, east = max(west, -180.0), min(east, 180.0)
+    statement = select(measurement.latitude, measurement.longitude, measurement.cpm).where(
+        measurement.bgeigie_import_id.in_(_approved_imports()),
+        spatial.cell_filter(measurement.spatial_cell, south, north, west, east),
+        measurement.latitude > south, measurement.latitude <= north,
+        measurement.longitude >= west, measurement.longitude < east,
+        measurement.cpm.is_not(None),
+    )
+    # Fetched as numpy columns, without a row object per reading
+    sql = str(statement.compile(dialect=db.get_bind().dialect, compile_kwargs={"literal_binds": True}))
+    return db.connection().connection.driver_connection.execute(sql).fetchnumpy()
+
+
+def render_heatmap(db: Session, z: int, x: int, y: int) -> bytes:
+    """The raster tile: mean dose around each pixel, in the legend's colours; transparent without readings."""
+    r = HEAT_RADIUS_PIXELS
+    side = TILE_PIXELS + 2 * r
+    points = _approved_points(db, *tile_bounds(z, x, y, r))
+    latitudes = np.radians(np.asarray(points["latitude"], dtype=np.float64))
+    scale = TILE_PIXELS * 2 ** z
+    columns = np.floor((np.asarray(points["longitude"], dtype=np.float64) + 180.0) / 360.0 * scale) - (x * TILE_PIXELS - r)
+    rows = np.floor((1.0 - np.log(np.tan(latitudes) + 1.0 / np.cos(latitudes)) / math.pi) / 2.0 * scale) - (y * TILE_PIXELS - r)
+    cells = np.clip(rows, 0, side - 1).astype(np.int64) * side + np.clip(columns, 0, side - 1).astype(np.int64)
+
+    # Readings and their summed dose per pixel of the tile and its margin
+    counts = np.bincount(cells, minlength=side * side).reshape(side, side).astype(np.float64)
+    doses = np.bincount(cells, weights=np.asarray(points["cpm"], dtype=np.float64) / CPM_PER_MICROSIEVERT_HOUR,
+                        minlength=side * side).reshape(side, side)
+    # Summed over the (2r + 1)-pixel square around each tile pixel, with integral images
+    window = 2 * r + 1
+
+    def box_sum(grid: np.ndarray) -> np.ndarray:
+        integral = np.zeros((side + 1, side + 1))
+        integral[1:, 1:] = grid.cumsum(axis=0).cumsum(axis=1)
+        return (integral[window:, window:] - integral[:-window, window:]
+                - integral[window:, :-window] + integral[:-window, :-window])
+
+    counts, doses = box_sum(counts), box_sum(doses)
+    rgba = np.zeros((TILE_PIXELS, TILE_PIXELS, 4), dtype=np.uint8)
+    covered = counts > 0.5
+    rgba[covered] = _DOSE_PALETTE[np.searchsorted(_DOSE_THRESHOLDS, doses[covered] / counts[covered], side="right")]
+    return png.encode_png(rgba)
+
+
+def occupied_tiles(db: Session, z: int) -> list:
+    """(x, y) of the tiles at the zoom holding approved measurements."""
+    n = 2 ** z
+    measurement = models.Measurement
+    latitude = func.radians(measurement.latitude)
+    tile_x = cast(func.floor((measurement.longitude + 180.0) / 360.0 * n), Integer)
+    tile_y = cast(func.floor((1.0 - func.ln(func.tan(latitude) + 1.0 / func.cos(latitude)) / math.pi) / 2.0 * n), Integer)
+    statement = select(tile_x, tile_y).where(
+        measurement.bgeigie_import_id.in_(_approved_imports()),
+        measurement.latitude.between(-85.05112878, 85.05112878),
+        measurement.longitude >= -180.0, measurement.longitude < 180.0,
+    ).group_by(tile_x, tile_y).order_by(tile_x, tile_y)
+    return [tuple(row) for row in db.execute(statement).all()]
+
+
+class TileCache:
+    """Rendered tiles on disk, as <directory>/<z>/<x>/<y>.<version><suffix>."""
+
+    def __init__(self, directory: str, suffix: str):
+        self.directory = directory
+        self.suffix = suffix
+
+    def _path(self, z: int, x: int, y: int, version: int) -> str:
+        return os.path.join(self.directory, str(z), str(x), f"{y}.{version}{self.suffix}")
+
+    def get(self, z: int, x: int, y: int, version: int) -> Optional[bytes]:
+        try:
+            with open(self._path(z, x, y, version), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, z: int, x: int, y: int, version: int, data: bytes):
+        path = self._path(z, x, y, version)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Written aside and renamed, so readers in other processes never see part of a tile
+        fd, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temporary, path)
+        for superseded in glob.glob(os.path.join(directory, f"{y}.*{self.suffix}")):
+            if superseded != path:
+                try:
+                    os.remove(superseded)
+                except FileNotFoundError:
+                    pass
+
+
+mvt_cache = TileCache(os.path.join(settings.TILE_CACHE_DIR, "mvt"), ".mvt")
+heatmap_cache = TileCache(os.path.join(settings.TILE_CACHE_DIR, "heatmap"), ".png")
@@ -0,0 +1,173 @@
+"""
+Zoom-aware decimation of import tracks for the map pages.
+
+At low zoom most of a drive's points fall on the same few pixels. A track is thinned in
+two steps, both of which keep radiation peaks:
+
+- with a zoom, to one point per THIN_PIXELS square of Web Mercator pixels at that zoom,
+  the one with the highest CPM;
+- with max_points, to at most that many points by Largest-Triangle-Three-Buckets (LTTB)
+  over CPM along the drive, which keeps the points that shape the CPM curve (spikes and
+  dips) rather than every Nth one. The highest CPM of the track is always kept.
+
+Full and decimated tracks are cached per import and level (LRU, TRACK_CACHE_MAX_BYTES).
+Entries are keyed by the import's measurements_count, as in the nearest-neighbour index, so
+a track is loaded again once (re)processing changes it, in every serving process.
+"""
+import math
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+
+from .config import settings
+
+# Side of the square of screen pixels thinned to one point (markers are 3-10 px across)
+THIN_PIXELS = 4
+TILE_PIXELS = 256
+MAX_ZOOM = 22
+# Web Mercator stops short of the poles
+_MAX_MERCATOR_LATITUDE = 85.05112878
+
+Columns = Dict[str, np.ndarray]
+
+TRACK_COLUMNS_SQL = """
+    SELECT id, latitude, longitude, altitude, CAST(epoch(captured_at) AS BIGINT) AS captured_at, cpm
+    FROM measurements WHERE bgeigie_import_id = ? ORDER BY id
+"""
+
+
+def lttb(y: np.ndarray, threshold: int) -> np.ndarray:
+    """Positions of the `threshold` points of y (over x = 0..n-1) that LTTB keeps, in order."""
+    n = len(y)
+    if threshold >= n:
+        return np.arange(n)
+    if threshold < 3:
+        return np.array([0, n - 1][:threshold], dtype=np.int64)
+    y = y.astype(np.float64)
+    # Interior points in threshold - 2 buckets; the first and last points are always kept
+    edges = (np.arange(threshold - 1) * ((n - 2) / (threshold - 2))).astype(np.int64) + 1
+    edges[-1] = n - 1
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # The third corner is the average of the next bucket (the last point after the last bucket)
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_x = (end + next_end - 1) / 2
+        next_y = y[end:next_end].mean()
+        x = np.arange(start, end)
+        areas = np.abs((a - next_x) * (y[start:end] - y[a]) - (a - x) * (next_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[bucket + 1] = a
+    return selected
+
+
+def thin_to_pixels(latitude: np.ndarray, longitude: np.ndarray, cpm: np.ndarray, zoom: int) -> np.ndarray:
+    """Positions of the highest-CPM point in each THIN_PIXELS square at the zoom, in order."""
+    located = np.flatnonzero(~(np.isnan(latitude) | np.isnan(longitude)))
+    if len(located) == 0:
+        return located
+    scale = TILE_PIXELS * 2.0 ** zoom / THIN_PIXELS
+    latitudes = np.radians(np.clip(latitude[located].astype(np.float64), -_MAX_MERCATOR_LATITUDE, _MAX_MERCATOR_LATITUDE))
+    x = np.floor((longitude[located].astype(np.float64) + 180.0) / 360.0 * scale).astype(np.int64)
+    y = np.floor((1.0 - np.log(np.tan(latitudes) + 1.0 / np.cos(latitudes)) / math.pi) / 2.0 * scale).astype(np.int64)
+    # Sort by square, highest CPM first within it, and keep the first of each square
+    order = np.lexsort((-cpm[located].astype(np.int64), y, x))
+    squares = np.stack((x[order], y[order]), axis=1)
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = np.any(squares[1:] != squares[:-1], axis=1)
+    return np.sort(located[order[first]])
+
+
+def decimate(columns: Columns, zoom: Optional[int] = None, max_points: Optional[int] = None) -> Columns:
+    """The track thinned for the zoom and cut down to max_points (either may be None)."""
+    positions = np.arange(len(columns['id']))
+    if zoom is not None:
+        positions = thin_to_pixels(columns['latitude'], columns['longitude'], columns['cpm'], zoom)
+    if max_points is not None and len(positions) > max_points:
+        cpm = columns['cpm'][positions]
+        kept = lttb(cpm, max_points)
+        peak = int(np.argmax(cpm))
+        if peak not in kept:
+            # Replace the point picked from the peak's bucket (never the first or last point)
+            kept[min(max(np.searchsorted(kept, peak), 1), len(kept) - 2)] = peak
+            kept.sort()
+        positions = positions[kept]
+    return {name: values[positions] for name, values in columns.items()}
+
+
+class TrackCache:
+    """Least recently used decimated tracks, up to max_bytes of column data."""
+
+    def __init__(self, max_bytes: int = settings.TRACK_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[tuple, Columns]" = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[Columns]:
+        with self.lock:
+            columns = self.entries.get(key)
+            if columns is not None:
+                self.entries.move_to_end(key)
+            return columns
+
+    def put(self, key: tuple, columns: Columns):
+        size = sum(values.nbytes for values in columns.values())
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = columns
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= sum(values.nbytes for values in evicted.values())
+
+
+track_cache = TrackCache()
+
+
+def _full_track(db, db_import) -> Columns:
+    key = (db_import.measurements_import_id, db_import.measurements_count, None, None)
+    full = track_cache.get(key)
+    if full is None:
+        connection = db.connection().connection.driver_connection
+        fetched = connection.execute(TRACK_COLUMNS_SQL, [db_import.measurements_import_id]).fetchnumpy()
+        full = {
+            'id': np.asarray(fetched['id'], dtype=np.int64),
+            'latitude': np.ma.filled(np.ma.asarray(fetched['latitude'], dtype=np.float64), np.nan),
+            'longitude': np.ma.filled(np.ma.asarray(fetched['longitude'], dtype=np.float64), np.nan),
+            'altitude': np.ma.filled(np.ma.asarray(fetched['altitude'], dtype=np.float64), np.nan),
+            'captured_at': np.ma.filled(np.ma.asarray(fetched['captured_at'], dtype=np.int64), 0),
+            'cpm': np.ma.filled(np.ma.asarray(fetched['cpm'], dtype=np.int64), 0),
+        }
+        track_cache.put(key, full)
+    return full
+
+
+def import_track_columns(db, db_import, zoom: Optional[int] = None, max_points: Optional[int] = None) -> Columns:
+    """
+    The columns of an import's track (id, latitude, longitude, altitude, captured_at in epoch
+    seconds, cpm; NULLs as NaN or 0), decimated for the zoom and max_points and cached.
+    """
+    if zoom is None and max_points is None:
+        return _full_track(db, db_import)
+    key = (db_import.measurements_import_id, db_import.measurements_count, zoom, max_points)
+    columns = track_cache.get(key)
+    if columns is None:
+        columns = decimate(_full_track(db, db_import), zoom, max_points)
+        track_cache.put(key, columns)
+    return columns
+
+
+def import_track_stats(db, db_import) -> dict:
+    """Number of measurements and mean, lowest and highest CPM of the whole track."""
+    cpm = _full_track(db, db_import)['cpm']
+    if len(cpm) == 0:
+        return {"count": 0, "cpm_avg": 0.0, "cpm_min": 0, "cpm_max": 0}
+    return {"count": len(cpm), "cpm_avg": float(cpm.mean()), "cpm_min": int(cpm.min()), "cpm_max": int(cpm.max())}
@@ -0,0 +1,87 @@
+"""
+Content-addressed storage for uploaded bGeigie logs.
+
+Raw logs are kept at uploads/<md5[:2]>/<md5>. An upload is written to a temporary
+file while it streams in and renamed into place once its hash is known, so identical
+bytes are stored once however many times (and by however many users) they are uploaded.
+"""
+import hashlib
+import os
+import uuid
+from typing import Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models
+
+UPLOAD_DIR = "uploads"
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def blob_path(md5sum: str) -> str:
+    """Where the log with the given md5sum is stored."""
+    return os.path.join(UPLOAD_DIR, md5sum[:2], md5sum)
+
+
+async def store_upload(upload, chunk_size: int = READ_CHUNK_SIZE) -> Tuple[str, str, int]:
+    """
+    Streams an UploadFile into the store, hashing it on the way.
+    Returns (md5sum, path, size); a blob that is already stored is left untouched.
+    """
+    tmp_dir = os.path.join(UPLOAD_DIR, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+
+    md5 = hashlib.md5()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                md5.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+
+        md5sum = md5.hexdigest()
+        path = blob_path(md5sum)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return md5sum, path, size
+
+
+def import_file_path(bgeigie_import: models.BGeigieImport) -> str:
+    """
+    The raw log of an import: its content-addressed blob, or uploads/<source>
+    for imports stored before the blob store existed.
+    """
+    if bgeigie_import.md5sum:
+        path = blob_path(bgeigie_import.md5sum)
+        if os.path.isfile(path):
+            return path
+    return os.path.join(UPLOAD_DIR, bgeigie_import.source)
+
+
+def release(db: Session, md5sum: Optional[str]) -> bool:
+    """Deletes a stored log once no import references its hash any more. Returns whether it was deleted."""
+    if not md5sum:
+        return False
+    still_referenced = db.query(models.BGeigieImport.id).filter(
+        models.BGeigieImport.md5sum == md5sum
+    ).first()
+    if still_referenced is not None:
+        return False
+    path = blob_path(md5sum)
+    if not os.path.isfile(path):
+        return False
+    os.remove(path)
+    return True
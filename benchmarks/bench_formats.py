@@ -0,0 +1,34 @@
+"""
+Per-format parse throughput for every registered sentence decoder.
+
+Usage: python -m benchmarks.bench_formats [--lines N]
+
+Each format gets its own synthetic log so a slow decoder stands out.
+"""
+import argparse
+import time
+
+from app import bgeigie_columnar, bgeigie_parser
+from benchmarks.corpus import make_corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lines', type=int, default=200_000)
+    args = parser.parse_args()
+
+    print(f"{'format':<10} {'scalar lines/s':>16} {'columnar lines/s':>18}")
+    for header in bgeigie_parser.DECODERS:
+        content = make_corpus(args.lines, headers=[header])
+        started = time.perf_counter()
+        bgeigie_parser.parse_bgeigie_log(content.decode('utf-8'))
+        scalar_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        bgeigie_columnar.parse_bgeigie_columns(content)
+        columnar_seconds = time.perf_counter() - started
+        print(f"{header:<10} {args.lines / scalar_seconds:>16,.0f} {args.lines / columnar_seconds:>18,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Compares the ORM and bulk measurement insert paths.
+
+Usage: python -m benchmarks.bench_ingest [--rows N] [--batch-size N]
+
+Both paths insert the same parsed measurements into a scratch DuckDB database
+(never safecast.db) in batches, as the import handlers do, and report rows per second.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from app import bgeigie_parser, crud
+from benchmarks.corpus import make_corpus
+
+# The measurements table as created by install.py and fix_database.py
+MEASUREMENTS_TABLE = """
+    CREATE TABLE measurements (
+        id INTEGER PRIMARY KEY,
+        cpm INTEGER,
+        latitude DOUBLE,
+        longitude DOUBLE,
+        captured_at TIMESTAMP,
+        bgeigie_import_id INTEGER,
+        device_id INTEGER,
+        altitude DOUBLE,
+        spatial_cell BIGINT
+    )
+"""
+
+
+def _run(insert, measurements, batch_size: int) -> float:
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"duckdb:///{os.path.join(directory, 'bench.db')}")
+        with engine.begin() as connection:
+            connection.execute(text("CREATE SEQUENCE measurements_id_seq"))
+            connection.execute(text(MEASUREMENTS_TABLE))
+        db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+        try:
+            started = time.perf_counter()
+            for i in range(0, len(measurements), batch_size):
+                insert(db, measurements[i:i + batch_size], 1)
+            seconds = time.perf_counter() - started
+            inserted = db.execute(text("SELECT COUNT(*) FROM measurements")).scalar()
+            assert inserted == len(measurements), (inserted, len(measurements))
+        finally:
+            db.close()
+            engine.dispose()
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=50_000)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    measurements = bgeigie_parser.parse_bgeigie_log(make_corpus(args.rows * 2).decode('utf-8'))[:args.rows]
+
+    orm_seconds = _run(
+        lambda db, batch, import_id: crud.create_measurements(db=db, measurements=batch, bgeigie_import_id=import_id),
+        measurements, args.batch_size,
+    )
+    bulk_seconds = _run(crud.bulk_insert_measurements, measurements, args.batch_size)
+
+    print(f"rows:    {len(measurements)} in batches of {args.batch_size}")
+    print(f"orm:     {len(measurements) / orm_seconds:,.0f} rows/s ({orm_seconds:.2f}s)")
+    print(f"bulk:    {len(measurements) / bulk_seconds:,.0f} rows/s ({bulk_seconds:.2f}s)")
+    print(f"speedup: {orm_seconds / bulk_seconds:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Compares the scalar and columnar bGeigie parsers.
+
+Usage: python -m benchmarks.bench_parser [--lines N] [--file path/to/log]
+
+Both engines parse the same buffer; the script exits with status 1 if their
+measurements or parse reports differ and otherwise prints lines per second for each.
+"""
+import argparse
+import datetime
+import sys
+import time
+
+import numpy as np
+
+from app import bgeigie_columnar, bgeigie_parser
+from benchmarks.corpus import make_corpus
+
+
+def _normalize(measurement: dict) -> dict:
+    """Brings a scalar-parser measurement to the columnar representation (naive UTC, float32 HDOP)."""
+    measurement = dict(measurement)
+    captured_at = measurement['captured_at']
+    if captured_at.tzinfo is not None:
+        measurement['captured_at'] = captured_at.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    if measurement['hdop'] is not None:
+        measurement['hdop'] = float(np.float32(measurement['hdop']))
+    return measurement
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lines', type=int, default=1_000_000)
+    parser.add_argument('--file', help='parse this log instead of a synthetic corpus')
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, 'rb') as f:
+            content = f.read()
+    else:
+        content = make_corpus(args.lines)
+    lines = content.count(b'\n')
+
+    scalar_stats = bgeigie_parser.ParseStats()
+    columnar_stats = bgeigie_parser.ParseStats()
+    started = time.perf_counter()
+    expected = bgeigie_parser.parse_bgeigie_log(content.decode('utf-8'), scalar_stats)
+    scalar_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    columns = bgeigie_columnar.parse_bgeigie_columns(content, columnar_stats)
+    columnar_seconds = time.perf_counter() - started
+
+    expected = [_normalize(m) for m in expected]
+    actual = bgeigie_columnar.columns_to_measurements(columns)
+    mismatches = sum(a != b for a, b in zip(expected, actual)) + abs(len(expected) - len(actual))
+    mismatches += scalar_stats.report.as_dict() != columnar_stats.report.as_dict()
+
+    print(f"lines:        {lines}")
+    print(f"measurements: {len(expected)} scalar, {len(actual)} columnar, {mismatches} mismatches")
+    print(f"scalar:       {lines / scalar_seconds:,.0f} lines/s ({scalar_seconds:.2f}s)")
+    print(f"columnar:     {lines / columnar_seconds:,.0f} lines/s ({columnar_seconds:.2f}s)")
+    print(f"speedup:      {scalar_seconds / columnar_seconds:.1f}x")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
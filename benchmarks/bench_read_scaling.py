@@ -0,0 +1,118 @@
+"""
+Read throughput of reader API workers as their number grows.
+
+Usage: python -m benchmarks.bench_read_scaling [--workers 1 2 4] [--clients N] [--seconds S] [--path PATH]
+
+Publishes a snapshot of a copy of safecast.db (the database itself is never opened), then
+for each worker count starts `uvicorn app.main:app --workers N` with SERVING_MODE=reader,
+drives it with concurrent keep-alive GET requests and reports requests per second.
+Reads only scale with workers as far as there are cores to run them on.
+"""
+import argparse
+import http.client
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import duckdb
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _publish(directory: str) -> str:
+    """Publishes a snapshot of a copy of safecast.db into directory/snapshots."""
+    os.environ['SNAPSHOT_DIR'] = os.path.join(directory, 'snapshots')
+    from app.snapshots import publish_snapshot
+
+    database = os.path.join(directory, 'safecast.db')
+    for suffix in ('', '.wal'):
+        if os.path.exists(os.path.join(REPO, f'safecast.db{suffix}')):
+            shutil.copy(os.path.join(REPO, f'safecast.db{suffix}'), f'{database}{suffix}')
+    connection = duckdb.connect(database)
+    try:
+        return publish_snapshot(connection)
+    finally:
+        connection.close()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_until_up(port: int, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/measurements/?limit=1')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"Server on port {port} did not come up within {timeout:g}s")
+
+
+def _drive(port: int, path: str, clients: int, seconds: float) -> tuple:
+    """Sends GET path from `clients` threads for `seconds`; returns (ok, failed) request counts."""
+    counts = [[0, 0] for _ in range(clients)]
+    stop_at = time.monotonic() + seconds
+
+    def client(count):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        while time.monotonic() < stop_at:
+            try:
+                connection.request('GET', path)
+                response = connection.getresponse()
+                response.read()
+                count[0 if response.status == 200 else 1] += 1
+            except (OSError, http.client.HTTPException):
+                count[1] += 1
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+
+    threads = [threading.Thread(target=client, args=(count,)) for count in counts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(c[0] for c in counts), sum(c[1] for c in counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--path', default='/measurements/?limit=100')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"snapshot: {_publish(directory)}")
+        env = {**os.environ, 'SERVING_MODE': 'reader', 'PYTHONPATH': REPO}
+        print(f"{'workers':>7} {'requests/s':>12} {'failed':>8}")
+        for workers in args.workers:
+            port = _free_port()
+            server = subprocess.Popen(
+                [sys.executable, '-m', 'uvicorn', 'app.main:app', '--port', str(port),
+                 '--workers', str(workers), '--log-level', 'warning'],
+                cwd=directory, env=env,
+            )
+            try:
+                _wait_until_up(port)
+                ok, failed = _drive(port, args.path, args.clients, args.seconds)
+                print(f"{workers:>7} {ok / args.seconds:>12,.0f} {failed:>8}")
+            finally:
+                server.terminate()
+                server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Synthetic bGeigie logs shared by the benchmarks.
+
+The corpus mixes every supported header with the lines real logs contain:
+bad checksums, comments, malformed timestamps, CPMs too large for the database
+(a corrupt SD card) and blank lines.
+"""
+import datetime
+import random
+from typing import List, Optional
+
+from app.bgeigie_parser import VALID_HEADERS, calculate_checksum
+
+
+def make_line(i: int, header: str, rnd: random.Random) -> str:
+    captured_at = datetime.datetime(2024, 11, 22, 7, 17) + datetime.timedelta(seconds=5 * i)
+    sentence = (
+        f"{header},2299,{captured_at:%Y-%m-%dT%H:%M:%SZ},{rnd.randint(10, 200)},3,5036,A,"
+        f"{3536.0 + rnd.random():.4f},N,{13944.0 + rnd.random():.4f},E,{rnd.uniform(0, 300):.2f},A,9,124"
+    )
+    return f"{sentence}*{calculate_checksum(sentence)}"
+
+
+def make_corpus(lines: int, seed: int = 1, headers: Optional[List[str]] = None) -> bytes:
+    """Returns a log of the given number of lines, about 3% of them unusable."""
+    rnd = random.Random(seed)
+    headers = headers or VALID_HEADERS
+    out = []
+    for i in range(lines):
+        kind = rnd.random()
+        line = make_line(i, rnd.choice(headers), rnd)
+        if kind < 0.01:
+            line = line[:-2] + '00'
+        elif kind < 0.02:
+            line = '# comment ' + line
+        elif kind < 0.025:
+            sentence = line.split('*')[0].replace('-11-', '-13-')
+            line = f"{sentence}*{calculate_checksum(sentence)}"
+        elif kind < 0.028:
+            line = ''
+        elif kind < 0.03:
+            fields = line.split('*')[0].split(',')
+            fields[3] = '99999999999'
+            sentence = ','.join(fields)
+            line = f"{sentence}*{calculate_checksum(sentence)}"
+        out.append(line)
+    return ('\n'.join(out) + '\n').encode('utf-8')
@@ -2,13 +2,40 @@
 """
 Database schema fix script for Safecast API
 Adds missing columns:
-- measurements: device_id, altitude
+- measurements: device_id, altitude, spatial_cell (backfilled and indexed)
 - users: name
+- bgeigie_imports: parse_report, archive_member, source_import_id, parsed_at
+- jobs: priority, claimed_at
 """
 
 import duckdb
 import os
 
+from app.spatial import spatial_cells
+
+def backfill_spatial_cells(conn, batch_size=1_000_000):
+    """Computes spatial_cell for measurements that have coordinates but no cell yet; returns how many."""
+    total = 0
+    while True:
+        rows = conn.execute("""
+            SELECT id, latitude, longitude FROM measurements
+            WHERE spatial_cell IS NULL AND latitude IS NOT NULL AND longitude IS NOT NULL
+              AND NOT isnan(latitude) AND NOT isnan(longitude)
+            LIMIT ?
+        """, [batch_size]).fetchnumpy()
+        if len(rows['id']) == 0:
+            return total
+        batch = {'id': rows['id'], 'spatial_cell': spatial_cells(rows['latitude'], rows['longitude'])}
+        conn.register('spatial_cell_batch', batch)
+        try:
+            conn.execute("""
+                UPDATE measurements SET spatial_cell = spatial_cell_batch.spatial_cell
+                FROM spatial_cell_batch WHERE measurements.id = spatial_cell_batch.id
+            """)
+        finally:
+            conn.unregister('spatial_cell_batch')
+        total += len(rows['id'])
+
 def fix_database_schema():
     db_path = "safecast.db"
     
@@ -42,6 +69,19 @@ def fix_database_schema():
         else:
             print("\u2713 altitude column already exists")
 
+        # spatial_cell column, filled in for existing measurements, and its index
+        if 'spatial_cell' not in columns:
+            print("Adding spatial_cell column to measurements table...")
+            conn.execute("ALTER TABLE measurements ADD COLUMN spatial_cell BIGINT")
+            print("\u2713 spatial_cell column added successfully")
+        else:
+            print("\u2713 spatial_cell column already exists")
+        backfilled = backfill_spatial_cells(conn)
+        if backfilled:
+            print(f"\u2713 spatial_cell computed for {backfilled} measurements")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_measurements_spatial_cell ON measurements (spatial_cell)")
+        print("\u2713 spatial_cell index exists")
+
         # Check current schema for users table
         result_users = conn.execute("DESCRIBE users").fetchall()
         user_columns = [row[0] for row in result_users]
@@ -55,6 +95,58 @@ def fix_database_schema():
             print("\u2713 name column added successfully")
         else:
             print("\u2713 name column already exists")
+
+        # Check current schema for bgeigie_imports table
+        result_imports = conn.execute("DESCRIBE bgeigie_imports").fetchall()
+        import_columns = [row[0] for row in result_imports]
+
+        # parse_report column on bgeigie_imports
+        if 'parse_report' not in import_columns:
+            print("Adding parse_report column to bgeigie_imports table...")
+            conn.execute("ALTER TABLE bgeigie_imports ADD COLUMN parse_report VARCHAR")
+            print("\u2713 parse_report column added successfully")
+        else:
+            print("\u2713 parse_report column already exists")
+
+        # archive_member column on bgeigie_imports (the log's name inside a .zip upload)
+        if 'archive_member' not in import_columns:
+            print("Adding archive_member column to bgeigie_imports table...")
+            conn.execute("ALTER TABLE bgeigie_imports ADD COLUMN archive_member VARCHAR")
+            print("\u2713 archive_member column added successfully")
+        else:
+            print("\u2713 archive_member column already exists")
+
+        # source_import_id column on bgeigie_imports (re-uploads sharing another import's measurements)
+        if 'source_import_id' not in import_columns:
+            print("Adding source_import_id column to bgeigie_imports table...")
+            conn.execute("ALTER TABLE bgeigie_imports ADD COLUMN source_import_id INTEGER")
+            print("\u2713 source_import_id column added successfully")
+        else:
+            print("\u2713 source_import_id column already exists")
+
+        # parsed_at column on bgeigie_imports; imports parsed before it existed count as parsed at upload
+        if 'parsed_at' not in import_columns:
+            print("Adding parsed_at column to bgeigie_imports table...")
+            conn.execute("ALTER TABLE bgeigie_imports ADD COLUMN parsed_at TIMESTAMP")
+            conn.execute("""
+                UPDATE bgeigie_imports SET parsed_at = created_at
+                WHERE parse_report IS NOT NULL OR measurements_count > 0
+            """)
+            print("\u2713 parsed_at column added successfully")
+        else:
+            print("\u2713 parsed_at column already exists")
+
+        # Scheduling columns on jobs (the table itself is created by the app on startup)
+        tables = [row[0] for row in conn.execute("SELECT table_name FROM duckdb_tables()").fetchall()]
+        if 'jobs' in tables:
+            job_columns = [row[0] for row in conn.execute("DESCRIBE jobs").fetchall()]
+            for column, column_type in (('priority', 'INTEGER DEFAULT 5'), ('claimed_at', 'TIMESTAMP')):
+                if column not in job_columns:
+                    print(f"Adding {column} column to jobs table...")
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+                    print(f"\u2713 {column} column added successfully")
+                else:
+                    print(f"\u2713 {column} column already exists")
         
         # Verify the change
         result = conn.execute("DESCRIBE measurements").fetchall()
@@ -11,7 +11,7 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import text
 
-from app.database import Base, SQLALCHEMY_DATABASE_URL
+from app.database import Base, SQLALCHEMY_DATABASE_URL, ensure_sequences
 from app.models import User
 from app.security import get_password_hash
 
@@ -51,17 +51,13 @@ def setup_admin_user():
             db_path = SQLALCHEMY_DATABASE_URL.split("///")[1]
             con = duckdb.connect(database=db_path, read_only=False)
             
-            # Get the next available ID
-            result = con.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM users").fetchone()
-            next_id = result[0]
-            
             # Extract name from email (part before @)
             name = email.split('@')[0]
             
             con.execute(
                 """INSERT INTO users (id, email, name, hashed_password, api_key, is_active, role)
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                (next_id, email, name, hashed_password, api_key, True, "admin"),
+                   VALUES (nextval('users_id_seq'), ?, ?, ?, ?, ?, ?)""",
+                (email, name, hashed_password, api_key, True, "admin"),
             )
             con.close()
             return  # Exit early since we already closed the db session
@@ -109,6 +105,10 @@ if __name__ == "__main__":
             auto_apprv_gps_validity BOOLEAN DEFAULT FALSE,
             auto_apprv_no_high_cpm BOOLEAN DEFAULT FALSE,
             auto_apprv_no_zero_cpm BOOLEAN DEFAULT FALSE,
+            parse_report VARCHAR,
+            archive_member VARCHAR,
+            source_import_id INTEGER,
+            parsed_at TIMESTAMP,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
         """,
@@ -118,11 +118,17 @@ if __name__ == "__main__":
             cpm INTEGER,
             latitude DOUBLE,
             longitude DOUBLE,
+            altitude DOUBLE,
             captured_at TIMESTAMP,
-            bgeigie_import_id INTEGER REFERENCES bgeigie_imports(id)
+            device_id INTEGER,
+            bgeigie_import_id INTEGER REFERENCES bgeigie_imports(id),
+            spatial_cell BIGINT
         );
         """,
         """
+        CREATE INDEX IF NOT EXISTS ix_measurements_spatial_cell ON measurements (spatial_cell);
+        """,
+        """
         CREATE TABLE IF NOT EXISTS devices (
             id INTEGER PRIMARY KEY,
             unit VARCHAR,
@@ -206,6 +212,53 @@ if __name__ == "__main__":
             id INTEGER PRIMARY KEY,
             user_id INTEGER REFERENCES users(id)
         );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS map_changes (
+            id INTEGER PRIMARY KEY,
+            bgeigie_import_id INTEGER,
+            lat_min DOUBLE,
+            lat_max DOUBLE,
+            lon_min DOUBLE,
+            lon_max DOUBLE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS grid_aggregates (
+            level INTEGER,
+            cell BIGINT,
+            cpm_sum BIGINT,
+            cpm_count BIGINT,
+            cpm_min INTEGER,
+            cpm_max INTEGER,
+            last_captured_at TIMESTAMP,
+            PRIMARY KEY (level, cell)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id VARCHAR PRIMARY KEY,
+            type VARCHAR,
+            data VARCHAR,
+            user_id INTEGER,
+            idempotency_key VARCHAR UNIQUE,
+            status VARCHAR,
+            priority INTEGER DEFAULT 5,
+            attempts INTEGER DEFAULT 0,
+            max_attempts INTEGER DEFAULT 5,
+            run_after TIMESTAMP,
+            lease_owner VARCHAR,
+            lease_expires_at TIMESTAMP,
+            progress VARCHAR,
+            insert_seconds DOUBLE DEFAULT 0,
+            result VARCHAR,
+            error VARCHAR,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            claimed_at TIMESTAMP,
+            completed_at TIMESTAMP
+        );
         """
     ]
 
@@ -213,6 +266,8 @@ if __name__ == "__main__":
         for statement in create_table_statements:
             connection.execute(text(statement))
         connection.commit()
+    # One id sequence per table, starting after any rows already present
+    ensure_sequences(engine)
     print("Database initialized.")
     
     setup_admin_user()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Pre-renders the map tiles of the low zoom levels into the tile cache.
+
+Usage: python seed_tiles.py [--min-zoom N] [--max-zoom N] [--mvt]
+
+Low zoom tiles each cover much of the measurements table and are slow to render on a
+first request; higher levels are rendered on demand by the API. Only tiles holding
+approved measurements are rendered, and tiles already cached at their current version are
+skipped, so running it again (e.g. after a batch of approvals) renders only what changed.
+
+Run it from the API's directory (TILE_CACHE_DIR is relative to it) while the API is
+stopped, or with SERVING_MODE=reader next to a writer process, to read its latest snapshot.
+"""
+import argparse
+import time
+
+from app import tiles
+from app.database import SessionLocal
+
+
+def seed(db, z: int, x: int, y: int, cache: tiles.TileCache, render, margin_pixels: int = 0) -> bool:
+    """Renders a tile into the cache unless its current version is there; returns whether it rendered."""
+    version = tiles.tile_version(db, z, x, y, margin_pixels)
+    if cache.get(z, x, y, version) is not None:
+        return False
+    cache.put(z, x, y, version, render(db, z, x, y))
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--min-zoom', type=int, default=0)
+    parser.add_argument('--max-zoom', type=int, default=6)
+    parser.add_argument('--mvt', action='store_true', help='seed the vector tiles as well as the heatmap')
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        for z in range(args.min_zoom, args.max_zoom + 1):
+            started = time.perf_counter()
+            occupied = tiles.occupied_tiles(db, z)
+            rendered = 0
+            for x, y in occupied:
+                rendered += seed(db, z, x, y, tiles.heatmap_cache, tiles.render_heatmap, tiles.HEAT_RADIUS_PIXELS)
+                if args.mvt:
+                    rendered += seed(db, z, x, y, tiles.mvt_cache, tiles.render_mvt)
+            print(f"zoom {z}: {len(occupied)} tiles with data, {rendered} rendered in {time.perf_counter() - started:.1f}s")
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+Fixtures for the API tests. They run the app in-process on a fresh safecast.db in a
+temporary directory, with import parsing on threads.
+"""
+import os
+import secrets
+import tempfile
+
+# The database and upload store are relative to the working directory, and settings are read at import
+os.chdir(tempfile.mkdtemp(prefix="safecast-tests-"))
+os.environ.setdefault("JOB_PARSE_EXECUTOR", "thread")
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import models
+from app.database import SessionLocal
+from app.main import app
+from app.security import create_access_token
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def make_user(client):
+    """Creates a user and returns the headers authenticating as them."""
+    def make_user(role: str = "user") -> dict:
+        db = SessionLocal()
+        try:
+            user = models.User(email=f"{secrets.token_hex(6)}@example.com", name="Test", hashed_password="x",
+                               api_key=secrets.token_urlsafe(16), is_active=True, role=role)
+            db.add(user)
+            db.commit()
+            return {"Authorization": f"Bearer {create_access_token({'sub': user.email})}"}
+        finally:
+            db.close()
+    return make_user
+
@@ -0,0 +1,30 @@
+"""Building blocks for test data."""
+import secrets
+import time
+
+from app.bgeigie_parser import calculate_checksum
+
+
+def bgeigie_line(cpm: int = 35, latitude: str = "3536.1000", longitude: str = "13944.2000",
+                 captured_at: str = "2024-11-22T07:17:00Z") -> str:
+    """A $BNRDD sentence with a valid checksum."""
+    sentence = f"$BNRDD,2299,{captured_at},{cpm},3,5036,A,{latitude},N,{longitude},E,12.00,A,9,124"
+    return f"{sentence}*{calculate_checksum(sentence)}"
+
+
+def log_bytes() -> bytes:
+    """A 50 line log; its first line is unique to it, so uploads from other tests never share its bytes."""
+    lines = [f"# {secrets.token_hex(8)}"] + [bgeigie_line(cpm=30 + i) for i in range(50)]
+    return ("\n".join(lines) + "\n").encode()
+
+
+def wait_for_job(client, headers, job_id: str) -> dict:
+    """Polls a job until it completed or died, or 30 seconds passed."""
+    deadline = time.time() + 30
+    while True:
+        response = client.get(f"/jobs/{job_id}", headers=headers)
+        assert response.status_code == 200
+        job = response.json()
+        if job["state"] in ("completed", "dead") or time.time() > deadline:
+            return job
+        time.sleep(0.05)
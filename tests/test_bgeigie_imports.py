@@ -0,0 +1,41 @@
+import threading
+
+from app import bgeigie_columnar
+from tests.helpers import log_bytes, wait_for_job
+
+
+def test_reupload_by_another_user_can_follow_the_parse_job(client, make_user, monkeypatch):
+    owner, other = make_user(), make_user()
+    log = log_bytes()
+    # Hold the parse until the second upload is in, so it finds the first one pending
+    release = threading.Event()
+    parse_column_range = bgeigie_columnar.parse_column_range
+
+    def held_parse(*args):
+        release.wait(30)
+        return parse_column_range(*args)
+    monkeypatch.setattr(bgeigie_columnar, "parse_column_range", held_parse)
+
+    first = client.post("/bgeigie-imports/", files={"file": ("drive.log", log)}, headers=owner).json()
+    second = client.post("/bgeigie-imports/", files={"file": ("copy.log", log)}, headers=other)
+    release.set()
+    assert second.status_code == 202
+    second = second.json()
+    assert second["id"] != first["id"]
+    assert second["job_id"] == first["job_id"]
+
+    # The re-uploader follows the original's job, without its result
+    job = wait_for_job(client, other, second["job_id"])
+    assert job["state"] == "completed"
+    assert job["result"] is None
+    assert wait_for_job(client, owner, first["job_id"])["result"] is not None
+
+    measurements = client.get(f"/bgeigie-imports/{second['id']}/measurements", headers=other).json()
+    assert measurements["total_count"] == 50
+
+
+def test_jobs_of_unrelated_users_stay_hidden(client, make_user):
+    owner, stranger = make_user(), make_user()
+    upload = client.post("/bgeigie-imports/", files={"file": ("drive.log", log_bytes())}, headers=owner).json()
+    assert client.get(f"/jobs/{upload['job_id']}", headers=stranger).status_code == 404
+    assert wait_for_job(client, owner, upload["job_id"])["state"] == "completed"
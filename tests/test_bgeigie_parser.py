@@ -0,0 +1,27 @@
+from app.bgeigie_columnar import parse_bgeigie_columns
+from app.bgeigie_parser import BAD_COORDINATES, ParseStats, decode_bgeigie_line, parse_bgeigie_log
+from tests.helpers import bgeigie_line
+
+
+def test_malformed_coordinate_drops_the_line():
+    measurement, reason = decode_bgeigie_line(bgeigie_line(latitude="35x6.1000"))
+    assert measurement is None
+    assert reason == BAD_COORDINATES
+
+
+def test_empty_coordinate_is_kept_at_zero():
+    measurement, reason = decode_bgeigie_line(bgeigie_line(latitude="", longitude=""))
+    assert reason is None
+    assert (measurement["latitude"], measurement["longitude"]) == (0.0, 0.0)
+
+
+def test_both_parsers_report_malformed_coordinates():
+    log = "\n".join([bgeigie_line(), bgeigie_line(longitude="13944"), bgeigie_line(cpm=40)]) + "\n"
+
+    stats = ParseStats()
+    assert [m["cpm"] for m in parse_bgeigie_log(log, stats)] == [35, 40]
+    assert stats.report.as_dict() == {"counts": {BAD_COORDINATES: 1}, "samples": {BAD_COORDINATES: [2]}}
+
+    stats = ParseStats()
+    assert parse_bgeigie_columns(log.encode(), stats)["cpm"].tolist() == [35, 40]
+    assert stats.report.as_dict() == {"counts": {BAD_COORDINATES: 1}, "samples": {BAD_COORDINATES: [2]}}
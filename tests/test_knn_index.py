@@ -0,0 +1,34 @@
+from sqlalchemy import text
+
+from app.database import SessionLocal
+from app.knn_index import MeasurementIndex
+from tests.helpers import log_bytes, wait_for_job
+
+
+def _measurement_ids(import_id: int) -> set:
+    db = SessionLocal()
+    try:
+        return set(db.execute(text("SELECT id FROM measurements WHERE bgeigie_import_id = :id"),
+                              {"id": import_id}).scalars())
+    finally:
+        db.close()
+
+
+def test_sync_picks_up_a_reparse_with_the_same_count(client, make_user):
+    owner, other, admin = make_user(), make_user(), make_user("admin")
+    log = log_bytes()
+    first = client.post("/bgeigie-imports/", files={"file": ("drive.log", log)}, headers=owner).json()
+    wait_for_job(client, owner, first["job_id"])
+    assert client.patch(f"/bgeigie-imports/{first['id']}/approve", headers=admin).status_code == 200
+    index = MeasurementIndex()
+    index.sync()
+    assert {i for i, _ in index.nearest(35.6017, 139.7367, 100)} == _measurement_ids(first["id"])
+
+    # A re-upload parsed again while the original stays approved: new measurement ids, same count
+    second = client.post("/bgeigie-imports/", files={"file": ("copy.log", log)}, headers=other).json()
+    job = client.patch(f"/bgeigie-imports/{second['id']}/process", headers=other).json()
+    assert wait_for_job(client, other, job["job_id"])["state"] == "completed"
+    index.sync()
+    nearest = {i for i, _ in index.nearest(35.6017, 139.7367, 100)}
+    assert len(nearest) == 50
+    assert nearest == _measurement_ids(first["id"])
@@ -0,0 +1,23 @@
+import duckdb
+
+from app.config import settings
+from app.snapshots import current_snapshot_path, publish_snapshot
+
+
+def test_snapshot_copies_tables_after_those_they_reference(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "SNAPSHOT_DIR", str(tmp_path / "snapshots"))
+    connection = duckdb.connect(str(tmp_path / "source.db"))
+    # Named so that name order would copy the referencing table first
+    connection.execute("CREATE TABLE users (id INTEGER PRIMARY KEY)")
+    connection.execute("CREATE TABLE bgeigie_imports (id INTEGER PRIMARY KEY, user_id INTEGER REFERENCES users (id))")
+    connection.execute("CREATE INDEX ix_bgeigie_imports_user_id ON bgeigie_imports (user_id)")
+    connection.execute("INSERT INTO users VALUES (1), (2)")
+    connection.execute("INSERT INTO bgeigie_imports VALUES (10, 1), (11, 2)")
+
+    path = publish_snapshot(connection)
+    connection.close()
+
+    assert current_snapshot_path() == path
+    snapshot = duckdb.connect(path, read_only=True)
+    assert snapshot.execute("SELECT id, user_id FROM bgeigie_imports ORDER BY id").fetchall() == [(10, 1), (11, 2)]
+    assert snapshot.execute("SELECT index_name FROM duckdb_indexes()").fetchall() == [("ix_bgeigie_imports_user_id",)]
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Checks that the grid_aggregates table equals a full recompute from the approved measurements.
+
+Usage: python verify_grid.py [--rebuild]
+
+Prints the cells that differ, if any, and exits with status 1. --rebuild recomputes the
+table instead: needed once after upgrading a database that has approved imports, and after
+changing grid_aggregates.GRID_LEVELS.
+
+Run it from the API's directory while the API is stopped, or with SERVING_MODE=reader next
+to a writer process to check its latest snapshot (--rebuild needs the writable database).
+"""
+import argparse
+import sys
+import time
+
+from app import grid_aggregates
+from app.database import SessionLocal, engine, setup_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rebuild', action='store_true', help='recompute the table from the approved measurements')
+    parser.add_argument('--show', type=int, default=20, help='differing cells to print')
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        if args.rebuild:
+            # The table is created on first start of the API; this may run before that
+            setup_database(engine)
+            cells = grid_aggregates.rebuild(db)
+            print(f"Rebuilt grid_aggregates: {cells} cells in {time.perf_counter() - started:.1f}s")
+            return
+        count, sample = grid_aggregates.differences(db, limit=args.show)
+        if not count:
+            print(f"grid_aggregates matches a full recompute ({time.perf_counter() - started:.1f}s)")
+            return
+        print(f"grid_aggregates differs from a full recompute in {count} cells:")
+        for level, cell, stored, recomputed in sample:
+            print(f"  level {level} cell {cell}: stored {stored}, recomputed {recomputed}")
+        print("Run python verify_grid.py --rebuild to recompute it.")
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()